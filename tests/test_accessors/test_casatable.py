@@ -1,8 +1,17 @@
 import os
+import shutil
+import tempfile
+import warnings
 
 import unittest
 
+import numpy
+from pyrap.images import image as pyrap_image
+from pyrap.tables import table as pyrap_table
+
 import tkp.accessors as accessors
+from tkp.accessors.casaimage import parse_data
+from tkp.utility.profiling import peak_rss
 from tkp.testutil.data import DATAPATH
 from tkp.testutil.decorators import requires_data
 
@@ -14,3 +23,49 @@ class TestLofarCasaImage(unittest.TestCase):
     # DataAccessor interface.
     def test_casaimage(self):
         self.assertRaises(IOError, accessors.open, casatable)
+
+
+class TestParseData(unittest.TestCase):
+    """
+    Reads single planes from a 4-Stokes cube, checking that the memory used
+    is that of a plane rather than of the whole cube.
+    """
+    shape = (1, 4, 1024, 1024)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, 'cube.image')
+        cls.cube = numpy.random.RandomState(0).normal(
+            size=cls.shape).astype(numpy.float32)
+        image = pyrap_image(cls.path, shape=cls.shape)
+        image.putdata(cls.cube)
+        del image
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def parse_data(self, plane, dtype=None):
+        table = pyrap_table(self.path, ack=False)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return parse_data(table, plane, dtype)
+
+    def test_planes(self):
+        for plane in range(4):
+            data = self.parse_data(plane)
+            self.assertEqual(data.shape, (1024, 1024))
+            numpy.testing.assert_array_equal(
+                data, self.cube[0, plane].transpose())
+
+    def test_dtype(self):
+        self.assertEqual(self.parse_data(1, numpy.float64).dtype,
+                         numpy.float64)
+
+    def test_memory(self):
+        # The peak memory use of the process only grows, so this is only an
+        # upper bound on the memory used to read the plane.
+        start = peak_rss()
+        data = self.parse_data(3)
+        self.assertTrue(peak_rss() - start < self.cube.nbytes / 2)
@@ -1,8 +1,12 @@
 import os
-
+import shutil
+import tempfile
 import unittest
 
+import pyfits
+
 
+from tkp.accessors import detection
 from tkp.accessors.detection import isfits, islofarhdf5, detect, iscasa
 from tkp.accessors.lofarcasaimage import LofarCasaImage
 from tkp.accessors.casaimage import CasaImage
@@ -56,3 +60,51 @@ class TestAutodetect(unittest.TestCase):
         self.assertEqual(accessor.__class__, LofarCasaImage)
         self.assertRaises(IOError, tkp.accessors.open, antennafile)
         self.assertRaises(IOError, tkp.accessors.open, 'doesntexists')
+
+
+class TestOpenCount(unittest.TestCase):
+    """
+    Counts the number of times a FITS file is opened by pyfits when opening
+    it with tkp.accessors.open(), as the persistence, quality, source
+    extraction and forced fitting steps each do for every image.
+    """
+    def setUp(self):
+        detection._detection_cache.clear()
+        self.opened = []
+        self.pyfits_open = pyfits.open
+        def counting_open(name, *args, **kwargs):
+            self.opened.append(name)
+            return self.pyfits_open(name, *args, **kwargs)
+        pyfits.open = counting_open
+
+    def tearDown(self):
+        pyfits.open = self.pyfits_open
+        detection._detection_cache.clear()
+
+    @requires_data(fitsfile)
+    def test_pipeline_run(self):
+        for step in ('persistence', 'quality', 'extraction', 'forced_fitting'):
+            accessor = tkp.accessors.open(fitsfile)
+            self.assertEqual(accessor.__class__, FitsImage)
+        self.assertEqual(self.opened, [fitsfile] * 4)
+
+    @requires_data(fitsfile)
+    def test_detection_cached(self):
+        self.assertEqual(detect(fitsfile), FitsImage)
+        self.assertEqual(detect(fitsfile), FitsImage)
+        self.assertEqual(self.opened, [fitsfile])
+
+    @requires_data(fitsfile)
+    def test_modified(self):
+        # A modified file is detected again.
+        tempdir = tempfile.mkdtemp()
+        try:
+            copy = os.path.join(tempdir, 'copy.fits')
+            shutil.copy(fitsfile, copy)
+            self.assertEqual(detect(copy), FitsImage)
+            stat = os.stat(copy)
+            os.utime(copy, (stat.st_atime, stat.st_mtime + 10))
+            self.assertEqual(detect(copy), FitsImage)
+            self.assertEqual(self.opened, [copy, copy])
+        finally:
+            shutil.rmtree(tempdir)
@@ -3,6 +3,8 @@ Tests for simulated LOFAR datasets.
 """
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from tkp.testutil.data import DATAPATH
@@ -13,6 +15,7 @@ from tkp.db.database import Database
 import tkp.db
 from tkp.testutil.decorators import requires_data
 from tkp.testutil.decorators import requires_database
+from tkp.testutil.images import write_cube
 
 
 
@@ -121,6 +124,39 @@ class DataBaseImage(unittest.TestCase):
                                                   extraction_radius=3)
 
 
+class LazyFitsImage(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check(self, shape, plane=None):
+        filename = os.path.join(self.tempdir, 'cube.fits')
+        write_cube(filename, shape)
+        eager = FitsImage(filename, plane=plane)
+        lazy = FitsImage(filename, plane=plane, lazy=True)
+        eager_metadata = eager.extract_metadata()
+        lazy_metadata = lazy.extract_metadata()
+        # Only the central region was read to calculate rms_qc.
+        self.assertTrue(lazy._data is None)
+        self.assertEqual(lazy_metadata, eager_metadata)
+        self.assertTrue((lazy.data == eager.data).all())
+
+    def test_plane(self):
+        self.check((1, 1, 128, 96))
+
+    def test_cube(self):
+        self.check((1, 3, 96, 128), plane=2)
+
+    def test_open(self):
+        filename = os.path.join(self.tempdir, 'image.fits')
+        write_cube(filename, (64, 64))
+        image = accessors.open(filename, lazy=True)
+        self.assertTrue(image._data is None)
+        self.assertEqual(image.data.shape, (64, 64))
+
+
 class FrequencyInformation(unittest.TestCase):
     @requires_data(os.path.join(DATAPATH, 'accessors/missing_metadata.fits'))
     def testFreqinfo(self):
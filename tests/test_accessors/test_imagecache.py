@@ -0,0 +1,127 @@
+"""
+Tests for the node-local cache of decoded images.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import tkp.accessors
+from tkp.accessors.imagecache import ImageCache
+from tkp.steps.misc import open_image
+from tkp.testutil.images import write_cube
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ImageCache(os.path.join(self.directory, "cache"))
+        self.image_path = os.path.join(self.directory, "image.fits")
+        write_cube(self.image_path, (1, 1, 128, 96))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertAccessorsEqual(self, first, second):
+        self.assertEqual(type(first), type(second))
+        numpy.testing.assert_array_equal(first.data, second.data)
+        self.assertEqual(first.data.dtype, second.data.dtype)
+        self.assertEqual(first.extract_metadata(), second.extract_metadata())
+        for attrname in ('crval', 'crpix', 'cdelt', 'ctype', 'cunit', 'crota'):
+            numpy.testing.assert_array_equal(
+                getattr(first.wcs, attrname), getattr(second.wcs, attrname))
+        self.assertEqual(first.wcs.p2s((10, 20)), second.wcs.p2s((10, 20)))
+
+    def test_reuse(self):
+        uncached = tkp.accessors.open(self.image_path)
+        self.assertAccessorsEqual(self.cache.open(self.image_path), uncached)
+        self.assertAccessorsEqual(self.cache.open(self.image_path), uncached)
+        # The data is stored in its own type.
+        native = tkp.accessors.open(self.image_path, dtype=numpy.float32)
+        key = self.cache.key(self.image_path)
+        second = self.cache.load(key)
+        self.assertAccessorsEqual(second, native)
+        self.assertTrue(isinstance(second.data, numpy.memmap))
+        # The cached data is copied on write, leaving the cache unchanged.
+        second.data[0, 0] = 1e6
+        self.assertAccessorsEqual(self.cache.load(key), native)
+
+    def test_lazy(self):
+        # Images opened lazily are read in part, so they aren't cached.
+        self.cache.open(self.image_path, lazy=True)
+        self.assertEqual(self.cache.load(self.cache.key(self.image_path)),
+                         None)
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_dtype(self):
+        # The image is stored once, whatever type it is asked for in, and
+        # converted on loading.
+        self.cache.open(self.image_path)
+        size = self.cache.size()
+        self.assertTrue(128 * 96 * 4 < size < 128 * 96 * 8)
+        single = self.cache.open(self.image_path, dtype=numpy.float32)
+        self.assertEqual(self.cache.size(), size)
+        self.assertEqual(single.data.dtype, numpy.float32)
+        # Data of the type it is stored in stays memory mapped.
+        self.assertTrue(isinstance(single.data, numpy.memmap))
+        double = self.cache.open(self.image_path)
+        self.assertEqual(double.data.dtype, numpy.float64)
+        self.assertFalse(isinstance(double.data, numpy.memmap))
+        numpy.testing.assert_array_equal(single.data, double.data)
+        self.assertEqual(self.cache.key(self.image_path),
+                         self.cache.key(self.image_path,
+                                        dtype=numpy.float32))
+
+    def test_modified(self):
+        self.cache.open(self.image_path)
+        key = self.cache.key(self.image_path)
+        status = os.stat(self.image_path)
+        os.utime(self.image_path, (status.st_atime, status.st_mtime + 10))
+        self.assertNotEqual(self.cache.key(self.image_path), key)
+        self.assertEqual(self.cache.load(self.cache.key(self.image_path)),
+                         None)
+
+    def test_evict(self):
+        self.cache.open(self.image_path)
+        size = self.cache.size()
+        self.assertTrue(size > 128 * 96 * 4)
+        other_path = os.path.join(self.directory, "other.fits")
+        write_cube(other_path, (1, 1, 128, 96))
+        self.cache.open(other_path)
+        self.assertTrue(self.cache.size() > size)
+        self.cache.max_size = size
+        self.cache.evict()
+        self.assertTrue(self.cache.size() <= size)
+
+    def test_corrupt(self):
+        self.cache.open(self.image_path)
+        key = self.cache.key(self.image_path)
+        with open(self.cache.path(key, ".meta"), 'w') as f:
+            f.write("garbage")
+        self.assertEqual(self.cache.load(key), None)
+
+
+class TestOpenImage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.directory, "image.fits")
+        write_cube(self.image_path, (64, 64))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disabled(self):
+        for config in (None, {'local_cache': False}):
+            accessor = open_image(self.image_path, config)
+            self.assertFalse(isinstance(accessor.data, numpy.memmap))
+
+    def test_enabled(self):
+        config = {'local_cache': True,
+                  'local_cache_dir': os.path.join(self.directory, 'cache'),
+                  'local_cache_size': 10}
+        first = open_image(self.image_path, config)
+        second = open_image(self.image_path, config)
+        self.assertTrue(isinstance(second.data, numpy.memmap))
+        numpy.testing.assert_array_equal(first.data, second.data)
@@ -39,6 +39,9 @@ options = AttributeDict({
     'skymodel': True,
     'csv': True,
     'force_beam': True,
+    'processes': 1,
+    'tile_memory': 0,
+    'float32': False,
     'alpha': .1,
     'detection_image': False,
     'mode': 'threshold'
@@ -0,0 +1,163 @@
+"""
+Tests for the background & RMS grids calculated by ImageData.
+
+ImageData calculates the grids for all the boxes of the image in parallel.
+Here we check that the results are the same as those obtained by clipping
+each box in turn, as the sourcefinder used to do, and that warm starting
+the clipping of some boxes from their neighbours gives nearly the same.
+"""
+import logging
+
+import numpy
+from numpy.testing import assert_array_equal, assert_allclose
+
+import unittest
+
+from tkp.sourcefinder import stats
+from tkp.sourcefinder.image import ImageData, background_grids
+from tkp.testutil import Timer
+from tkp.testutil.decorators import duration
+from tkp.testutil.images import beam, noise_with_sources
+try:
+    import ndimage
+except ImportError:
+    from scipy import ndimage
+
+
+logger = logging.getLogger(__name__)
+
+
+def grids_per_box(imagedata):
+    """
+    Reference implementation: loop over the boxes, clipping each in turn.
+    """
+    useful_chunk = ndimage.find_objects(numpy.where(imagedata.data.mask, 0, 1))
+    useful_data = imagedata.data[useful_chunk[0]]
+    my_xdim, my_ydim = useful_data.shape
+
+    rmsgrid, bggrid = [], []
+    for startx in xrange(0, my_xdim, imagedata.back_size_x):
+        rmsrow, bgrow = [], []
+        for starty in xrange(0, my_ydim, imagedata.back_size_y):
+            chunk = useful_data[
+                startx:startx + imagedata.back_size_x,
+                starty:starty + imagedata.back_size_y
+            ].ravel()
+            if not chunk.any():
+                rmsrow.append(False)
+                bgrow.append(False)
+                continue
+            chunk, sigma, median, num_clip_its = stats.sigma_clip(
+                chunk, imagedata.beam)
+            if len(chunk) == 0 or not chunk.any():
+                rmsrow.append(False)
+                bgrow.append(False)
+            else:
+                mean = numpy.mean(chunk)
+                rmsrow.append(sigma)
+                if numpy.fabs(mean - median) / sigma >= 0.3:
+                    bgrow.append(median)
+                else:
+                    bgrow.append(2.5 * median - 1.5 * mean)
+        rmsgrid.append(rmsrow)
+        bggrid.append(bgrow)
+
+    rmsgrid = numpy.ma.array(
+        rmsgrid, mask=numpy.where(numpy.array(rmsgrid) == False, 1, 0))
+    bggrid = numpy.ma.array(
+        bggrid, mask=numpy.where(numpy.array(bggrid) == False, 1, 0))
+    return {'rms': rmsgrid, 'bg': bggrid}
+
+
+class TestBackgroundGrids(unittest.TestCase):
+    def assertGridsEqual(self, imagedata):
+        expected = grids_per_box(imagedata)
+        cold = background_grids(
+            imagedata.data[imagedata.useful_chunk], imagedata.beam,
+            imagedata.back_size_x, imagedata.back_size_y, warm_start=False)
+        for key, grid in zip(('rms', 'bg'), cold):
+            self.assertEqual(grid.shape, expected[key].shape)
+            assert_allclose(grid, expected[key].filled(0), rtol=1e-10, atol=0)
+
+        # Warm starts agree with cold starts within the noise of the grids.
+        result = imagedata.grids
+        for key in ('rms', 'bg'):
+            self.assertEqual(result[key].shape, expected[key].shape)
+            assert_array_equal(numpy.ma.getmaskarray(result[key]),
+                               numpy.ma.getmaskarray(expected[key]))
+        rms = expected['rms'].filled(0)
+        assert_allclose(result['rms'].filled(0), rms, rtol=5e-2, atol=0)
+        self.assertTrue((abs(result['bg'].filled(0) - expected['bg'].filled(0))
+                         <= 0.1 * rms).all())
+
+    def test_noise(self):
+        data = numpy.random.RandomState(1).normal(0, 1, (200, 200))
+        self.assertGridsEqual(ImageData(data, beam, None))
+
+    def test_sources(self):
+        # Some boxes will be skewed by the sources
+        data = noise_with_sources((256, 256), 60, background=1.0,
+                                  border=0)
+        self.assertGridsEqual(ImageData(data, beam, None))
+
+    def test_partial_boxes(self):
+        # Boxes along the upper edges are smaller than the others
+        data = noise_with_sources((211, 173), 20, background=1.0,
+                                  border=0)
+        self.assertGridsEqual(
+            ImageData(data, beam, None, back_size_x=30, back_size_y=47))
+
+    def test_masked(self):
+        # Margin, radius and bad pixels are all excluded
+        data = noise_with_sources((256, 256), 30, background=1.0,
+                                  border=0)
+        data[100:120, 30:60] = numpy.nan
+        data[10:200, 150:152] = 0
+        # Some boxes will be left with too few pixels after masking
+        self.assertGridsEqual(ImageData(data, beam, None, margin=10,
+                                        radius=115, back_size_x=40,
+                                        back_size_y=40))
+
+    def test_empty_boxes(self):
+        # A box which is entirely zero (and hence masked)
+        data = noise_with_sources((128, 128), 5, background=1.0,
+                                  border=0)
+        data[:32, :32] = 0
+        imagedata = ImageData(data, beam, None)
+        self.assertGridsEqual(imagedata)
+        self.assertTrue(imagedata.grids['rms'].mask[0, 0])
+        self.assertTrue(imagedata.grids['bg'].mask[0, 0])
+
+    def test_constant_boxes(self):
+        data = noise_with_sources((128, 128), 5, background=1.0,
+                                  border=0)
+        data[32:64, 32:64] = 5.0
+        self.assertGridsEqual(ImageData(data, beam, None))
+
+
+class TestBackgroundGridsBenchmark(unittest.TestCase):
+    @duration(60)
+    def test_benchmark(self):
+        data = noise_with_sources((2048, 2048), 1000, background=1.0,
+                                  border=0)
+        imagedata = ImageData(data, beam, None, back_size_x=50,
+                              back_size_y=50)
+        imagedata.data
+
+        with Timer() as per_box:
+            expected = grids_per_box(imagedata)
+        with Timer() as vectorized:
+            result = imagedata.grids
+
+        logger.info("Background grids for %s image: %.2fs per box, "
+                    "%.2fs vectorized", data.shape, per_box.elapsed,
+                    vectorized.elapsed)
+        assert_array_equal(result['rms'].mask, expected['rms'].mask)
+        rms = expected['rms'].filled(0)
+        assert_allclose(result['rms'].filled(0), rms, rtol=5e-2)
+        self.assertTrue((abs(result['bg'].filled(0) - expected['bg'].filled(0))
+                         <= 0.1 * rms).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
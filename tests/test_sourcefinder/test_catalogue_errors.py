@@ -0,0 +1,525 @@
+"""
+Tests for calculating the errors and deconvolved shapes of many sources at
+once.
+"""
+import copy
+from math import sin, cos, atan, sqrt, pi
+
+import numpy
+from numpy.testing import assert_allclose
+import unittest
+
+from tkp.sourcefinder import extract
+from tkp.sourcefinder import utils
+from tkp.sourcefinder.deconv import deconv_array
+from tkp.utility.uncertain import Uncertain
+
+
+# Pairs of (argument), (result) tuples calculated by deconv.f from classic
+# AIPS, as in test_deconv.
+KNOWN_GOOD = [
+    ((1, 1, 0, 1, 1, 0), (0.0, 0.0, 0.0, 0)),
+    ((1, 1, 0, 1, 1, 90), (0.0, 0.0, 0.0, 0)),
+    ((2., 2., 0, 1, 1, 0), (1.7320508075688772, 1.7320508075688772, 0.0, 0)),
+    ((2., 2., 0, 1, 1, 45), (1.7320508075688772, 1.7320508075688772, 45.0, 0)),
+    ((2.7, 1.7, 0, 1, 1, 45), (2.507987241303295, 1.3747727075629217, 0.0, 0)),
+    ((2.7, 1.7, 20, 1, 1, 180), (2.507987240796891, 1.3747727084867518, 20.0, 0)),
+    ((2.7, 1.7, 30, 1, 1, 90), (2.507987240796891, 1.3747727084867516, 30.0, 0)),
+]
+
+
+def get_paramset():
+    """The ParamSet of test_errors"""
+    paramset = extract.ParamSet()
+    paramset.sig = 1
+    paramset.values = {
+        'peak': Uncertain(10, 0),
+        'flux': Uncertain(10, 0),
+        'semimajor': Uncertain(10, 1),
+        'semiminor': Uncertain(10, 1),
+        'theta': Uncertain(0, 1),
+        'semimaj_deconv': Uncertain(10, 1),
+        'semimin_deconv': Uncertain(10, 1),
+        'theta_deconv': Uncertain(10, 1),
+        'xbar': Uncertain(10, 1),
+        'ybar': Uncertain(10, 1)
+    }
+    return paramset
+
+
+def legacy_deconv(fmaj, fmin, fpa, cmaj, cmin, cpa):
+    """The former deconv(), with the math module."""
+    HALF_RAD = 90.0 / pi
+    cmaj2 = cmaj * cmaj
+    cmin2 = cmin * cmin
+    fmaj2 = fmaj * fmaj
+    fmin2 = fmin * fmin
+    theta = (fpa - cpa) / HALF_RAD
+    det = ((fmaj2 + fmin2) - (cmaj2 + cmin2)) / 2.0
+    rhoc = (fmaj2 - fmin2) * cos(theta) - (cmaj2 - cmin2)
+    sigic2 = 0.0
+    rhoa = 0.0
+    ierr = 0
+
+    if abs(rhoc) > 0.0:
+        sigic2 = atan((fmaj2 - fmin2) * sin(theta) / rhoc)
+        rhoa = (((cmaj2 - cmin2) - (fmaj2 - fmin2) * cos(theta)) /
+                (2.0 * cos(sigic2)))
+
+    rpa = sigic2 * HALF_RAD + cpa
+    rmaj = det - rhoa
+    rmin = det + rhoa
+
+    if rmaj < 0:
+        ierr += 1
+        rmaj = 0
+    if rmin < 0:
+        ierr += 1
+        rmin = 0
+
+    rmaj = sqrt(rmaj)
+    rmin = sqrt(rmin)
+    if rmaj < rmin:
+        rmaj, rmin = rmin, rmaj
+        rpa += 90
+
+    rpa = (rpa + 900) % 180
+    if not abs(rmaj):
+        rpa = 0.0
+    elif not abs(rmin) and (45.0 < abs(rpa-fpa) < 135.0):
+        rpa = (rpa + 450.0) % 180.0
+
+    return rmaj, rmin, rpa, ierr
+
+
+def legacy_condon_formulae(self, noise, beam):
+    """The former ParamSet._condon_formulae()"""
+    peak = self['peak'].value
+    flux = self['flux'].value
+    smaj = self['semimajor'].value
+    smin = self['semiminor'].value
+    theta = self['theta'].value
+
+    theta_B, theta_b = utils.calculate_correlation_lengths(
+        beam[0], beam[1])
+
+    rho_sq1 = ((smaj*smin/(theta_B*theta_b)) *
+               (1.+(theta_B/(2.*smaj))**2)**self.alpha_maj1 *
+               (1.+(theta_b/(2.*smin))**2)**self.alpha_min1 *
+               (peak/noise)**2)
+    rho_sq2 = ((smaj*smin/(theta_B*theta_b)) *
+               (1.+(theta_B/(2.*smaj))**2)**self.alpha_maj2 *
+               (1.+(theta_b/(2.*smin))**2)**self.alpha_min2 *
+               (peak/noise)**2)
+    rho_sq3 = ((smaj*smin/(theta_B*theta_b)) *
+               (1.+(theta_B/(2.*smaj))**2)**self.alpha_maj3 *
+               (1.+(theta_b/(2.*smin))**2)**self.alpha_min3 *
+               (peak/noise)**2)
+
+    rho1 = numpy.sqrt(rho_sq1)
+    rho2 = numpy.sqrt(rho_sq2)
+    rho3 = numpy.sqrt(rho_sq3)
+
+    denom1 = numpy.sqrt(2.*numpy.log(2.)) * rho1
+    denom2 = numpy.sqrt(2.*numpy.log(2.)) * rho2
+
+    # Here you get the errors parallel to the fitted semi-major and
+    # semi-minor axes as taken from the NVSS paper (Condon et al. 1998,
+    # AJ, 115, 1693), formula 25.
+    # Those variances are twice the theoreticals, so the errors in
+    # position are sqrt(2) as large as one would get from formula 21
+    # of the Condon (1997) paper.
+    error_par_major = 2.*smaj/denom1
+    error_par_minor = 2.*smin/denom2
+
+    # When these errors are converted to RA and Dec,
+    # calibration uncertainties will have to be added,
+    # like in formulae 27 of the NVSS paper.
+    errorx = numpy.sqrt((error_par_major * numpy.sin(theta))**2 +
+                        (error_par_minor * numpy.cos(theta))**2)
+    errory = numpy.sqrt((error_par_major * numpy.cos(theta))**2 +
+                        (error_par_minor * numpy.sin(theta))**2)
+
+    # Note that we report errors in HWHM axes instead of FWHM axes
+    # so the errors are half the errors of formula 29 of the NVSS paper.
+    errorsmaj = numpy.sqrt(2) * smaj / rho1
+    errorsmin = numpy.sqrt(2) * smin / rho2
+
+    if smaj > smin:
+        errortheta = 2.0 * (smaj*smin/(smaj**2-smin**2))/rho2
+    else:
+        errortheta = numpy.pi
+    if errortheta > numpy.pi:
+        errortheta = numpy.pi
+
+    peak += -noise**2/peak + self.clean_bias
+
+    errorpeaksq = ((self.frac_flux_cal_error * peak)**2 +
+                   self.clean_bias_error**2 +
+                   2. * peak**2 / rho_sq3)
+
+    errorpeak = numpy.sqrt(errorpeaksq)
+
+    help1 = (errorsmaj/smaj)**2
+    help2 = (errorsmin/smin)**2
+    help3 = theta_B * theta_b / (4. * smaj * smin)
+    errorflux = numpy.abs(flux)*numpy.sqrt(errorpeaksq/peak**2+help3*(help1+help2))
+
+    self['peak'] = Uncertain(peak, errorpeak)
+    self['flux'].error = errorflux
+    self['xbar'].error = errorx
+    self['ybar'].error = errory
+    self['semimajor'].error = errorsmaj
+    self['semiminor'].error = errorsmin
+    self['theta'].error = errortheta
+
+    return self
+
+def legacy_error_bars_from_moments(self, noise, beam, threshold):
+    """The former ParamSet._error_bars_from_moments()"""
+
+    # The formulae below should give some reasonable estimate of the
+    # errors from moments, should always be higher than the errors from
+    # Gauss fitting.
+    peak = self['peak'].value
+    flux = self['flux'].value
+    smaj = self['semimajor'].value
+    smin = self['semiminor'].value
+    theta = self['theta'].value
+
+    # This analysis is only possible if the peak flux is >= 0. This
+    # follows from the definition of eq. 2.81 in Spreeuw's thesis. In that
+    # situation, we set all errors to be infinite
+    if peak < 0:
+        self['peak'].error = float('inf')
+        self['flux'].error = float('inf')
+        self['semimajor'].error = float('inf')
+        self['semiminor'].error = float('inf')
+        self['theta'].error = float('inf')
+        return self
+
+    clean_bias_error = self.clean_bias_error
+    frac_flux_cal_error = self.frac_flux_cal_error
+    theta_B, theta_b = utils.calculate_correlation_lengths(
+        beam[0], beam[1])
+
+    # This is eq. 2.81 from Spreeuw's thesis.
+    rho_sq = ((16. * smaj * smin /
+              (numpy.log(2.) * theta_B * theta_b*noise**2))
+              * ((peak - threshold) /
+                 (numpy.log(peak) - numpy.log(threshold)))**2)
+
+    rho = numpy.sqrt(rho_sq)
+    denom = numpy.sqrt(2.*numpy.log(2.))*rho
+
+    # Again, like above for the Condon formulae, we set the
+    # positional variances to twice the theoretical values.
+    error_par_major = 2. * smaj / denom
+    error_par_minor = 2. * smin / denom
+
+    # When these errors are converted to RA and Dec,
+    # calibration uncertainties will have to be added,
+    # like in formulae 27 of the NVSS paper.
+    errorx = numpy.sqrt((error_par_major * numpy.sin(theta))**2
+                        + (error_par_minor * numpy.cos(theta))**2)
+    errory = numpy.sqrt((error_par_major * numpy.cos(theta))**2
+                        + (error_par_minor * numpy.sin(theta))**2)
+
+    # Note that we report errors in HWHM axes instead of FWHM axes
+    # so the errors are half the errors of formula 29 of the NVSS paper.
+    errorsmaj = numpy.sqrt(2) * smaj / rho
+    errorsmin = numpy.sqrt(2) * smin / rho
+
+    if smaj > smin:
+        errortheta = 2.0 * (smaj * smin / (smaj**2 -smin**2)) / rho
+    else:
+        errortheta = numpy.pi
+    if errortheta > numpy.pi:
+        errortheta = numpy.pi
+
+    # The peak from "moments" is just the value of the maximum pixel
+    # times a correction, fudge_max_pix, for the fact that the
+    # centre of the Gaussian is not at the centre of the pixel.
+    # This correction is performed in fitting.py. The maximum pixel
+    # method introduces a peak dependent error corresponding to the last
+    # term in the expression below for errorpeaksq.
+    # To this, we add, in quadrature, the errors corresponding
+    # to the first and last term of the rhs of equation 37 of the
+    # NVSS paper. The middle term in that equation 37 is heuristically
+    # replaced by noise**2 since the threshold should not affect
+    # the error from the (corrected) maximum pixel method,
+    # while it is part of the expression for rho_sq above.
+    errorpeaksq = ((frac_flux_cal_error*peak)**2 +
+                   clean_bias_error**2+noise**2 +
+                   utils.maximum_pixel_method_variance(
+        beam[0], beam[1], beam[2])*peak**2)
+    errorpeak = numpy.sqrt(errorpeaksq)
+
+    help1 = (errorsmaj/smaj)**2
+    help2 = (errorsmin/smin)**2
+    help3 = theta_B*theta_b/(4.*smaj*smin)
+    errorflux = flux*numpy.sqrt(errorpeaksq/peak**2+help3*(help1+help2))
+
+    self['peak'].error = errorpeak
+    self['flux'].error = errorflux
+    self['xbar'].error = errorx
+    self['ybar'].error = errory
+    self['semimajor'].error = errorsmaj
+    self['semiminor'].error = errorsmin
+    self['theta'].error = errortheta
+
+    return self
+
+def legacy_deconvolve_from_clean_beam(self, beam):
+    """The former ParamSet.deconvolve_from_clean_beam()"""
+
+    # If the fitted axes are smaller than the clean beam
+    # (=restoring beam) axes, the axes and position angle
+    # can be deconvolved from it.
+    fmaj = 2.*self['semimajor'].value
+    fmajerror = 2.*self['semimajor'].error
+    fmin = 2.*self['semiminor'].value
+    fminerror = 2.*self['semiminor'].error
+    fpa = numpy.degrees(self['theta'].value)
+    fpaerror = numpy.degrees(self['theta'].error)
+    cmaj = 2.*beam[0]
+    cmin = 2.*beam[1]
+    cpa = numpy.degrees(beam[2])
+
+    rmaj, rmin, rpa, ierr = legacy_deconv(fmaj, fmin, fpa, cmaj, cmin, cpa)
+    # This parameter gives the number of components that could not be
+    # deconvolved, IERR from deconf.f.
+    self.deconv_imposs = ierr
+    # Now, figure out the error bars.
+    if rmaj > 0:
+        # In this case the deconvolved position angle is defined.
+        # For convenience we reset rpa to the interval [-90, 90].
+        if rpa > 90:
+            rpa = -numpy.mod(-rpa, 180.)
+        self['theta_deconv'].value = rpa
+
+        # In the general case, where the restoring beam is elliptic,
+        # calculating the error bars of the deconvolved position angle
+        # is more complicated than in the NVSS case, where a circular
+        # restoring beam was used.
+        # In the NVSS case the error bars of the deconvolved angle are
+        # equal to the fitted angle.
+        rmaj1, rmin1, rpa1, ierr1 = legacy_deconv(
+            fmaj, fmin, fpa+fpaerror, cmaj, cmin, cpa)
+        if ierr1 < 2:
+            if rpa1 > 90:
+                rpa1 = -numpy.mod(-rpa1, 180.)
+            rpaerror1 = numpy.abs(rpa1-rpa)
+            # An angle error can never be more than 90 degrees.
+            if rpaerror1 > 90.:
+                rpaerror1 = numpy.mod(-rpaerror1, 180.)
+        else:
+            rpaerror1 = numpy.nan
+        rmaj2, rmin2, rpa2, ierr2 = legacy_deconv(
+            fmaj, fmin, fpa-fpaerror, cmaj, cmin, cpa)
+        if ierr2 < 2:
+            if rpa2 > 90:
+                rpa2 = -numpy.mod(-rpa2, 180.)
+            rpaerror2 = numpy.abs(rpa2 - rpa)
+            # An angle error can never be more than 90 degrees.
+            if rpaerror2 > 90.:
+                rpaerror2 = numpy.mod(-rpaerror2, 180.)
+        else:
+            rpaerror2 = numpy.nan
+        if numpy.isnan(rpaerror1) or numpy.isnan(rpaerror2):
+            self['theta_deconv'].error = numpy.nansum(
+                [rpaerror1, rpaerror2])
+        else:
+            self['theta_deconv'].error = numpy.mean(
+                [rpaerror1, rpaerror2])
+        self['semimaj_deconv'].value = rmaj / 2.
+        rmaj3, rmin3, rpa3, ierr3 = legacy_deconv(
+            fmaj + fmajerror, fmin, fpa, cmaj, cmin, cpa)
+        # If rmaj>0, then rmaj3 should also be > 0,
+        # if I am not mistaken, see the formulas at
+        # the end of ch.2 of Spreeuw's Ph.D. thesis.
+        if fmaj-fmajerror > fmin:
+            rmaj4, rmin4, rpa4, ierr4 = legacy_deconv(
+                fmaj-fmajerror, fmin, fpa, cmaj, cmin, cpa)
+            if rmaj4 > 0:
+                self['semimaj_deconv'].error = numpy.mean(
+                    [numpy.abs(rmaj3-rmaj), numpy.abs(rmaj - rmaj4)])
+            else:
+                self['semimaj_deconv'].error = numpy.abs(rmaj3 - rmaj)
+        else:
+            rmin4, rmaj4, rpa4, ierr4 = legacy_deconv(
+                fmin, fmaj - fmajerror, fpa, cmaj, cmin, cpa)
+            if rmaj4>0:
+                self['semimaj_deconv'].error = numpy.mean(
+                    [numpy.abs(rmaj3-rmaj), numpy.abs(rmaj - rmaj4)])
+            else:
+                self['semimaj_deconv'].error = numpy.abs(rmaj3 - rmaj)
+        if rmin > 0:
+            self['semimin_deconv'].value = rmin / 2.
+            if fmin + fminerror < fmaj:
+                rmaj5, rmin5, rpa5, ierr5 = legacy_deconv(
+                    fmaj, fmin+fminerror, fpa, cmaj, cmin, cpa)
+            else:
+                rmin5, rmaj5, rpa5, ierr5 = legacy_deconv(
+                    fmin+fminerror, fmaj, fpa, cmaj, cmin, cpa)
+            # If rmin > 0, then rmin5 should also be > 0,
+            # if I am not mistaken, see the formulas at
+            # the end of ch.2 of Spreeuw's Ph.D. thesis.
+            rmaj6, rmin6, rpa6, ierr6 = legacy_deconv(
+                fmaj, fmin-fminerror, fpa, cmaj, cmin, cpa)
+            if rmin6 > 0:
+                self['semimin_deconv'].error = numpy.mean(
+                    [numpy.abs(rmin6-rmin), numpy.abs(rmin5 - rmin)])
+            else:
+                self['semimin_deconv'].error = numpy.abs(rmin5 - rmin)
+        else:
+            self['semimin_deconv'] = Uncertain(
+                numpy.nan, numpy.nan)
+    else:
+        self['semimaj_deconv'] = Uncertain(numpy.nan, numpy.nan)
+        self['semimin_deconv'] = Uncertain(numpy.nan, numpy.nan)
+        self['theta_deconv'] = Uncertain(numpy.nan, numpy.nan)
+
+    return self
+
+
+def random_params(number, seed=0):
+    """ParamSets of all sorts of shapes, from Gaussian fits and moments"""
+    random = numpy.random.RandomState(seed)
+    params = []
+    for index in range(number):
+        param = extract.ParamSet()
+        smaj, smin = random.uniform(0.5, 8, 2)
+        if index % 7 == 0:
+            smin = smaj
+        elif index % 3 == 0:
+            smaj, smin = max(smaj, smin), min(smaj, smin)
+        param.update({
+            'peak': random.uniform(-1, 20),
+            'xbar': random.uniform(0, 100),
+            'ybar': random.uniform(0, 100),
+            'semimajor': smaj,
+            'semiminor': smin,
+            'theta': random.uniform(-numpy.pi / 2, numpy.pi / 2),
+        })
+        param['flux'] = param['peak'].value * smaj * smin
+        param.gaussian = index % 2 == 0
+        param.moments = index % 5 != 0
+        params.append(param)
+    return params
+
+
+class TestCatalogueErrors(unittest.TestCase):
+    beam = (2.5, 1.5, 0.3)
+
+    def assertSameParams(self, params, expected):
+        for param, expected_param in zip(params, expected):
+            self.assertEqual(param.deconv_imposs, expected_param.deconv_imposs)
+            for name in expected_param.keys():
+                for attr in ('value', 'error'):
+                    assert_allclose(getattr(param[name], attr),
+                                    getattr(expected_param[name], attr),
+                                    rtol=1e-12, err_msg=name)
+
+    def legacy_errors(self, params, noise, threshold):
+        """
+        Apply the former methods to each ParamSet, and return those which
+        couldn't be deconvolved.
+        """
+        failed = []
+        for param, noise, threshold in zip(params, noise, threshold):
+            if param.gaussian:
+                legacy_condon_formulae(param, noise, self.beam)
+            elif param.moments:
+                legacy_error_bars_from_moments(param, noise, self.beam,
+                                               threshold or 0)
+            try:
+                legacy_deconvolve_from_clean_beam(param, self.beam)
+            except ValueError:
+                failed.append(param)
+        return failed
+
+    def test_same_as_one_by_one(self):
+        params = random_params(1000)
+        expected = copy.deepcopy(params)
+        noise = numpy.random.RandomState(1).uniform(0.1, 2, len(params))
+        threshold = [None if index % 4 == 0 else 3 * value
+                     for index, value in enumerate(noise)]
+        failed = self.legacy_errors(expected, noise, threshold)
+        extract.calculate_all_errors(params, noise, self.beam, threshold)
+        # Moments with a negative peak can't be deconvolved.
+        self.assertTrue(len(failed) > 10)
+        self.assertRaises(ValueError, extract.deconvolve_all, params,
+                          self.beam)
+        deconvolved = [param for param, expected_param in zip(params, expected)
+                       if expected_param not in failed]
+        self.assertEqual(len(deconvolved), len(params) - len(failed))
+        extract.deconvolve_all(deconvolved, self.beam)
+        self.assertSameParams(deconvolved, [param for param in expected
+                                            if param not in failed])
+        # Every branch of the deconvolution has been taken.
+        self.assertEqual(set(param.deconv_imposs for param in deconvolved),
+                         set([0, 1, 2]))
+
+    def test_paramset_methods(self):
+        # The methods of a ParamSet work on it alone.
+        for param in random_params(200, seed=2):
+            expected = copy.deepcopy(param)
+            if self.legacy_errors([expected], [0.5], [1.5]):
+                param.calculate_errors(0.5, self.beam, 1.5)
+                self.assertRaises(ValueError,
+                                  param.deconvolve_from_clean_beam, self.beam)
+                continue
+            param.calculate_errors(0.5, self.beam, 1.5)
+            param.deconvolve_from_clean_beam(self.beam)
+            self.assertSameParams([param], [expected])
+
+    def test_test_errors(self):
+        for peak in (10, -10):
+            for method, legacy, args in (
+                    ('_condon_formulae', legacy_condon_formulae, ()),
+                    ('_error_bars_from_moments',
+                     legacy_error_bars_from_moments, (3.0,))):
+                param, expected = get_paramset(), get_paramset()
+                for p in (param, expected):
+                    p['peak'] *= numpy.sign(peak)
+                    p['flux'] *= numpy.sign(peak)
+                getattr(param, method)(1.0, (1.0, 1.0, 0.0), *args)
+                legacy(expected, 1.0, (1.0, 1.0, 0.0), *args)
+                self.assertSameParams([param], [expected])
+
+    def test_constants(self):
+        # Each ParamSet may have constants of its own.
+        params = random_params(20)
+        for index, param in enumerate(params):
+            param.gaussian = True
+            param.clean_bias_error = 0.01 * index
+            param.alpha_maj1 = 1 + 0.1 * index
+        expected = copy.deepcopy(params)
+        self.legacy_errors(expected, [1.0] * 20, [None] * 20)
+        extract.calculate_all_errors(params, 1.0, self.beam, None)
+        extract.deconvolve_all(params, self.beam)
+        self.assertSameParams(params, expected)
+
+    def test_empty(self):
+        extract.calculate_all_errors([], [], self.beam, [])
+        extract.deconvolve_all([], self.beam)
+
+    def test_deconv_array(self):
+        args, results = zip(*KNOWN_GOOD)
+        for column, expected in zip(deconv_array(*zip(*args)), zip(*results)):
+            assert_allclose(column, expected, atol=1e-7)
+        random = numpy.random.RandomState(3)
+        args = numpy.concatenate((random.uniform(0.5, 10, (4, 1000)),
+                                  random.uniform(-180, 180, (1, 1000))))
+        fmaj, fmin, cmaj, cmin, fpa = args
+        columns = deconv_array(fmaj, fmin, fpa, cmaj, cmin, 30.)
+        for index in range(1000):
+            assert_allclose(
+                [column[index] for column in columns],
+                legacy_deconv(fmaj[index], fmin[index], fpa[index],
+                              cmaj[index], cmin[index], 30.), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
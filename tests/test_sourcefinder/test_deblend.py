@@ -0,0 +1,135 @@
+"""
+Tests for deblending islands using their threshold tree.
+"""
+import numpy
+import unittest
+try:
+    import ndimage
+except ImportError:
+    from scipy import ndimage
+
+from tkp.sourcefinder import extract
+from tkp.sourcefinder import utils
+from tkp.sourcefinder.image import ImageData
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+from tkp.testutil.sourcefinder import islands
+
+
+def recursive_deblend(island, niter=0):
+    """
+    The former implementation of Island.deblend(), which labels the island
+    afresh at every subthreshold and recurses into each split.
+    """
+    for level in island.subthrrange[niter:]:
+        if level > island.data.max():
+            break
+        clipped_data = numpy.where(
+            island.data.filled(fill_value=0) >= level, 1, 0)
+        labels, number = ndimage.label(clipped_data,
+                                       island.structuring_element)
+        if number > 1:
+            subislands = []
+            label = 0
+            for chunk in ndimage.find_objects(labels):
+                label += 1
+                newdata = numpy.where(
+                    labels == label,
+                    island.data.filled(fill_value=-extract.BIGNUM),
+                    -extract.BIGNUM)
+                subislands.append(extract.Island(
+                    newdata[chunk],
+                    numpy.ones(island.data[chunk].shape) * level,
+                    (slice(island.chunk[0].start + chunk[0].start,
+                           island.chunk[0].start + chunk[0].stop),
+                     slice(island.chunk[1].start + chunk[1].start,
+                           island.chunk[1].start + chunk[1].stop)),
+                    1, island.detection_map[chunk], island.beam,
+                    island.deblend_nthresh, island.deblend_mincont,
+                    island.structuring_element, island.rms_orig[chunk],
+                    island.flux_orig, island.subthrrange))
+            subislands = filter(
+                lambda isl: (isl.data - numpy.ma.array(
+                    numpy.ones(isl.data.shape) * level,
+                    mask=isl.data.mask)).sum() >
+                island.deblend_mincont * island.flux_orig, subislands)
+            subislands = filter(
+                lambda isl: (isl.data - isl.detection_map).max() >= 0,
+                subislands)
+            if len(subislands) > 1:
+                if niter + 1 < island.deblend_nthresh:
+                    return list(utils.flatten(map(
+                        lambda isl: recursive_deblend(isl, niter=niter + 1),
+                        subislands)))
+                else:
+                    return subislands
+            elif len(subislands) == 1 and niter + 1 < island.deblend_nthresh:
+                return recursive_deblend(island, niter=niter + 1)
+            else:
+                break
+    return island
+
+
+def flat(deblended):
+    return list(utils.flatten([deblended]))
+
+
+class TestDeblend(unittest.TestCase):
+    def setUp(self):
+        # Crowded enough for many islands to hold several sources.
+        self.data = noise_with_sources((256, 256), 150)
+
+    def assertSameIslands(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for island, expected in zip(first, second):
+            self.assertEqual(island.chunk, expected.chunk)
+            numpy.testing.assert_array_equal(island.data.mask,
+                                             expected.data.mask)
+            numpy.testing.assert_array_equal(island.data.filled(0),
+                                             expected.data.filled(0))
+            numpy.testing.assert_array_equal(island.rms, expected.rms)
+            numpy.testing.assert_array_equal(island.detection_map,
+                                             expected.detection_map)
+            numpy.testing.assert_array_equal(island.rms_orig,
+                                             expected.rms_orig)
+            self.assertEqual(island.flux_orig, expected.flux_orig)
+
+    def test_same_as_recursive(self):
+        split = 0
+        for nthresh, mincont in ((8, 0.005), (32, 0.005), (32, 0.05),
+                                 (64, 0.001)):
+            for island in islands(self.data, nthresh, mincont):
+                deblended = flat(island.deblend())
+                self.assertSameIslands(deblended,
+                                       flat(recursive_deblend(island)))
+                if len(deblended) > 1:
+                    split += 1
+        self.assertTrue(split > 10)
+
+    def test_niter(self):
+        for island in islands(self.data, 32):
+            self.assertSameIslands(flat(island.deblend(niter=5)),
+                                   flat(recursive_deblend(island, niter=5)))
+
+    def test_not_split(self):
+        # A single source is returned as it is.
+        island = islands(noise_with_sources((128, 128), 1), 32)[0]
+        self.assertTrue(island.deblend() is island)
+
+    def test_many_subthresholds(self):
+        # There used to be a limit of 300, to stay clear of the recursion
+        # limit.
+        for island in islands(self.data, 2000):
+            self.assertEqual(island.deblend_nthresh, 2000)
+            self.assertEqual(len(island.subthrrange), 2000)
+            for subisland in flat(island.deblend()):
+                self.assertTrue(subisland.data.count() > 0)
+
+    def test_extract(self):
+        imagedata = ImageData(self.data, beam, equatorial_wcs())
+        blended = imagedata.extract(det=10, anl=3)
+        deblended = imagedata.extract(det=10, anl=3, deblend_nthresh=32)
+        self.assertTrue(len(deblended) > len(blended))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Tests for storing and transferring Detections without their image.
+"""
+import pickle
+
+import numpy
+import unittest
+
+from tkp.sourcefinder.extract import (Detection, ParamSet, DETECTION_DTYPE,
+                                      detections_to_array,
+                                      detections_from_array)
+from tkp.sourcefinder.image import ImageData
+from tkp.utility.coordinates import WCS
+from tkp.utility.uncertain import Uncertain
+
+
+beam = (2.5, 2., 0.5)
+
+
+def make_wcs():
+    wcs = WCS()
+    wcs.cdelt = (-0.009722222222222, 0.009722222222222)
+    wcs.crota = (0.0, 0.0)
+    wcs.crpix = (257, 257)
+    wcs.crval = (15.0, 45.0)
+    wcs.ctype = ('RA---SIN', 'DEC--SIN')
+    wcs.cunit = ('deg', 'deg')
+    return wcs
+
+
+def get_paramset(x=50, y=60):
+    paramset = ParamSet()
+    paramset.sig = 12.5
+    paramset.gaussian = True
+    paramset.deconv_imposs = 0
+    paramset.values = {
+        'peak': Uncertain(10, 0.5),
+        'flux': Uncertain(12, 0.7),
+        'semimajor': Uncertain(3, 0.2),
+        'semiminor': Uncertain(2, 0.1),
+        'theta': Uncertain(0.3, 0.05),
+        'semimaj_deconv': Uncertain(1.5, 0.2),
+        'semimin_deconv': Uncertain(1.0, 0.1),
+        'theta_deconv': Uncertain(20, 3),
+        'xbar': Uncertain(x, 0.1),
+        'ybar': Uncertain(y, 0.2)
+    }
+    return paramset
+
+
+def make_detection(shape, chunk=(slice(45, 55), slice(55, 65))):
+    """A detection in an image of the given shape, with all the (memoized)
+    maps calculated."""
+    data = numpy.random.RandomState(0).normal(0, 1, shape)
+    imagedata = ImageData(data, beam, make_wcs())
+    imagedata.rmsmap, imagedata.backmap, imagedata.data_bgsubbed
+    return Detection(get_paramset(), imagedata, chunk=chunk,
+                     eps_ra=0.01, eps_dec=0.02)
+
+
+class TestDetectionRecord(unittest.TestCase):
+    def assertDetectionsEqual(self, restored, original):
+        self.assertEqual(restored.serialize(1, 2), original.serialize(1, 2))
+        for attrname in ('peak', 'flux', 'x', 'y', 'smaj', 'smin', 'theta',
+                         'smaj_dc', 'smin_dc', 'theta_dc', 'ra', 'dec',
+                         'theta_celes', 'theta_dc_celes', 'smaj_asec',
+                         'smin_asec'):
+            self.assertEqual(getattr(restored, attrname).value,
+                             getattr(original, attrname).value)
+            self.assertEqual(getattr(restored, attrname).error,
+                             getattr(original, attrname).error)
+        for attrname in ('eps_ra', 'eps_dec', 'sig', 'error_radius',
+                         'dc_imposs', 'gaussian', 'chunk', 'end_smaj_x',
+                         'start_smaj_x', 'end_smaj_y', 'start_smaj_y',
+                         'end_smin_x', 'start_smin_x', 'end_smin_y',
+                         'start_smin_y'):
+            self.assertEqual(getattr(restored, attrname),
+                             getattr(original, attrname))
+        self.assertEqual(str(restored), str(original))
+
+    def test_record(self):
+        det = make_detection((128, 128))
+        record = det.to_record()
+        self.assertEqual(record.dtype, DETECTION_DTYPE)
+        self.assertDetectionsEqual(Detection.from_record(record), det)
+
+    def test_no_chunk(self):
+        det = make_detection((128, 128), chunk=None)
+        self.assertEqual(Detection.from_record(det.to_record()).chunk, None)
+
+    def test_pickle(self):
+        det = make_detection((128, 128))
+        restored = pickle.loads(pickle.dumps(det, pickle.HIGHEST_PROTOCOL))
+        self.assertDetectionsEqual(restored, det)
+        self.assertEqual(restored.imagedata, None)
+
+    def test_pickle_size(self):
+        # The pickled detection doesn't contain the image.
+        small = make_detection((128, 128))
+        large = make_detection((1024, 1024))
+        small_size = len(pickle.dumps(small, pickle.HIGHEST_PROTOCOL))
+        large_size = len(pickle.dumps(large, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(small_size, large_size)
+        self.assertTrue(small_size < 2048)
+
+    def test_array(self):
+        imagedata = ImageData(numpy.ones((128, 128)), beam, make_wcs())
+        detections = [
+            Detection(get_paramset(x, y), imagedata,
+                      chunk=(slice(x - 5, x + 5), slice(y - 5, y + 5)))
+            for x, y in ((10, 20), (30, 40), (50, 60))
+        ]
+        records = detections_to_array(detections)
+        self.assertEqual(records.dtype, DETECTION_DTYPE)
+        self.assertEqual(records.shape, (3,))
+        numpy.testing.assert_array_equal(records['x'], [10, 30, 50])
+        for restored, original in zip(detections_from_array(records),
+                                      detections):
+            self.assertDetectionsEqual(restored, original)
+
+    def test_empty_array(self):
+        self.assertEqual(detections_to_array([]).shape, (0,))
+        self.assertEqual(detections_from_array(detections_to_array([])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Tests for finding the false detection rate threshold without sorting the
+image.
+"""
+import os
+
+import numpy
+import unittest
+
+from tkp import accessors
+from tkp.sourcefinder import stats
+from tkp.sourcefinder import utils
+from tkp.sourcefinder.image import ImageData
+from tkp.testutil.decorators import requires_data
+from tkp.testutil.data import DATAPATH
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+
+
+uncorr_path = os.path.join(
+    DATAPATH, 'sourcefinder/simulations/uncorrelated_noise.fits')
+corr_path = os.path.join(
+    DATAPATH, 'sourcefinder/simulations/correlated_noise.fits')
+deconv_path = os.path.join(
+    DATAPATH, 'sourcefinder/simulations/deconvolved.fits')
+
+
+def scale(imagedata, alpha):
+    """alpha / C_n, as in ImageData.fd_extract()"""
+    corlengthlong, corlengthshort = utils.calculate_correlation_lengths(
+        imagedata.beam[0], imagedata.beam[1])
+    C_n = (1.0 / numpy.arange(
+        round(0.25 * numpy.pi * corlengthlong *
+              corlengthshort + 1))[1:]).sum()
+    return alpha / C_n
+
+
+def legacy_cutoff(imagedata, alpha):
+    """
+    The probability at the cutoff, as found by the former
+    ImageData.fd_extract(), which sorts the probabilities of all the pixels.
+    """
+    normalized_data = imagedata.data_bgsubbed / imagedata.rmsmap
+    n1 = numpy.sqrt(2 * numpy.pi)
+    prob = numpy.sort(numpy.ravel(numpy.exp(-0.5 * normalized_data**2) / n1))
+    lengthprob = float(len(prob))
+    compare = (scale(imagedata, alpha) * numpy.arange(lengthprob + 1)[1:] /
+               lengthprob)
+    try:
+        index = (numpy.where(prob - compare < 0.)[0]).max()
+    except ValueError:
+        return None
+    return prob[index]
+
+
+def cutoff(imagedata, alpha, **kwargs):
+    normalized_data = imagedata.data_bgsubbed / imagedata.rmsmap
+    prob = numpy.exp(-0.5 * numpy.ma.compressed(normalized_data)**2) / \
+        numpy.sqrt(2 * numpy.pi)
+    return stats.fdr_cutoff(prob, normalized_data.size,
+                            scale(imagedata, alpha), **kwargs)
+
+
+def sorted_cutoff(prob, size, scale):
+    prob = numpy.sort(prob)
+    compare = scale * numpy.arange(1, len(prob) + 1.) / float(size)
+    below = numpy.flatnonzero(prob - compare < 0.)
+    if len(below):
+        return prob[below[-1]]
+
+
+class TestFdrCutoff(unittest.TestCase):
+    def setUp(self):
+        self.random = numpy.random.RandomState(0)
+
+    def assertSameCutoff(self, prob, size, scale, **kwargs):
+        result = stats.fdr_cutoff(prob, size, scale, **kwargs)
+        self.assertEqual(result, sorted_cutoff(prob, size, scale))
+        return result
+
+    def test_uniform(self):
+        # Pure noise hardly ever crosses the line.
+        prob = self.random.uniform(0, 1, 10000)
+        for scale in (1e-3, 0.1, 0.5, 1.0):
+            self.assertSameCutoff(prob, len(prob), scale)
+
+    def test_signal(self):
+        prob = numpy.concatenate((self.random.uniform(0, 1, 10000),
+                                  self.random.uniform(0, 1e-4, 500)))
+        for scale in (1e-3, 1e-2, 0.1):
+            self.assertTrue(self.assertSameCutoff(prob, len(prob), scale))
+            self.assertSameCutoff(prob, 2 * len(prob), scale)
+            for nbins in (1, 2, 7, 100000):
+                for max_passes in (1, 2, 10):
+                    self.assertSameCutoff(prob, len(prob), scale,
+                                          nbins=nbins, max_passes=max_passes)
+
+    def test_ties(self):
+        prob = numpy.repeat(self.random.uniform(0, 1e-3, 50), 20)
+        prob[:100] = 0
+        for nbins in (1, 16, 1024):
+            self.assertSameCutoff(prob, len(prob), 1e-2, nbins=nbins)
+
+    def test_nothing(self):
+        self.assertEqual(stats.fdr_cutoff(numpy.array([]), 10, 0.1), None)
+        self.assertEqual(stats.fdr_cutoff(numpy.ones(10), 10, 0.1), None)
+
+
+class TestFdExtract(unittest.TestCase):
+    def setUp(self):
+        data = noise_with_sources((256, 256), 30)
+        data[:, :10] = numpy.nan
+        self.imagedata = ImageData(data, beam, equatorial_wcs(), margin=5)
+
+    def test_same_as_sorted(self):
+        for alpha in (0.5, 0.1, 1e-2, 1e-3, 1e-6):
+            expected = legacy_cutoff(self.imagedata, alpha)
+            self.assertTrue(expected is not None)
+            self.assertEqual(cutoff(self.imagedata, alpha), expected)
+            self.assertEqual(cutoff(self.imagedata, alpha, nbins=4,
+                                    max_passes=1), expected)
+
+    def test_noise(self):
+        data = numpy.random.RandomState(0).normal(0, 1, (256, 256))
+        imagedata = ImageData(data, beam, equatorial_wcs())
+        for alpha in (1e-2, 1e-3):
+            self.assertEqual(legacy_cutoff(imagedata, alpha), None)
+            self.assertEqual(cutoff(imagedata, alpha), None)
+            self.assertEqual(len(imagedata.fd_extract(alpha)), 0)
+
+    def test_fd_extract(self):
+        expected = legacy_cutoff(self.imagedata, 1e-2)
+        threshold = numpy.sqrt(-2.0 * numpy.log(
+            numpy.sqrt(2 * numpy.pi) * expected))
+        self.assertEqual(
+            [det.serialize(0, 0) for det in self.imagedata.fd_extract(1e-2)],
+            [det.serialize(0, 0) for det in self.imagedata.extract(
+                det=threshold, anl=threshold)])
+
+
+@requires_data(uncorr_path)
+@requires_data(corr_path)
+@requires_data(deconv_path)
+class TestFdrMaps(unittest.TestCase):
+    # The maps of test_FDR.
+    def test_same_as_sorted(self):
+        for path in (uncorr_path, corr_path, deconv_path):
+            image = accessors.open(path)
+            imagedata = ImageData(image.data, image.beam, image.wcs)
+            for alpha in (1e-1, 1e-2, 1e-3):
+                self.assertEqual(cutoff(imagedata, alpha),
+                                 legacy_cutoff(imagedata, alpha))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Tests for the Gaussian fitting in tkp.sourcefinder.fitting, checking the
+results of fitting with the analytic Jacobian against those obtained with
+numerically estimated derivatives.
+"""
+import logging
+
+import numpy
+import scipy.optimize
+
+import unittest
+
+from tkp.sourcefinder.gaussian import gaussian
+from tkp.sourcefinder.fitting import moments, fitgaussian, FIT_PARAMS
+from tkp.testutil import Timer
+from tkp.testutil.decorators import duration
+
+
+logger = logging.getLogger(__name__)
+
+beam = (2.5, 2., 0.5)
+
+
+def fitgaussian_numerical(pixels, params, fixed=None):
+    """
+    Reference implementation: fitgaussian as it used to be, evaluating the
+    model over the whole of the pixels array and estimating the derivatives
+    numerically.
+    """
+    fixed = fixed or {}
+    initial = [params[param] for param in FIT_PARAMS if param not in fixed]
+
+    def residuals(paramlist):
+        paramlist = list(paramlist)
+        gaussian_args = []
+        for param in FIT_PARAMS:
+            if param in fixed:
+                gaussian_args.append(fixed[param])
+            else:
+                gaussian_args.append(paramlist.pop(0))
+        g = gaussian(*gaussian_args)
+        pixel_resids = numpy.ma.MaskedArray(
+            data=numpy.fromfunction(g, pixels.shape) - pixels,
+            mask=pixels.mask)
+        return pixel_resids.compressed()
+
+    soln, success = scipy.optimize.leastsq(
+        residuals, initial, xtol=1e-4, ftol=1e-4)
+    soln = list(numpy.atleast_1d(soln))
+    results = fixed.copy()
+    for param in FIT_PARAMS:
+        if param not in results:
+            results[param] = soln.pop(0)
+    if results['semiminor'] > results['semimajor']:
+        results['semimajor'], results['semiminor'] = (
+            results['semiminor'], results['semimajor'])
+        results['theta'] += numpy.pi / 2
+    results['semimajor'] = abs(results['semimajor'])
+    results['semiminor'] = abs(results['semiminor'])
+    return results
+
+
+def noisy_island(seed, shape=(25, 25), threshold=1.5):
+    """
+    An elliptical Gaussian with noise, masked below threshold like the
+    islands the sourcefinder fits.
+    """
+    random = numpy.random.RandomState(seed)
+    x, y = numpy.indices(shape)
+    data = gaussian(random.uniform(10, 100),
+                    random.uniform(10, shape[0] - 10),
+                    random.uniform(10, shape[1] - 10),
+                    random.uniform(3, 5), random.uniform(1.5, 3),
+                    random.uniform(-numpy.pi / 2, numpy.pi / 2))(x, y)
+    data += random.normal(0, 0.5, shape)
+    return numpy.ma.array(data, mask=data < threshold)
+
+
+class TestFitGaussian(unittest.TestCase):
+    def assertFitsAgree(self, pixels, fixed=None):
+        initial = moments(pixels, beam, 1.5)
+        expected = fitgaussian_numerical(pixels, initial, fixed)
+        result = fitgaussian(pixels, initial, fixed)
+        for param in FIT_PARAMS:
+            if param == 'theta':
+                # Only defined modulo pi
+                difference = (result[param] - expected[param] +
+                              numpy.pi / 2) % numpy.pi - numpy.pi / 2
+                self.assertAlmostEqual(difference, 0, 2)
+            else:
+                self.assertAlmostEqual(
+                    result[param] / expected[param], 1, 3,
+                    "%s: %f != %f" % (param, result[param], expected[param]))
+
+    def test_all_free(self):
+        for seed in range(20):
+            self.assertFitsAgree(noisy_island(seed))
+
+    def test_fixed_shape(self):
+        fixed = {'semimajor': beam[0], 'semiminor': beam[1],
+                 'theta': beam[2]}
+        for seed in range(20):
+            self.assertFitsAgree(noisy_island(seed), fixed)
+
+    def test_fixed_position(self):
+        for seed in range(20):
+            pixels = noisy_island(seed)
+            initial = moments(pixels, beam, 1.5)
+            fixed = {'xbar': initial['xbar'], 'ybar': initial['ybar']}
+            self.assertFitsAgree(pixels, fixed)
+
+    def test_fixed_position_and_shape(self):
+        # Only the peak is fitted
+        for seed in range(20):
+            pixels = noisy_island(seed)
+            initial = moments(pixels, beam, 1.5)
+            fixed = {'xbar': initial['xbar'], 'ybar': initial['ybar'],
+                     'semimajor': beam[0], 'semiminor': beam[1],
+                     'theta': beam[2]}
+            self.assertFitsAgree(pixels, fixed)
+
+    def test_unmasked(self):
+        # A plain (unmasked) array is fitted over all its pixels.
+        pixels = noisy_island(0)
+        pixels = numpy.ma.array(pixels.data)
+        self.assertFitsAgree(pixels)
+
+
+class TestFitGaussianBenchmark(unittest.TestCase):
+    @duration(60)
+    def test_benchmark(self):
+        islands = [noisy_island(seed) for seed in range(200)]
+        initials = [moments(pixels, beam, 1.5) for pixels in islands]
+
+        with Timer() as numerical:
+            expected = [fitgaussian_numerical(pixels, initial)
+                        for pixels, initial in zip(islands, initials)]
+        with Timer() as analytic:
+            result = [fitgaussian(pixels, initial)
+                      for pixels, initial in zip(islands, initials)]
+
+        logger.info("Gaussian fitting: %.2fms per island with numerical "
+                    "derivatives, %.2fms with analytic Jacobian",
+                    numerical.elapsed * 1000 / len(islands),
+                    analytic.elapsed * 1000 / len(islands))
+        numpy.testing.assert_allclose([fit['peak'] for fit in result],
+                                      [fit['peak'] for fit in expected],
+                                      rtol=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests for source extraction with the image held in single precision.
+"""
+import os
+import shutil
+import tempfile
+import logging
+
+import numpy
+import pyfits
+from numpy.testing import assert_allclose
+import unittest
+
+from tkp.accessors.fitsimage import FitsImage
+from tkp.sourcefinder.image import ImageData
+from tkp.sourcefinder.tiled import TiledImage, BYTES_PER_PIXEL
+from tkp.testutil import Timer
+from tkp.testutil.decorators import duration
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+from tkp.testutil.sourcefinder import catalogue
+
+
+logger = logging.getLogger(__name__)
+
+
+def map_bytes(imagedata):
+    """Memory used by the data and maps of an ImageData"""
+    return sum(array.nbytes + numpy.ma.getmaskarray(array).nbytes
+               for array in (imagedata.data, imagedata.backmap,
+                             imagedata.rmsmap, imagedata.data_bgsubbed))
+
+
+class TestFloat32(unittest.TestCase):
+    def setUp(self):
+        self.data = numpy.float32(noise_with_sources((512, 512), 60))
+        self.double = ImageData(numpy.float64(self.data), beam,
+                                equatorial_wcs(), margin=10)
+        self.single = ImageData(self.data, beam, equatorial_wcs(), margin=10,
+                                float32=True)
+
+    def test_maps(self):
+        for name in ('data', 'backmap', 'rmsmap', 'data_bgsubbed'):
+            single = getattr(self.single, name)
+            double = getattr(self.double, name)
+            self.assertEqual(single.dtype, numpy.float32)
+            self.assertEqual(double.dtype, numpy.float64)
+            numpy.testing.assert_array_equal(single.mask, double.mask)
+            assert_allclose(single.filled(0), double.filled(0),
+                            rtol=1e-5, atol=1e-5)
+            self.assertEqual(single.nbytes * 2, double.nbytes)
+
+    def test_double_precision_data(self):
+        # Data given in double precision is converted.
+        imagedata = ImageData(numpy.float64(self.data), beam,
+                              equatorial_wcs(), float32=True)
+        self.assertEqual(imagedata.data.dtype, numpy.float32)
+
+    def test_extract(self):
+        single = self.single.extract(det=10, anl=3)
+        double = self.double.extract(det=10, anl=3)
+        self.assertTrue(len(double) > 10)
+        self.assertEqual(len(single), len(double))
+        # The measurements are made in double precision.
+        self.assertEqual(
+            self.single.residuals_from_gauss_fitting.dtype, numpy.float32)
+        for det in single:
+            self.assertTrue(isinstance(det.peak.value, float))
+            self.assertTrue(isinstance(det.flux.error, float))
+        assert_allclose(catalogue(single), catalogue(double), rtol=1e-4)
+
+    def test_deblend(self):
+        single = self.single.extract(det=10, anl=3, deblend_nthresh=32)
+        double = self.double.extract(det=10, anl=3, deblend_nthresh=32)
+        self.assertEqual(len(single), len(double))
+        assert_allclose(catalogue(single), catalogue(double), rtol=1e-4)
+
+    def test_tiled(self):
+        tiled = TiledImage(self.data, beam, equatorial_wcs(), margin=10,
+                           memory_budget=200**2 * BYTES_PER_PIXEL,
+                           overlap=30, float32=True)
+        assert_allclose(catalogue(tiled.extract(det=10, anl=3)),
+                        catalogue(self.single.extract(det=10, anl=3)),
+                        rtol=1e-6)
+
+    def test_fitsimage(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "image.fits")
+            header = pyfits.Header()
+            header['crval1'], header['crval2'] = 15.0, 0.0
+            header['crpix1'], header['crpix2'] = 257, 257
+            header['cdelt1'], header['cdelt2'] = -0.01, 0.01
+            header['telescop'] = 'LOFAR'
+            header['restfrq'], header['restbw'] = 1.5e8, 2e5
+            header['bmaj'] = header['bmin'] = header['bpa'] = 0.1
+            pyfits.writeto(filename, self.data.transpose(), header)
+            self.assertEqual(FitsImage(filename).data.dtype, numpy.float64)
+            single = FitsImage(filename, dtype=numpy.float32)
+            self.assertEqual(single.data.dtype, numpy.float32)
+            numpy.testing.assert_array_equal(single.data, self.data)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestFloat32Benchmark(unittest.TestCase):
+    @duration(60)
+    def test_benchmark(self):
+        data = numpy.float32(noise_with_sources((2048, 2048), 1000))
+        results = {}
+        for float32 in (False, True):
+            with Timer() as timer:
+                imagedata = ImageData(
+                    data if float32 else numpy.float64(data), beam,
+                    equatorial_wcs(), back_size_x=64, back_size_y=64,
+                    float32=float32)
+                sources = imagedata.extract(det=10, anl=3)
+            results[float32] = (timer.elapsed, map_bytes(imagedata),
+                                catalogue(sources))
+        logger.info("Extracting %d sources: %.2fs, %d MB of maps in double "
+                    "precision; %.2fs, %d MB in single precision",
+                    len(results[False][2]), results[False][0],
+                    results[False][1] / 2**20, results[True][0],
+                    results[True][1] / 2**20)
+        # The maps take less memory; the timings are only logged.
+        self.assertLess(results[True][1], 0.6 * results[False][1])
+        self.assertEqual(results[True][2].shape, results[False][2].shape)
+        assert_allclose(results[True][2], results[False][2], rtol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
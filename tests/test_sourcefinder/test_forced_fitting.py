@@ -0,0 +1,153 @@
+"""
+Tests for fitting sources of the shape of the beam at fixed positions.
+"""
+
+import logging
+
+import numpy
+from numpy.testing import assert_allclose
+import unittest
+
+from tkp.sourcefinder import image as sfimage
+from tkp.sourcefinder.image import ImageData
+from tkp.testutil import Timer
+from tkp.testutil.decorators import duration
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+
+
+logger = logging.getLogger(__name__)
+
+
+def fit_one_by_one(imagedata, positions, boxsize, threshold):
+    """Fit each position in turn, with the nonlinear fitter"""
+    return [imagedata._fit_fixed_position(posn, boxsize, threshold,
+                                          'position+shape')
+            for posn in positions]
+
+
+def make_image(shape, nsources):
+    data = noise_with_sources(shape, nsources)
+    data[:, -6:] = numpy.nan
+    imagedata = ImageData(data, beam, equatorial_wcs(), margin=5)
+    sources = imagedata.extract(det=10, anl=3)
+    return imagedata, [(det.ra.value, det.dec.value) for det in sources]
+
+
+class TestFitFixedShapes(unittest.TestCase):
+    def setUp(self):
+        self.imagedata, self.sources = make_image((256, 256), 30)
+        # Random positions, including some off the image and near its edges.
+        pixels = numpy.concatenate((
+            numpy.random.RandomState(1).uniform(-5, 261, (300, 2)),
+            [[3.2, 100.], [100., 252.5], [250.7, 100.2], [100., 250.2]]))
+        self.positions = self.sources + [
+            tuple(posn) for posn in self.imagedata.wcs.all_p2s(pixels)]
+
+    def assertSameDetections(self, detections, expected):
+        self.assertEqual([det is None for det in detections],
+                         [det is None for det in expected])
+        for det, expected_det in zip(detections, expected):
+            if det is None:
+                continue
+            record = det.to_record()
+            expected_record = expected_det.to_record()
+            for name in record.dtype.names:
+                assert_allclose(record[name], expected_record[name],
+                                rtol=1e-9, err_msg=name)
+
+    def test_same_as_nonlinear_fit(self):
+        detections = self.imagedata._fit_fixed_shapes(self.positions, 10,
+                                                      None)
+        self.assertTrue(sum(det is not None for det in detections) > 100)
+        self.assertSameDetections(detections, fit_one_by_one(
+            self.imagedata, self.positions, 10, None))
+
+    def test_odd_boxsize(self):
+        detections = self.imagedata._fit_fixed_shapes(self.positions, 9,
+                                                      None)
+        self.assertSameDetections(detections, fit_one_by_one(
+            self.imagedata, self.positions, 9, None))
+
+    def test_threshold(self):
+        detections = self.imagedata._fit_fixed_shapes(self.sources, 10, 3)
+        self.assertTrue(all(detections))
+        self.assertSameDetections(detections, fit_one_by_one(
+            self.imagedata, self.sources, 10, 3))
+        self.assertRaises(ValueError, self.imagedata._fit_fixed_shapes,
+                          self.positions, 10, 3)
+
+    def test_fit_fixed_positions(self):
+        ids = range(len(self.positions))
+        detections, fitted_ids = self.imagedata.fit_fixed_positions(
+            self.positions, 10, ids=ids)
+        expected = fit_one_by_one(self.imagedata, self.positions, 10, None)
+        self.assertEqual(fitted_ids, [i for i in ids if expected[i]])
+        self.assertEqual(len(detections), len(fitted_ids))
+        self.assertEqual(self.imagedata.fit_fixed_positions([], 10), [])
+
+    def test_other_modes(self):
+        # The other modes still fit each position in turn.
+        detections = self.imagedata.fit_fixed_positions(
+            self.sources, 10, fixed='position')
+        self.assertEqual(len(detections), len(self.sources))
+        for det, posn in zip(detections, self.sources):
+            assert_allclose((det.ra.value, det.dec.value), posn, rtol=1e-6)
+
+    def test_fractional_pixels(self):
+        # Pixel coordinates needn't be whole numbers.
+        detection = self.imagedata.fit_to_point(100.6, 100.2, 10, None,
+                                                'position+shape')
+        self.assertEqual((detection.x.value, detection.y.value),
+                         (100.6, 100.2))
+
+
+class TestThresholdLabels(unittest.TestCase):
+    def setUp(self):
+        self.imagedata, self.sources = make_image((256, 256), 30)
+        self.calls = 0
+        self.label = sfimage.ndimage.label
+
+        def counting_label(*args, **kwargs):
+            self.calls += 1
+            return self.label(*args, **kwargs)
+        sfimage.ndimage.label = counting_label
+
+    def tearDown(self):
+        sfimage.ndimage.label = self.label
+
+    def test_labelled_once(self):
+        for fixed in ('position', None, 'position+shape'):
+            detections = self.imagedata.fit_fixed_positions(
+                self.sources, 10, threshold=3, fixed=fixed)
+            self.assertEqual(len(detections), len(self.sources))
+        self.assertEqual(self.calls, 1)
+        labels, num = self.imagedata.labels[3]
+        self.assertTrue(num >= len(self.sources))
+        self.imagedata.fit_fixed_positions(self.sources, 10, threshold=4)
+        self.assertEqual(self.calls, 2)
+        self.imagedata.clearcache()
+        self.imagedata.fit_fixed_positions(self.sources, 10, threshold=3)
+        self.assertEqual(self.calls, 3)
+
+
+class TestThresholdLabelsBenchmark(unittest.TestCase):
+    @duration(60)
+    def test_benchmark(self):
+        # The cost of fitting a position doesn't grow with the image.
+        times = []
+        for size in (256, 2048):
+            imagedata, sources = make_image((size, size), size // 16)
+            sources = sources[:20]
+            imagedata.fit_fixed_positions(sources[:1], 10, threshold=3,
+                                          fixed='position')
+            with Timer() as timer:
+                detections = imagedata.fit_fixed_positions(
+                    sources, 10, threshold=3, fixed='position')
+            times.append(timer.elapsed / len(sources))
+            self.assertEqual(len(detections), len(sources))
+        logger.info("Forced fits with a threshold: %.4fs per position in a "
+                    "256x256 image, %.4fs in a 2048x2048 image", *times)
+
+
+if __name__ == '__main__':
+    unittest.main()
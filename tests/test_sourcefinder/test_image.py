@@ -348,3 +348,55 @@ class TestMaskedBackground(unittest.TestCase):
             accessors.open(fits_file), radius=1.0)
         result = self.image.extract(det=10.0, anl=3.0)
         self.assertFalse(result)
+
+
+class TestDataMask(unittest.TestCase):
+    """The mask is built up from the margin, radius and bad pixels."""
+    def setUp(self):
+        self.data = np.random.RandomState(0).normal(size=(100, 80))
+        self.data[20:30, 40] = 0
+        self.data[50, 10:15] = np.nan
+
+    def legacy_mask(self, margin, radius):
+        mask = np.zeros(self.data.shape)
+        if margin:
+            margin_mask = np.ones(self.data.shape)
+            margin_mask[margin:-margin, margin:-margin] = 0
+            mask = np.logical_or(mask, margin_mask)
+        if radius:
+            mask = np.logical_or(mask, tkp.sourcefinder.utils.circular_mask(
+                self.data.shape[0], self.data.shape[1], radius))
+        mask = np.logical_or(mask, np.where(self.data == 0, 1, 0))
+        return np.logical_or(mask, np.isnan(self.data))
+
+    def testMask(self):
+        for margin, radius in ((0, 0), (5, 0), (0, 30), (12, 45.5)):
+            image = sfimage.ImageData(self.data, (2., 2., 0.), None,
+                                      margin=margin, radius=radius)
+            self.assertEqual(image.data.mask.dtype, np.bool)
+            np.testing.assert_array_equal(image.data.mask,
+                                          self.legacy_mask(margin, radius))
+
+    def testMaskReused(self):
+        first = sfimage.geometric_mask(self.data.shape, 5, 30)
+        second = sfimage.geometric_mask(self.data.shape, 5, 30)
+        self.assertTrue(first is second)
+        self.assertFalse(first.flags.writeable)
+        self.assertTrue(sfimage.geometric_mask(self.data.shape) is None)
+        for margin in range(sfimage.MASK_CACHE_SIZE):
+            sfimage.geometric_mask(self.data.shape, margin + 1)
+        self.assertFalse(
+            sfimage.geometric_mask(self.data.shape, 5, 30) is first)
+
+    def testUsefulChunk(self):
+        image = sfimage.ImageData(self.data, (2., 2., 0.), None, margin=7,
+                                  radius=35)
+        expected = sfimage.ndimage.find_objects(
+            np.where(image.data.mask, 0, 1))[0]
+        self.assertEqual(image.useful_chunk, expected)
+        # The interpolated maps leave the data mask untouched.
+        image.rmsmap
+        np.testing.assert_array_equal(image.data.mask,
+                                      self.legacy_mask(7, 35))
+        self.assertTrue(sfimage.ImageData(np.zeros((10, 10)), (2., 2., 0.),
+                                          None).useful_chunk is None)
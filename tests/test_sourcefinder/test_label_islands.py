@@ -0,0 +1,126 @@
+"""
+Tests for labelling the islands of an image.
+"""
+import logging
+
+import numpy
+import unittest
+try:
+    import ndimage
+except ImportError:
+    from scipy import ndimage
+
+from tkp.sourcefinder.image import ImageData, STRUCTURING_ELEMENT
+from tkp.testutil import Timer
+from tkp.testutil.decorators import duration
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_label_islands(imagedata, detectionthresholdmap,
+                         analysisthresholdmap):
+    """
+    The former ImageData.label_islands(), which relabels the image with
+    numpy.in1d() and finds the median of the RMS map on every call.
+    """
+    rms_median = numpy.ma.median(imagedata.rmsmap)
+    clipped_data = numpy.ma.where(
+        (imagedata.data_bgsubbed > analysisthresholdmap) &
+        (imagedata.rmsmap >= (0.001 * rms_median)),
+        1, 0
+    ).filled(fill_value=0)
+    labelled_data, num_labels = ndimage.label(clipped_data,
+                                              STRUCTURING_ELEMENT)
+    labels_above_det_thr = []
+    if num_labels > 0:
+        above_det_thr = (
+            imagedata.data_bgsubbed - detectionthresholdmap
+        ).filled(fill_value=-1)
+        maximum_values = ndimage.maximum(
+            above_det_thr, labelled_data, numpy.arange(1, num_labels + 1))
+        if isinstance(maximum_values, float):
+            maximum_values = [maximum_values]
+        for i, x in enumerate(maximum_values, 1):
+            if x >= 0:
+                labels_above_det_thr.append(i)
+        labelled_data = numpy.where(
+            numpy.in1d(labelled_data.ravel(), labels_above_det_thr).reshape(
+                labelled_data.shape),
+            labelled_data, 0)
+    return labels_above_det_thr, labelled_data
+
+
+class TestLabelIslands(unittest.TestCase):
+    def setUp(self):
+        data = noise_with_sources((256, 256), 40)
+        data[:, :10] = 0
+        self.imagedata = ImageData(data, beam, equatorial_wcs())
+
+    def assertSameLabels(self, det, anl):
+        detection = det * self.imagedata.rmsmap
+        analysis = anl * self.imagedata.rmsmap
+        labels, labelled_data = self.imagedata.label_islands(detection,
+                                                             analysis)
+        expected_labels, expected_data = legacy_label_islands(
+            self.imagedata, detection, analysis)
+        self.assertEqual(labels, expected_labels)
+        self.assertEqual(labelled_data.dtype, expected_data.dtype)
+        numpy.testing.assert_array_equal(labelled_data, expected_data)
+        return labels
+
+    def test_same_labels(self):
+        # Noise islands are labelled, but most of them are not kept.
+        self.assertTrue(len(self.assertSameLabels(10, 3)) > 10)
+        self.assertTrue(len(self.assertSameLabels(4, 2)) > 10)
+
+    def test_one_island(self):
+        self.assertEqual(len(self.assertSameLabels(1e6, 1e5)), 0)
+        data = numpy.zeros((50, 50))
+        data[20:25, 20:25] = 1.0
+        self.imagedata = ImageData(data, beam, equatorial_wcs())
+        self.imagedata.backmap = numpy.ma.zeros(data.shape)
+        self.imagedata.rmsmap = numpy.ma.ones(data.shape) * 0.1
+        self.assertEqual(self.assertSameLabels(5, 3), [1])
+
+    def test_rms_median(self):
+        self.assertEqual(self.imagedata.rms_median,
+                         numpy.ma.median(self.imagedata.rmsmap))
+        self.imagedata.rmsmap = self.imagedata.rmsmap * 2
+        self.assertEqual(self.imagedata.rms_median,
+                         numpy.ma.median(self.imagedata.rmsmap))
+        self.imagedata.clearcache()
+        self.assertEqual(self.imagedata.rms_median,
+                         numpy.ma.median(self.imagedata.rmsmap))
+
+
+class TestLabelIslandsBenchmark(unittest.TestCase):
+    @duration(60)
+    def test_benchmark(self):
+        # Pure noise has plenty of islands above a low threshold.
+        shape = (4096, 4096)
+        data = numpy.random.RandomState(0).normal(0, 1, shape)
+        imagedata = ImageData(data, beam, equatorial_wcs())
+        imagedata.backmap = numpy.ma.zeros(shape)
+        imagedata.rmsmap = numpy.ma.ones(shape)
+        detection = imagedata.rmsmap * 2.5
+        analysis = imagedata.rmsmap * 2
+
+        with Timer() as legacy:
+            expected_labels, expected_data = legacy_label_islands(
+                imagedata, detection, analysis)
+        with Timer() as lookup:
+            labels, labelled_data = imagedata.label_islands(detection,
+                                                            analysis)
+
+        logger.info("Labelling %d islands in a %dx%d image: %.2fs with "
+                    "numpy.in1d, %.2fs with a lookup table", len(labels),
+                    shape[0], shape[1], legacy.elapsed, lookup.elapsed)
+        self.assertTrue(len(labels) > 10**5)
+        self.assertEqual(labels, expected_labels)
+        numpy.testing.assert_array_equal(labelled_data, expected_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Tests for the on-disk cache of background and RMS maps.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy
+import unittest
+
+from tkp.sourcefinder.image import ImageData
+from tkp.sourcefinder.mapcache import MapCache, SUFFIX
+from tkp.steps.source_extraction import get_map_cache
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+
+
+class UncachedImageData(ImageData):
+    """An ImageData which fails if it has to calculate its grids"""
+    def _ImageData__grids(self):
+        raise AssertionError("Grids not taken from cache")
+
+
+class TestMapCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = MapCache(os.path.join(self.directory, "cache"))
+        self.image_path = os.path.join(self.directory, "image.npy")
+        self.data = noise_with_sources((256, 256), 20)
+        numpy.save(self.image_path, self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def imagedata(self, cls=ImageData, **kwargs):
+        return cls(self.data, beam, equatorial_wcs(), margin=10,
+                   map_cache=self.cache.entry(self.image_path), **kwargs)
+
+    def assertMapsEqual(self, first, second):
+        for name in ('backmap', 'rmsmap'):
+            first_map, second_map = getattr(first, name), getattr(second, name)
+            self.assertEqual(first_map.dtype, second_map.dtype)
+            numpy.testing.assert_array_equal(
+                numpy.ma.getmaskarray(first_map),
+                numpy.ma.getmaskarray(second_map))
+            numpy.testing.assert_array_equal(first_map.data, second_map.data)
+
+    def test_reuse(self):
+        uncached = ImageData(self.data, beam, equatorial_wcs(), margin=10)
+        first = self.imagedata()
+        self.assertMapsEqual(first, uncached)
+        # The maps are all cached, so the grids aren't needed.
+        second = self.imagedata(cls=UncachedImageData)
+        self.assertMapsEqual(second, uncached)
+        self.assertEqual(
+            [det.serialize(0, 0) for det in second.extract(det=10, anl=3)],
+            [det.serialize(0, 0) for det in uncached.extract(det=10, anl=3)])
+        self.assertTrue(second.fit_to_point(128, 128, 10, 0, None))
+
+    def test_parameters(self):
+        self.imagedata().rmsmap
+        for kwargs in ({'back_size_x': 64}, {'radius': 100},
+                       {'float32': True}):
+            imagedata = self.imagedata(cls=UncachedImageData, **kwargs)
+            self.assertRaises(AssertionError, getattr, imagedata, 'rmsmap')
+            imagedata = self.imagedata(**kwargs)
+            self.assertMapsEqual(imagedata, ImageData(
+                self.data, beam, equatorial_wcs(), margin=10, **kwargs))
+
+    def test_beam(self):
+        self.imagedata().rmsmap
+        other_beam = (beam[0] * 2, beam[1] * 2, beam[2])
+        imagedata = UncachedImageData(
+            self.data, other_beam, equatorial_wcs(), margin=10,
+            map_cache=self.cache.entry(self.image_path))
+        self.assertRaises(AssertionError, getattr, imagedata, 'rmsmap')
+
+    def test_modified_directory(self):
+        # A CASA image is a directory of table files, which are rewritten
+        # without changing the modification time of the directory.
+        image_path = os.path.join(self.directory, "image.casa")
+        os.mkdir(image_path)
+        table_path = os.path.join(image_path, "table.f0")
+        with open(table_path, 'w') as f:
+            f.write("first")
+        key = self.cache.entry(image_path).key
+        status = os.stat(image_path)
+        with open(table_path, 'w') as f:
+            f.write("second")
+        os.utime(image_path, (status.st_atime, status.st_mtime))
+        self.assertNotEqual(self.cache.entry(image_path).key, key)
+
+    def test_modified_image(self):
+        self.imagedata().rmsmap
+        status = os.stat(self.image_path)
+        os.utime(self.image_path, (status.st_atime, status.st_mtime + 10))
+        imagedata = self.imagedata(cls=UncachedImageData)
+        self.assertRaises(AssertionError, getattr, imagedata, 'rmsmap')
+
+    def test_corrupt(self):
+        self.imagedata().backmap
+        for filename in os.listdir(self.cache.directory):
+            with open(os.path.join(self.cache.directory, filename), 'w') as f:
+                f.write("garbage")
+        self.assertMapsEqual(self.imagedata(), ImageData(
+            self.data, beam, equatorial_wcs(), margin=10))
+
+    def test_eviction(self):
+        entry = self.cache.entry(self.image_path)
+        arrays = {'map': numpy.ma.MaskedArray(numpy.zeros(1000))}
+        entry.save("first", (), arrays)
+        size = self.cache.size()
+        cache = MapCache(self.cache.directory, max_size=2 * size)
+        entry = cache.entry(self.image_path)
+        # Make sure the modification times differ.
+        os.utime(cache.path(entry._key("first", ()), SUFFIX),
+                 (time.time() - 100, time.time() - 100))
+        entry.save("second", (), arrays)
+        self.assertEqual(cache.size(), 2 * size)
+        # Loading an entry marks it as recently used.
+        self.assertTrue(entry.load("first", ()) is not None)
+        os.utime(cache.path(entry._key("second", ()), SUFFIX),
+                 (time.time() - 200, time.time() - 200))
+        entry.save("third", (), arrays)
+        self.assertEqual(cache.size(), 2 * size)
+        self.assertTrue(entry.load("first", ()) is not None)
+        self.assertTrue(entry.load("second", ()) is None)
+        numpy.testing.assert_array_equal(entry.load("third", ())['map'],
+                                         arrays['map'])
+
+    def test_configuration(self):
+        self.assertTrue(get_map_cache(self.image_path, {}) is None)
+        self.assertTrue(
+            get_map_cache(self.image_path, {'map_cache': False}) is None)
+        entry = get_map_cache(self.image_path, {
+            'map_cache': True, 'map_cache_dir': self.cache.directory,
+            'map_cache_size': 10})
+        self.assertEqual(entry.cache.max_size, 10 * 2**20)
+        self.assertEqual(entry.key, self.cache.entry(self.image_path).key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Tests for measuring the moments of all the islands of an image at once.
+"""
+import numpy
+from numpy.testing import assert_allclose
+import unittest
+try:
+    import ndimage
+except ImportError:
+    from scipy import ndimage
+
+from tkp.sourcefinder import fitting
+from tkp.sourcefinder.image import ImageData
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+from tkp.testutil.sourcefinder import islands
+
+
+def labelled(data):
+    """The labels, island map and chunks of the islands of an image"""
+    imagedata = ImageData(data, beam, equatorial_wcs())
+    labels, labelled_data = imagedata.label_islands(
+        10 * imagedata.rmsmap, 3 * imagedata.rmsmap)
+    slices = ndimage.find_objects(labelled_data)
+    chunks = [slices[label - 1] for label in labels]
+    return imagedata, labels, labelled_data, chunks
+
+
+class TestLabelledMoments(unittest.TestCase):
+    def setUp(self):
+        self.data = noise_with_sources((256, 256), 60)
+
+    def test_same_as_single_island(self):
+        imagedata, labels, labelled_data, chunks = labelled(self.data)
+        island_list = islands(self.data, 0)
+        self.assertTrue(len(island_list) > 10)
+        moments, max_positions = fitting.labelled_moments(
+            imagedata.data_bgsubbed.data, labelled_data, labels,
+            [(chunk[0].start, chunk[1].start) for chunk in chunks], beam)
+        for island, raw, max_pos in zip(island_list, moments, max_positions):
+            expected = fitting.raw_moments(island.data, beam)
+            for name in fitting.MOMENTS_DTYPE.names:
+                assert_allclose(raw[name], expected[name], rtol=1e-10,
+                                atol=1e-12)
+            self.assertEqual(tuple(max_pos), island.max_pos)
+            shape = fitting.moments_to_shape(raw, beam, 3.0)
+            expected = fitting.moments(island.data, beam, 3.0)
+            self.assertEqual(sorted(shape), sorted(expected))
+            for name in shape:
+                assert_allclose(shape[name], expected[name], rtol=1e-10,
+                                atol=1e-12)
+
+    def test_selected_labels(self):
+        # Only the given labels are measured, in the given order.
+        imagedata, labels, labelled_data, chunks = labelled(self.data)
+        origins = [(chunk[0].start, chunk[1].start) for chunk in chunks]
+        moments, max_positions = fitting.labelled_moments(
+            imagedata.data_bgsubbed.data, labelled_data, labels, origins,
+            beam)
+        subset = [3, 0, 5]
+        sub_moments, sub_positions = fitting.labelled_moments(
+            imagedata.data_bgsubbed.data, labelled_data,
+            [labels[i] for i in subset], [origins[i] for i in subset], beam)
+        numpy.testing.assert_array_equal(sub_moments, moments[subset])
+        numpy.testing.assert_array_equal(sub_positions, max_positions[subset])
+
+    def test_no_labels(self):
+        moments, max_positions = fitting.labelled_moments(
+            self.data, numpy.zeros(self.data.shape, dtype=numpy.int32), [],
+            [], beam)
+        self.assertEqual(len(moments), 0)
+        self.assertEqual(max_positions.shape, (0, 2))
+
+    def test_single_pixel(self):
+        labelled_data = numpy.zeros((10, 10), dtype=numpy.int32)
+        labelled_data[4, 5] = 1
+        data = numpy.zeros((10, 10))
+        data[4, 5] = 7.0
+        moments, max_positions = fitting.labelled_moments(
+            data, labelled_data, [1], [(4, 5)], beam)
+        self.assertEqual(moments[0]['nonzero'], 1)
+        self.assertEqual(tuple(max_positions[0]), (0, 0))
+        shape = fitting.moments_to_shape(moments[0], beam)
+        self.assertEqual(shape['semimajor'], shape['semiminor'])
+
+    def test_seeded_fits(self):
+        # Fits seeded from the moments of the whole image agree with those
+        # which measure each island on its own.
+        imagedata = ImageData(self.data, beam, equatorial_wcs())
+        seeded = [(det.x.value, det.y.value, det.peak.value)
+                  for det in imagedata.extract(det=10, anl=3)]
+        unseeded = []
+        for island in islands(self.data, 0):
+            island.moments = None
+            measurement, residual = island.fit()
+            unseeded.append((measurement['xbar'].value,
+                             measurement['ybar'].value,
+                             measurement['peak'].value))
+        assert_allclose(sorted(seeded), sorted(unseeded), rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
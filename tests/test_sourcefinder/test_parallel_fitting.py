@@ -0,0 +1,79 @@
+"""
+Tests for fitting the islands of a single image in parallel.
+"""
+import pickle
+
+import numpy
+import unittest
+
+from tkp.sourcefinder import extract
+from tkp.sourcefinder.image import ImageData
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+
+
+def serialize_all(results):
+    return [det.serialize(0, 0) for det in results]
+
+
+class TestParallelFitting(unittest.TestCase):
+    def setUp(self):
+        self.data = noise_with_sources((512, 512), 100)
+
+    def extract(self, **kwargs):
+        imagedata = ImageData(self.data, beam, equatorial_wcs())
+        return imagedata.extract(det=10, anl=3, **kwargs), imagedata
+
+    def test_same_results(self):
+        serial, serial_image = self.extract()
+        parallel, parallel_image = self.extract(nr_processes=3)
+        self.assertEqual(serialize_all(serial), serialize_all(parallel))
+        # The residuals include all the fitted islands, even those which are
+        # later rejected.
+        self.assertTrue(serial_image.residuals_from_gauss_fitting.any())
+        numpy.testing.assert_array_equal(
+            serial_image.residuals_from_gauss_fitting,
+            parallel_image.residuals_from_gauss_fitting)
+
+    def test_same_results_deblended_force_beam(self):
+        serial, serial_image = self.extract(deblend_nthresh=32,
+                                            force_beam=True)
+        parallel, parallel_image = self.extract(deblend_nthresh=32,
+                                                force_beam=True,
+                                                nr_processes=2)
+        self.assertEqual(serialize_all(serial), serialize_all(parallel))
+        numpy.testing.assert_array_equal(
+            serial_image.residuals_from_gauss_fitting,
+            parallel_image.residuals_from_gauss_fitting)
+
+    def test_compact_island(self):
+        # Fitting the compact form of an island gives the same result as
+        # fitting the island itself.
+        imagedata = ImageData(self.data, beam, equatorial_wcs())
+        detection = 10 * imagedata.rmsmap
+        analysis = 3 * imagedata.rmsmap
+        labels, labelled_data = imagedata.label_islands(detection, analysis)
+        chunk = numpy.ma.where(labelled_data == labels[0])
+        chunk = (slice(chunk[0].min(), chunk[0].max() + 1),
+                 slice(chunk[1].min(), chunk[1].max() + 1))
+        selected = numpy.where(labelled_data[chunk] == labels[0],
+                               imagedata.data_bgsubbed[chunk].data,
+                               -extract.BIGNUM)
+        island = extract.Island(
+            selected, imagedata.rmsmap[chunk], chunk,
+            (analysis[chunk] / imagedata.rmsmap[chunk]).max(),
+            detection[chunk], beam, 0, 0.005, [[0, 1, 0], [1, 1, 1], [0, 1, 0]]
+        )
+        measurement, residual = island.fit()
+        compact = pickle.loads(pickle.dumps(island.compact()))
+        compact_measurement, compact_residual = extract.fit_island(compact)
+        self.assertEqual(measurement.keys(), compact_measurement.keys())
+        for key in measurement.keys():
+            numpy.testing.assert_array_equal(
+                [measurement[key].value, measurement[key].error],
+                [compact_measurement[key].value, compact_measurement[key].error])
+        self.assertEqual(measurement.sig, compact_measurement.sig)
+        numpy.testing.assert_array_equal(residual, compact_residual)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+"""
+Tests for converting the pixel parameters of many detections to celestial
+coordinates at once.
+
+We check that the results are the same as those obtained by converting the
+positions of each detection in turn, as Detection used to do.
+"""
+import numpy
+import unittest
+
+from tkp.sourcefinder.extract import Detection, ParamSet, physical_coordinates
+from tkp.sourcefinder.utils import get_error_radius
+from tkp.utility import coordinates
+from tkp.utility.uncertain import Uncertain
+
+
+class DummyImage(object):
+    pass
+
+
+def make_image(crval):
+    image = DummyImage()
+    image.wcs = coordinates.WCS()
+    image.wcs.cdelt = (-0.009722222222222, 0.009722222222222)
+    image.wcs.crota = (0.0, 0.0)
+    image.wcs.crpix = (1025, 1025)
+    image.wcs.crval = crval
+    image.wcs.ctype = ('RA---SIN', 'DEC--SIN')
+    image.wcs.cunit = ('deg', 'deg')
+    return image
+
+
+def make_paramsets(n, seed=0):
+    random = numpy.random.RandomState(seed)
+    paramsets = []
+    for i in range(n):
+        paramset = ParamSet()
+        paramset.sig = 1
+        paramset.values = {
+            'peak': Uncertain(10, 1),
+            'flux': Uncertain(10, 1),
+            'semimajor': Uncertain(random.uniform(2, 5), random.uniform(0, 1)),
+            'semiminor': Uncertain(random.uniform(1, 2), random.uniform(0, 1)),
+            'theta': Uncertain(random.uniform(-1.5, 1.5), 0.1),
+            'semimaj_deconv': Uncertain(1, 1),
+            'semimin_deconv': Uncertain(1, 1),
+            'theta_deconv': Uncertain(10, 1),
+            'xbar': Uncertain(random.uniform(0, 2048), random.uniform(0, 2)),
+            'ybar': Uncertain(random.uniform(0, 2048), random.uniform(0, 2)),
+        }
+        paramsets.append(paramset)
+    return paramsets
+
+
+def scalar_physical_coordinates(det):
+    """
+    Reference implementation: the calculation for a single detection, one
+    position at a time, as Detection._physical_coordinates() used to do.
+    Returns a dict of the results.
+    """
+    wcs = det.imagedata.wcs
+    result = {}
+    ra, dec = wcs.p2s([det.x.value, det.y.value])
+    center_position = numpy.array([
+        numpy.cos(numpy.radians(dec)) * numpy.cos(numpy.radians(ra)),
+        numpy.cos(numpy.radians(dec)) * numpy.sin(numpy.radians(ra)),
+        numpy.sin(numpy.radians(dec))])
+    if center_position[2] != 0:
+        local_north_position = numpy.array([0., 0., 1./center_position[2]])
+    else:
+        local_north_position = numpy.array([0., 0., 99e99])
+    endy_ra, endy_dec = wcs.p2s([det.x.value, det.y.value+1.])
+    endy_position = numpy.array([
+        numpy.cos(numpy.radians(endy_dec)) * numpy.cos(numpy.radians(endy_ra)),
+        numpy.cos(numpy.radians(endy_dec)) * numpy.sin(numpy.radians(endy_ra)),
+        numpy.sin(numpy.radians(endy_dec))])
+    endy_position /= numpy.dot(center_position, endy_position)
+    diff1 = endy_position-center_position
+    diff2 = local_north_position-center_position
+    cross_prod = numpy.cross(diff2, diff1)
+    length_cross_sq = numpy.dot(cross_prod, cross_prod)
+    normalization = numpy.dot(diff1, diff1) * numpy.dot(diff2, diff2)
+    yoffs_rad = (numpy.arccos(numpy.dot(diff1, diff2) /
+                              numpy.sqrt(normalization)))
+    sign_cor = (numpy.dot(cross_prod, center_position) /
+                numpy.sqrt(length_cross_sq))
+    yoffs_rad *= -sign_cor
+    yoffset_angle = numpy.degrees(yoffs_rad)
+    errorx_proj = numpy.sqrt(
+        (det.x.error*numpy.cos(yoffs_rad))**2 +
+        (det.y.error*numpy.sin(yoffs_rad))**2)
+    errory_proj = numpy.sqrt(
+        (det.x.error*numpy.sin(yoffs_rad))**2 +
+        (det.y.error*numpy.cos(yoffs_rad))**2)
+    try:
+        end_ra1, end_dec1 = wcs.p2s([det.x.value+errorx_proj, det.y.value])
+        end_ra2, end_dec2 = wcs.p2s([det.x.value, det.y.value+errory_proj])
+        result['ra_error'] = det.eps_ra + max(
+            numpy.fabs(ra - end_ra1), numpy.fabs(ra - end_ra2))
+        result['dec_error'] = det.eps_dec + max(
+            numpy.fabs(dec - end_dec1), numpy.fabs(dec - end_dec2))
+    except RuntimeError:
+        result['ra_error'] = result['dec_error'] = float('inf')
+    result['ra'], result['dec'] = ra, dec
+    result['error_radius'] = get_error_radius(
+        wcs, det.x.value, det.x.error, det.y.value, det.y.error)
+    result['theta_celes'] = (
+        numpy.degrees(det.theta.value) + yoffset_angle) % 180
+    result['theta_dc_celes'] = (det.theta_dc.value + yoffset_angle) % 180
+
+    def pixel_to_spatial(x, y):
+        try:
+            return wcs.p2s([x, y])
+        except RuntimeError:
+            return numpy.nan, numpy.nan
+    end_smaj_ra, end_smaj_dec = pixel_to_spatial(
+        det.x.value - numpy.sin(det.theta.value) * det.smaj.value,
+        det.y.value + numpy.cos(det.theta.value) * det.smaj.value)
+    end_smin_ra, end_smin_dec = pixel_to_spatial(
+        det.x.value + numpy.cos(det.theta.value) * det.smin.value,
+        det.y.value + numpy.sin(det.theta.value) * det.smin.value)
+    result['smaj_asec'] = coordinates.angsep(ra, dec, end_smaj_ra,
+                                             end_smaj_dec)
+    result['smin_asec'] = coordinates.angsep(ra, dec, end_smin_ra,
+                                             end_smin_dec)
+    result['smaj_asec_error'] = (result['smaj_asec'] / det.smaj.value *
+                                 det.smaj.error)
+    result['smin_asec_error'] = (result['smin_asec'] / det.smin.value *
+                                 det.smin.error)
+    return result
+
+
+class TestPhysicalCoordinates(unittest.TestCase):
+    def assertMatchesScalar(self, image, paramsets):
+        detections = [Detection(paramset, image, convert_coordinates=False)
+                      for paramset in paramsets]
+        physical_coordinates(detections)
+        for det in detections:
+            expected = scalar_physical_coordinates(det)
+            result = {
+                'ra': det.ra.value, 'dec': det.dec.value,
+                'ra_error': det.ra.error, 'dec_error': det.dec.error,
+                'error_radius': det.error_radius,
+                'theta_celes': det.theta_celes.value,
+                'theta_dc_celes': det.theta_dc_celes.value,
+                'smaj_asec': det.smaj_asec.value,
+                'smin_asec': det.smin_asec.value,
+                'smaj_asec_error': det.smaj_asec.error,
+                'smin_asec_error': det.smin_asec.error,
+            }
+            for key in expected:
+                numpy.testing.assert_allclose(
+                    result[key], expected[key], rtol=1e-9, atol=1e-9,
+                    err_msg=key)
+        return detections
+
+    def test_equator(self):
+        self.assertMatchesScalar(make_image((15.0, 0.0)), make_paramsets(200))
+
+    def test_mid_declination(self):
+        self.assertMatchesScalar(make_image((200.0, 45.0)),
+                                 make_paramsets(200, seed=1))
+
+    def test_ncp(self):
+        self.assertMatchesScalar(make_image((15.0, 90.0)),
+                                 make_paramsets(200, seed=2))
+
+    def test_errors_off_the_sky(self):
+        # A detection near the edge of the sky with large position errors
+        # gets infinite errors, like it used to.
+        image = make_image((15.0, 0.0))
+        image.wcs.cdelt = (-0.1, 0.1)
+        paramsets = make_paramsets(2)
+        for paramset in paramsets:
+            paramset.values['xbar'] = Uncertain(1025, 1)
+            paramset.values['ybar'] = Uncertain(1025, 1)
+        paramsets[1].values['xbar'] = Uncertain(1025 + 570, 50)
+        detections = self.assertMatchesScalar(image, paramsets)
+        self.assertEqual(detections[1].ra.error, float('inf'))
+        self.assertEqual(detections[1].error_radius, float('inf'))
+        self.assertNotEqual(detections[0].ra.error, float('inf'))
+
+    def test_single_detection(self):
+        # Detection calculates its own coordinates by default.
+        image = make_image((15.0, 0.0))
+        paramset = make_paramsets(1)[0]
+        det = Detection(paramset, image)
+        expected = scalar_physical_coordinates(det)
+        self.assertAlmostEqual(det.ra.value, expected['ra'])
+        self.assertAlmostEqual(det.dec.error, expected['dec_error'])
+
+    def test_centre_off_the_sky(self):
+        image = make_image((15.0, 0.0))
+        image.wcs.cdelt = (-0.1, 0.1)
+        paramsets = make_paramsets(2)
+        for paramset in paramsets:
+            paramset.values['xbar'] = Uncertain(1025, 1)
+            paramset.values['ybar'] = Uncertain(1025, 1)
+        paramsets[1].values['xbar'] = Uncertain(1025 + 1000, 1)
+        detections = [Detection(paramset, image, convert_coordinates=False)
+                      for paramset in paramsets]
+        self.assertRaises(RuntimeError, physical_coordinates, detections)
+
+    def test_empty(self):
+        physical_coordinates([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for rendering the sources and residuals of an image.
+"""
+import math
+
+import numpy
+import unittest
+
+from tkp.sourcefinder.gaussian import gaussian
+from tkp.sourcefinder.image import ImageData
+from tkp.sourcefinder.utils import generate_result_maps
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+
+
+def legacy_result_maps(data, sourcelist):
+    """
+    The former generate_result_maps(), which evaluates numpy.indices() over
+    the whole image for every source.
+    """
+    residual_map = numpy.array(data)
+    gaussian_map = numpy.zeros(residual_map.shape)
+    for src in sourcelist:
+        box_size = 6 * src.smaj.value / math.sqrt(2 * math.log(2))
+        lower_bound_x = max(0, int(src.x.value - 1 - box_size))
+        upper_bound_x = min(residual_map.shape[0],
+                            int(src.x.value - 1 + box_size))
+        lower_bound_y = max(0, int(src.y.value - 1 - box_size))
+        upper_bound_y = min(residual_map.shape[1],
+                            int(src.y.value - 1 + box_size))
+        local_gaussian = gaussian(
+            src.peak.value, src.x.value, src.y.value, src.smaj.value,
+            src.smin.value, src.theta.value
+        )(
+            numpy.indices(residual_map.shape)[
+                0, lower_bound_x:upper_bound_x, lower_bound_y:upper_bound_y],
+            numpy.indices(residual_map.shape)[
+                1, lower_bound_x:upper_bound_x, lower_bound_y:upper_bound_y]
+        )
+        gaussian_map[lower_bound_x:upper_bound_x,
+                     lower_bound_y:upper_bound_y] += local_gaussian
+        residual_map[lower_bound_x:upper_bound_x,
+                     lower_bound_y:upper_bound_y] -= local_gaussian
+    return gaussian_map, residual_map
+
+
+def extracted(shape, nsources):
+    data = noise_with_sources(shape, nsources)
+    imagedata = ImageData(data, beam, equatorial_wcs())
+    return data, imagedata.extract(det=10, anl=3)
+
+
+class TestResultMaps(unittest.TestCase):
+    def assertSameMaps(self, data, sources):
+        for result, expected in zip(generate_result_maps(data, sources),
+                                    legacy_result_maps(data, sources)):
+            numpy.testing.assert_array_equal(result, expected)
+
+    def test_same_as_whole_image_grid(self):
+        data, sources = extracted((256, 256), 40)
+        self.assertTrue(len(sources) > 20)
+        self.assertSameMaps(data, sources)
+
+    def test_edges(self):
+        # Sources near the edges are clipped to the image.
+        data, sources = extracted((128, 128), 10)
+        source = sources[0]
+        for x, y in ((0.5, 64), (127.5, 1), (64, 140)):
+            source.x.value, source.y.value = x, y
+            self.assertSameMaps(data, [source])
+
+    def test_off_image(self):
+        # The box of a source far below the image used to end at a negative
+        # index, which selected most of the image instead of none of it.
+        data, sources = extracted((128, 128), 10)
+        source = sources[0]
+        for x, y in ((-60, 64), (64, -60), (64, 300)):
+            source.x.value, source.y.value = x, y
+            gaussian_map, residual_map = generate_result_maps(data, [source])
+            self.assertFalse(gaussian_map.any())
+            numpy.testing.assert_array_equal(residual_map, data)
+
+    def test_no_sources(self):
+        data = numpy.ones((10, 20))
+        gaussian_map, residual_map = generate_result_maps(data, [])
+        numpy.testing.assert_array_equal(gaussian_map, numpy.zeros((10, 20)))
+        numpy.testing.assert_array_equal(residual_map, data)
+        self.assertFalse(residual_map is data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+Tests for the iterative sigma clipping in tkp.sourcefinder.stats.
+"""
+import numpy
+from numpy.testing import assert_array_equal, assert_allclose
+
+import unittest
+
+from tkp.sourcefinder import stats
+
+
+beam = (2.5, 2., 0.5)
+
+
+def recursive_sigma_clip(data, beam, sigma=stats.unbiased_sigma,
+                         my_iterations=0, corr_clip=1.):
+    """
+    Reference implementation: sigma_clip as it used to be, recursing until
+    no more data is clipped.
+    """
+    centre = numpy.median(data)
+    N = numpy.size(data)
+    N_indep = stats.indep_pixels(N, beam)
+    if N_indep < 1:
+        return numpy.array([]), 0, 0, 0
+    my_sigma = sigma(N_indep) if callable(sigma) else sigma
+    clipped_var = numpy.var(data) * (N - 1.) * N_indep / (N * (N_indep - 1.))
+    unbiased_var = corr_clip * clipped_var
+    c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+    unbiased_std = numpy.sqrt(unbiased_var) / c4
+    limit = my_sigma * unbiased_std
+    newdata = data.compress(abs(data - centre) <= limit)
+    if len(newdata) != len(data) and len(newdata) > 0:
+        return recursive_sigma_clip(newdata, beam, sigma, my_iterations + 1,
+                                    stats.var_helper(my_sigma))
+    else:
+        return newdata, unbiased_std, centre, my_iterations
+
+
+def noise_with_outliers(size, noutliers, seed=0):
+    random = numpy.random.RandomState(seed)
+    data = random.normal(1.0, 0.5, size)
+    data[random.randint(0, size, noutliers)] += random.uniform(
+        2, 200, noutliers)
+    return data
+
+
+class TestSigmaClip(unittest.TestCase):
+    def assertClipEqual(self, result, expected):
+        self.assertEqual(result[3], expected[3])
+        assert_array_equal(numpy.sort(result[0]), numpy.sort(expected[0]))
+        assert_allclose(result[1:3], expected[1:3], rtol=1e-12)
+
+    def test_noise(self):
+        data = numpy.random.RandomState(1).normal(0, 1, 10000)
+        self.assertClipEqual(stats.sigma_clip(data, beam),
+                             recursive_sigma_clip(data, beam))
+
+    def test_outliers(self):
+        for seed in range(10):
+            data = noise_with_outliers(2500, 100, seed)
+            self.assertClipEqual(stats.sigma_clip(data, beam),
+                                 recursive_sigma_clip(data, beam))
+
+    def test_even_and_odd(self):
+        for size in (1000, 1001):
+            data = noise_with_outliers(size, 20)
+            self.assertClipEqual(stats.sigma_clip(data, beam),
+                                 recursive_sigma_clip(data, beam))
+
+    def test_hard_limit(self):
+        data = noise_with_outliers(2500, 100)
+        self.assertClipEqual(stats.sigma_clip(data, beam, sigma=3),
+                             recursive_sigma_clip(data, beam, sigma=3))
+
+    def test_masked(self):
+        data = noise_with_outliers(2500, 100)
+        mask = numpy.zeros(data.shape, dtype=bool)
+        mask[::7] = True
+        self.assertClipEqual(
+            stats.sigma_clip(numpy.ma.array(data, mask=mask), beam),
+            recursive_sigma_clip(data[~mask], beam))
+
+    def test_too_small(self):
+        self.assertEqual(stats.sigma_clip(numpy.ones(5), beam)[1:],
+                         (0, 0, 0))
+
+    def test_input_unchanged(self):
+        data = noise_with_outliers(2500, 100)
+        original = data.copy()
+        stats.sigma_clip(data, beam)
+        assert_array_equal(data, original)
+
+    def test_max_iter(self):
+        data = noise_with_outliers(2500, 100)
+        clipped, sigma, centre, iterations = stats.sigma_clip(
+            data, beam, max_iter=1)
+        self.assertEqual(iterations, 1)
+        self.assertTrue(len(clipped) < len(data))
+
+    def test_warm_start(self):
+        # Clipping similar data about the previous results converges in
+        # fewer iterations, to nearly the same results.
+        previous = stats.sigma_clip(noise_with_outliers(2500, 100, seed=1),
+                                    beam)
+        for seed in range(2, 12):
+            data = noise_with_outliers(2500, 100, seed=seed)
+            cold = stats.sigma_clip(data, beam)
+            warm = stats.sigma_clip(data, beam, initial_centre=previous[2],
+                                    initial_std=previous[1])
+            self.assertTrue(warm[3] < cold[3])
+            self.assertTrue(abs(len(warm[0]) - len(cold[0])) <= 5)
+            assert_allclose(warm[1:3], cold[1:3], rtol=1e-2)
+
+    def test_warm_start_differs(self):
+        # The results of a warm start are close to, but not the same as,
+        # those of a cold start: too small an initial standard deviation
+        # leaves the data clipped a little too tightly.
+        data = noise_with_outliers(2500, 100, seed=1)
+        cold = stats.sigma_clip(data, beam)
+        warm = stats.sigma_clip(data, beam, initial_centre=cold[2],
+                                initial_std=0.9 * cold[1])
+        self.assertNotEqual(warm[1], cold[1])
+        assert_allclose(warm[1], cold[1], rtol=5e-2)
+
+    def test_warm_start_nothing_to_clip(self):
+        data = numpy.random.RandomState(1).normal(0, 1, 10000)
+        expected = recursive_sigma_clip(data, beam)
+        result = stats.sigma_clip(data, beam, initial_centre=0,
+                                  initial_std=100)
+        assert_allclose(result[1:3], expected[1:3], rtol=1e-12)
+
+    def test_warm_start_clips_everything(self):
+        data = numpy.random.RandomState(1).normal(0, 1, 10000)
+        expected = recursive_sigma_clip(data, beam)
+        result = stats.sigma_clip(data, beam, initial_centre=100,
+                                  initial_std=1)
+        self.assertEqual(len(result[0]), len(expected[0]))
+        assert_allclose(result[1:3], expected[1:3], rtol=1e-12)
+
+
+class TestSigmaClipTiles(unittest.TestCase):
+    def setUp(self):
+        self.tiles = numpy.array([noise_with_outliers(2500, 100, seed)
+                                  for seed in range(20)])
+
+    def test_same_as_sigma_clip(self):
+        n, std, centre, mean, iterations = stats.sigma_clip_tiles(
+            self.tiles, beam)
+        for index, row in enumerate(self.tiles):
+            expected = stats.sigma_clip(row, beam)
+            self.assertEqual(n[index], len(expected[0]))
+            self.assertEqual(iterations[index], expected[3])
+            assert_allclose((std[index], centre[index]), expected[1:3],
+                            rtol=1e-10)
+
+    def test_warm_start(self):
+        # Seeding each row with the results for its neighbour takes fewer
+        # iterations, and agrees with a cold start within the noise.
+        cold = stats.sigma_clip_tiles(self.tiles, beam)
+        seeds = numpy.roll(cold[2], 1), numpy.roll(cold[1], 1)
+        warm = stats.sigma_clip_tiles(self.tiles, beam,
+                                      initial_centre=seeds[0],
+                                      initial_std=seeds[1])
+        self.assertTrue(warm[4].sum() < cold[4].sum())
+        self.assertTrue((abs(warm[0] - cold[0]) <= 5).all())
+        for result, expected in zip(warm[1:4], cold[1:4]):
+            assert_allclose(result, expected, rtol=1e-2)
+
+    def test_cold_rows(self):
+        # Rows without usable initial values start cold.
+        cold = stats.sigma_clip_tiles(self.tiles, beam)
+        warm = stats.sigma_clip_tiles(self.tiles, beam,
+                                      initial_centre=numpy.nan,
+                                      initial_std=0)
+        for result, expected in zip(warm, cold):
+            assert_array_equal(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for extracting sources from an image in tiles.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy
+import pyfits
+from numpy.testing import assert_allclose
+import unittest
+
+from tkp.accessors.fitsimage import FitsImage
+from tkp.sourcefinder.image import ImageData
+from tkp.sourcefinder.tiled import TiledImage, BYTES_PER_PIXEL
+from tkp.testutil.images import beam, equatorial_wcs, noise_with_sources
+from tkp.testutil.sourcefinder import catalogue
+
+
+class TestTiledImage(unittest.TestCase):
+    def setUp(self):
+        self.data = noise_with_sources((400, 300), 80)
+        self.data[50:60, 200:240] = numpy.nan
+        self.data[300:302, :] = 0
+        self.kwargs = dict(margin=10, radius=180, back_size_x=40,
+                           back_size_y=30)
+        self.imagedata = ImageData(self.data, beam, equatorial_wcs(),
+                                   **self.kwargs)
+        # Tiles of 160x160 pixels, including the overlap.
+        self.tiled = TiledImage(self.data, beam, equatorial_wcs(),
+                                memory_budget=160**2 * BYTES_PER_PIXEL,
+                                overlap=30, **self.kwargs)
+
+    def test_tiles(self):
+        tiles = self.tiled.tiles
+        self.assertTrue(len(tiles) > 1)
+        covered = numpy.zeros(self.data.shape, dtype=numpy.int)
+        for core, extended in tiles:
+            covered[core] += 1
+            self.assertTrue(covered[extended].size <= 160**2)
+        self.assertTrue((covered == 1).all())
+
+    def test_grids(self):
+        for key in ('rms', 'bg'):
+            numpy.testing.assert_array_equal(
+                self.tiled.grids[key].mask, self.imagedata.grids[key].mask)
+            assert_allclose(self.tiled.grids[key].filled(0),
+                            self.imagedata.grids[key].filled(0), rtol=1e-12)
+
+    def test_rms_median(self):
+        self.assertEqual(self.tiled.rms_median,
+                         numpy.ma.median(self.imagedata.rmsmap))
+
+    def test_maps(self):
+        # The maps for each tile are the corresponding parts of those for
+        # the whole image.
+        for core, extended in self.tiled.tiles:
+            tile = self.tiled._tile(extended)
+            for tiled_map, whole_map in ((tile.rmsmap, self.imagedata.rmsmap),
+                                         (tile.backmap, self.imagedata.backmap)):
+                numpy.testing.assert_array_equal(
+                    numpy.ma.getmaskarray(tiled_map),
+                    numpy.ma.getmaskarray(whole_map[extended]))
+                assert_allclose(tiled_map.filled(0),
+                                whole_map[extended].filled(0), rtol=1e-12)
+
+    def test_same_catalogue(self):
+        expected = catalogue(self.imagedata.extract(det=10, anl=3))
+        result = catalogue(self.tiled.extract(det=10, anl=3))
+        self.assertTrue(len(expected) > 10)
+        self.assertEqual(result.shape, expected.shape)
+        assert_allclose(result, expected, rtol=1e-8)
+
+    def test_small_overlap(self):
+        # Islands extending beyond the overlap are measured in a window of
+        # their own, so we still find the same sources.
+        tiled = TiledImage(self.data, beam, equatorial_wcs(),
+                           memory_budget=160**2 * BYTES_PER_PIXEL,
+                           overlap=4, **self.kwargs)
+        expected = catalogue(self.imagedata.extract(det=10, anl=3))
+        result = catalogue(tiled.extract(det=10, anl=3))
+        self.assertEqual(result.shape, expected.shape)
+        assert_allclose(result, expected, rtol=1e-8)
+
+    def test_memmap(self):
+        # The data is only read, so it may be memory mapped from a FITS file.
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "image.fits")
+            wcs = equatorial_wcs()
+            header = pyfits.Header()
+            for i in (0, 1):
+                header['ctype%d' % (i + 1)] = wcs.ctype[i]
+                header['crval%d' % (i + 1)] = wcs.crval[i]
+                header['crpix%d' % (i + 1)] = wcs.crpix[i] + 1
+                header['cdelt%d' % (i + 1)] = wcs.cdelt[i]
+                header['cunit%d' % (i + 1)] = wcs.cunit[i]
+            header['telescop'] = 'LOFAR'
+            header['restfrq'], header['restbw'] = 1.5e8, 2e5
+            header['bmaj'] = header['bmin'] = header['bpa'] = 0.1
+            data = numpy.float32(self.data)
+            pyfits.writeto(filename, data.transpose(), header)
+
+            fitsimage = FitsImage(filename, memmap=True)
+            self.assertEqual(fitsimage.data.dtype.itemsize, 4)
+            numpy.testing.assert_array_equal(fitsimage.data, data)
+            tiled = TiledImage(fitsimage.data, beam, fitsimage.wcs,
+                               memory_budget=160**2 * BYTES_PER_PIXEL,
+                               overlap=30, **self.kwargs)
+            expected = ImageData(numpy.float64(data), beam, fitsimage.wcs,
+                                 **self.kwargs)
+            assert_allclose(catalogue(tiled.extract(det=10, anl=3)),
+                            catalogue(expected.extract(det=10, anl=3)),
+                            rtol=1e-8)
+            del fitsimage, tiled
+        finally:
+            shutil.rmtree(directory)
+
+    def test_masked(self):
+        tiled = TiledImage(numpy.zeros((100, 100)), beam, equatorial_wcs())
+        self.assertEqual(len(tiled.extract(det=10, anl=3)), 0)
+
+    def test_budget_too_small(self):
+        self.assertRaises(ValueError, TiledImage, self.data, beam,
+                          equatorial_wcs(),
+                          memory_budget=100**2 * BYTES_PER_PIXEL, overlap=64)
+
+
+if __name__ == '__main__':
+    unittest.main()
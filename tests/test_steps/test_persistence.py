@@ -1,4 +1,7 @@
 import os
+import shutil
+import tempfile
+import datetime
 import unittest
 import tkp.steps.persistence
 from tkp.testutil.decorators import requires_mongodb
@@ -60,6 +63,102 @@ class TestPersistence(unittest.TestCase):
         tkp.steps.persistence.node_steps(self.images, self.image_cache_pars, sigma=4, f=8)
 
 
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.directory, 'manifest.pkl')
+        self.images = []
+        for name in ('a.fits', 'b.fits'):
+            self.images.append(os.path.join(self.directory, name))
+            with open(self.images[-1], 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def metadata(self, image):
+        return {'url': image, 'rms_qc': 0.5,
+                'taustart_ts': datetime.datetime(2013, 1, 2, 3, 4, 5)}
+
+    def test_no_manifest(self):
+        self.assertEqual(
+            tkp.steps.persistence.read_manifest(self.manifest, self.images,
+                                                4, 8),
+            [None, None])
+
+    def test_incremental(self):
+        first, second = self.images
+        tkp.steps.persistence.update_manifest(
+            self.manifest, [self.metadata(first), False], 4, 8)
+        self.assertEqual(
+            tkp.steps.persistence.read_manifest(self.manifest, self.images,
+                                                4, 8),
+            [self.metadata(first), None])
+        tkp.steps.persistence.update_manifest(
+            self.manifest, [self.metadata(second)], 4, 8)
+        self.assertEqual(
+            tkp.steps.persistence.read_manifest(self.manifest, self.images,
+                                                4, 8),
+            [self.metadata(first), self.metadata(second)])
+        # The RMS depends on sigma and f.
+        self.assertEqual(
+            tkp.steps.persistence.read_manifest(self.manifest, self.images,
+                                                3, 8),
+            [None, None])
+
+    def test_changed(self):
+        first, second = self.images
+        tkp.steps.persistence.update_manifest(
+            self.manifest, [self.metadata(first), self.metadata(second)], 4, 8)
+        with open(first, 'a') as f:
+            f.write('changed')
+        self.assertEqual(
+            tkp.steps.persistence.read_manifest(self.manifest, self.images,
+                                                4, 8),
+            [None, self.metadata(second)])
+        # The entry of the earlier version of the image is replaced.
+        tkp.steps.persistence.update_manifest(
+            self.manifest, [self.metadata(first)], 4, 8)
+        self.assertEqual(
+            len(tkp.steps.persistence.load_manifest(self.manifest)), 2)
+
+    def test_node_steps(self):
+        # Only the metadata of images missing from the manifest is
+        # extracted, but every image is copied to mongodb, and the results
+        # are in the order of the images.
+        first, second = self.images
+        tkp.steps.persistence.update_manifest(
+            self.manifest, [self.metadata(second)], 4, 8)
+        copied, extracted = [], []
+        def image_to_mongodb(filename, hostname, port, db):
+            copied.append(filename)
+        def extract_metadatas(images, sigma, f, image_cache_config=None):
+            extracted.extend(images)
+            return [self.metadata(image) for image in images]
+        originals = (tkp.steps.persistence.image_to_mongodb,
+                     tkp.steps.persistence.extract_metadatas)
+        tkp.steps.persistence.image_to_mongodb = image_to_mongodb
+        tkp.steps.persistence.extract_metadatas = extract_metadatas
+        try:
+            metadatas = tkp.steps.persistence.node_steps(
+                self.images, {'mongo_host': 'localhost', 'mongo_port': 27017,
+                              'mongo_db': 'tkp', 'copy_images': True},
+                4, 8, self.manifest)
+        finally:
+            (tkp.steps.persistence.image_to_mongodb,
+             tkp.steps.persistence.extract_metadatas) = originals
+        self.assertEqual(metadatas, [self.metadata(first),
+                                     self.metadata(second)])
+        self.assertEqual(copied, self.images)
+        self.assertEqual(extracted, [first])
+
+    def test_unreadable(self):
+        with open(self.manifest, 'w') as f:
+            f.write('garbage')
+        self.assertEqual(tkp.steps.persistence.load_manifest(self.manifest),
+                         {})
+
+
 @requires_mongodb()
 class TestMongoDb(unittest.TestCase):
     @classmethod
@@ -1,3 +1,8 @@
+import os
+import json
+import shutil
+import datetime
+import tempfile
 import unittest
 import numpy as np
 from ConfigParser import SafeConfigParser
@@ -8,6 +13,7 @@ from tkp.testutil.mock import Mock
 import tkp.steps.source_extraction
 from tkp.db import DataSet
 from tkp.testutil.data import fits_file
+from tkp.utility.profiling import Profile
 
 
 class MockImage(Mock):
@@ -59,3 +65,38 @@ class TestSourceExtraction(unittest.TestCase):
         self.assertIn('anl', mock_method.returnvalue.callvalues[0][1])
         self.assertIn('force_beam', mock_method.returnvalue.callvalues[0][1])
         self.assertIn('deblend_nthresh', mock_method.returnvalue.callvalues[0][1])
+
+
+class TestDumpProfiles(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_dump_profiles(self):
+        timestep = datetime.datetime(2013, 1, 2, 3, 4, 5)
+        profile = Profile()
+        with profile.stage('fit', islands=5):
+            pass
+        results = [
+            tkp.steps.source_extraction.ExtractionResults(
+                [], 0., 1., profile.report()),
+            tkp.steps.source_extraction.ExtractionResults([], 0., 1., None)]
+        path = tkp.steps.source_extraction.dump_profiles(
+            self.log_dir, timestep, ['a.fits', 'b.fits'], results)
+        self.assertEqual(os.path.basename(path),
+                         'source_extraction_profile_20130102T030405.json')
+        with open(path) as f:
+            dumped = json.load(f)
+        self.assertEqual(dumped['timestep'], '2013-01-02T03:04:05')
+        self.assertEqual(dumped['images'].keys(), ['a.fits'])
+        self.assertEqual(dumped['images']['a.fits']['islands']['fit']['1-9'],
+                         profile.stages['fit'])
+
+    def test_no_profiles(self):
+        results = [tkp.steps.source_extraction.ExtractionResults(
+            [], 0., 1., None)]
+        self.assertEqual(tkp.steps.source_extraction.dump_profiles(
+            self.log_dir, datetime.datetime.now(), ['a.fits'], results), None)
+        self.assertEqual(os.listdir(self.log_dir), [])
@@ -0,0 +1,75 @@
+"""
+Tests for the on-disk store shared by the image and map caches.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tkp.utility.filecache import FileCache, file_status
+
+
+class PairCache(FileCache):
+    suffixes = (".data", ".meta")
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = PairCache(os.path.join(self.directory, "cache"), 250)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, key, age):
+        self.cache.write(key, ".data", lambda f: f.write("x" * 100))
+        self.cache.write(key, ".meta", lambda f: f.write("x" * 10))
+        then = time.time() - age
+        os.utime(self.cache.path(key, ".data"), (then, then))
+
+    def test_evict(self):
+        self.save("old", 200)
+        self.save("used", 100)
+        self.assertEqual(self.cache.size(), 220)
+        self.cache.touch("used")
+        self.save("new", 0)
+        self.cache.evict()
+        self.assertEqual(sorted(os.listdir(self.cache.directory)),
+                         ["new.data", "new.meta", "used.data", "used.meta"])
+        self.assertEqual(self.cache.size(), 220)
+
+    def test_touch_missing(self):
+        self.assertRaises(OSError, self.cache.touch, "missing")
+
+    def test_failed_write(self):
+        def write(f):
+            raise IOError("disk full")
+        self.assertRaises(IOError, self.cache.write, "key", ".data", write)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+
+class TestFileStatus(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_directory(self):
+        # The files in a directory are rewritten without changing its own
+        # modification time.
+        path = os.path.join(self.directory, "image")
+        os.mkdir(path)
+        with open(os.path.join(path, "table.f0"), 'w') as f:
+            f.write("first")
+        status = file_status(path)
+        directory_status = os.stat(path)
+        with open(os.path.join(path, "table.f0"), 'w') as f:
+            f.write("second")
+        os.utime(path, (directory_status.st_atime, directory_status.st_mtime))
+        self.assertNotEqual(file_status(path), status)
+
+
+if __name__ == '__main__':
+    unittest.main()
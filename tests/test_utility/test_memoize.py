@@ -0,0 +1,174 @@
+import gc
+import unittest
+
+import numpy
+
+from tkp.utility.memoize import Memoize, MemoCache, nbytes
+from tkp.sourcefinder.image import ImageData
+from tkp.utility import memoize
+from tkp.utility.coordinates import WCS
+
+
+class Arrays(object):
+    """Memoizes arrays of 100 doubles, counting how often each is made."""
+    def __init__(self):
+        self.calls = {'first': 0, 'second': 0, 'third': 0}
+
+    def _make(self, name):
+        self.calls[name] += 1
+        return numpy.zeros(100)
+
+    @Memoize
+    def _first(self):
+        return self._make('first')
+    first = property(fget=_first, fdel=_first.delete)
+
+    @Memoize
+    def _second(self):
+        return self._make('second')
+    second = property(fget=_second, fdel=_second.delete)
+
+    @Memoize
+    def _third(self):
+        return self._make('third')
+    third = property(fget=_third, fdel=_third.delete)
+
+
+def make_arrays(max_bytes):
+    # Each test gets a cache of its own.
+    cache = MemoCache(max_bytes)
+    for name in ('_first', '_second', '_third'):
+        getattr(Arrays, name).cache = cache
+    return Arrays(), cache
+
+
+class TestNbytes(unittest.TestCase):
+    def test_nbytes(self):
+        self.assertEqual(nbytes(numpy.zeros(10)), 80)
+        self.assertEqual(nbytes(numpy.ma.zeros(10)), 80)
+        self.assertEqual(nbytes(numpy.ma.array(numpy.zeros(10),
+                                               mask=numpy.ones(10))), 90)
+        self.assertEqual(nbytes({'bg': numpy.zeros(10),
+                                 'rms': [numpy.zeros(5, dtype=numpy.int8)]}),
+                         85)
+        self.assertEqual(nbytes(None), 0)
+        self.assertEqual(nbytes(1.5), 0)
+
+
+class TestMemoCache(unittest.TestCase):
+    def test_unlimited(self):
+        arrays, cache = make_arrays(None)
+        arrays.first, arrays.second, arrays.third, arrays.first
+        self.assertEqual(cache.nbytes, 2400)
+        self.assertEqual(arrays.calls, {'first': 1, 'second': 1, 'third': 1})
+        stats = cache.stats(arrays)
+        self.assertEqual(stats['_first'], {'hits': 1, 'misses': 1,
+                                           'recomputes': 0, 'evictions': 0,
+                                           'bytes': 800})
+        self.assertEqual(stats['_third']['hits'], 0)
+
+    def test_least_recently_used(self):
+        arrays, cache = make_arrays(2000)
+        arrays.first, arrays.second
+        arrays.first
+        # Second is the least recently used.
+        arrays.third
+        self.assertEqual(cache.nbytes, 1600)
+        self.assertEqual(cache.stats(arrays)['_second']['evictions'], 1)
+        self.assertEqual(cache.stats(arrays)['_second']['bytes'], 0)
+        arrays.first
+        self.assertEqual(arrays.calls, {'first': 1, 'second': 1, 'third': 1})
+        # Now third is.
+        arrays.second
+        self.assertEqual(arrays.calls, {'first': 1, 'second': 2, 'third': 1})
+        stats = cache.stats(arrays)
+        self.assertEqual(stats['_second']['misses'], 1)
+        self.assertEqual(stats['_second']['recomputes'], 1)
+        self.assertEqual(stats['_third']['evictions'], 1)
+        self.assertEqual(cache.nbytes, 1600)
+
+    def test_larger_than_budget(self):
+        # The value just calculated is kept, whatever its size.
+        arrays, cache = make_arrays(100)
+        arrays.first
+        self.assertEqual(cache.nbytes, 800)
+        arrays.second
+        self.assertEqual(cache.nbytes, 800)
+        arrays.second
+        self.assertEqual(arrays.calls['second'], 1)
+        self.assertEqual(cache.stats(arrays)['_first']['evictions'], 1)
+
+    def test_delete(self):
+        arrays, cache = make_arrays(None)
+        arrays.first, arrays.second
+        del(arrays.first)
+        del(arrays.first)
+        self.assertEqual(cache.nbytes, 800)
+        arrays.first
+        self.assertEqual(cache.stats(arrays)['_first']['recomputes'], 1)
+        self.assertEqual(cache.nbytes, 1600)
+
+    def test_instances(self):
+        # Values are shared out between instances, and forgotten with them.
+        first, cache = make_arrays(2000)
+        second = Arrays()
+        first.first, second.first, first.second
+        self.assertEqual(cache.stats(second)['_first']['evictions'], 0)
+        second.second
+        self.assertEqual(cache.stats(first)['_first']['evictions'], 1)
+        del(second)
+        gc.collect()
+        self.assertEqual(cache.nbytes, 800)
+        self.assertEqual(len(cache._entries), 1)
+
+
+class TestImageData(unittest.TestCase):
+    def setUp(self):
+        self.max_bytes = memoize.default_cache.max_bytes
+
+    def tearDown(self):
+        memoize.default_cache.max_bytes = self.max_bytes
+
+    def extract(self):
+        data = numpy.random.RandomState(0).normal(0, 1, (256, 256))
+        data[100:103, 100:103] += 50
+        data[200:202, 20:23] += 30
+        wcs = WCS()
+        wcs.cdelt = (-0.01, 0.01)
+        wcs.crota = (0.0, 0.0)
+        wcs.crpix = (128, 128)
+        wcs.crval = (15.0, 45.0)
+        wcs.ctype = ('RA---SIN', 'DEC--SIN')
+        wcs.cunit = ('deg', 'deg')
+        imagedata = ImageData(data, (2., 2., 0.), wcs)
+        return imagedata, [(det.x.value, det.y.value, det.peak.value)
+                           for det in imagedata.extract(det=10, anl=3)]
+
+    def test_budget(self):
+        # Under a budget smaller than a single map, maps are recalculated
+        # rather than held, with the same results.
+        memoize.default_cache.max_bytes = None
+        imagedata, expected = self.extract()
+        self.assertEqual(len(expected), 2)
+        stats = memoize.default_cache.stats(imagedata)
+        self.assertEqual(stats['_get_rm']['misses'], 1)
+        self.assertEqual(sum(s['recomputes'] for s in stats.values()), 0)
+        self.assertTrue(stats['_get_rm']['hits'] > 0)
+        self.assertTrue(stats['_get_rm']['bytes'] >= 256 * 256 * 8)
+
+        memoize.default_cache.max_bytes = 1000
+        imagedata, detections = self.extract()
+        self.assertEqual(detections, expected)
+        stats = memoize.default_cache.stats(imagedata)
+        self.assertTrue(sum(s['recomputes'] for s in stats.values()) > 0)
+        self.assertTrue(sum(s['evictions'] for s in stats.values()) > 0)
+        self.assertEqual(sum(s['bytes'] > 0 for s in stats.values()), 1)
+
+        imagedata.clearcache()
+        self.assertEqual(sum(s['bytes'] for s in
+                             memoize.default_cache.stats(imagedata).values()),
+                         0)
+
+
+if __name__ == '__main__':
+    unittest.main()
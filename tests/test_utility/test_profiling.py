@@ -0,0 +1,123 @@
+import os
+import time
+import unittest
+
+import numpy
+
+from tkp.sourcefinder.image import ImageData
+from tkp.utility import profiling
+from tkp.utility.coordinates import WCS
+from tkp.utility.profiling import Profile, island_bucket
+
+
+def make_imagedata(profile):
+    data = numpy.random.RandomState(0).normal(0, 1, (256, 256))
+    data[100:103, 100:103] += 50
+    data[200:202, 20:23] += 30
+    wcs = WCS()
+    wcs.cdelt = (-0.01, 0.01)
+    wcs.crota = (0.0, 0.0)
+    wcs.crpix = (128, 128)
+    wcs.crval = (15.0, 45.0)
+    wcs.ctype = ('RA---SIN', 'DEC--SIN')
+    wcs.cunit = ('deg', 'deg')
+    return ImageData(data, (2., 2., 0.), wcs, profile=profile)
+
+
+class TestProfile(unittest.TestCase):
+    def test_island_bucket(self):
+        self.assertEqual([island_bucket(n) for n in (0, 1, 9, 10, 99, 100,
+                                                     12345)],
+                         ['0', '1-9', '1-9', '10-99', '10-99', '100-999',
+                          '10000-99999'])
+
+    def test_nested(self):
+        # The time of a stage excludes that of the stages within it.
+        profile = Profile()
+        with profile.stage('outer'):
+            time.sleep(0.05)
+            with profile.stage('inner', islands=3):
+                time.sleep(0.1)
+        with profile.stage('inner', islands=30):
+            pass
+        stages = profile.stages
+        self.assertEqual(stages['outer']['calls'], 1)
+        self.assertEqual(stages['inner']['calls'], 2)
+        self.assertTrue(0.04 < stages['outer']['wall'] < 0.09)
+        self.assertTrue(stages['inner']['wall'] >= 0.09)
+        self.assertEqual(sorted(profile.islands['inner']), ['1-9', '10-99'])
+        self.assertEqual(profile.islands['inner']['10-99']['calls'], 1)
+        self.assertFalse('outer' in profile.islands)
+
+    def test_exception(self):
+        profile = Profile()
+        try:
+            with profile.stage('outer'):
+                with profile.stage('inner'):
+                    raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(profile.stages['inner']['calls'], 1)
+        self.assertEqual(profile.stages['outer']['calls'], 1)
+        with profile.stage('outer'):
+            pass
+        self.assertEqual(profile._nested, [])
+
+    def test_no_profile(self):
+        with profiling.stage(None, 'anything', islands=1):
+            pass
+
+    @unittest.skipUnless(os.path.exists('/proc/self/clear_refs'),
+                         "Peak memory can only be reset on Linux")
+    def test_peak_rss(self):
+        # Each stage has its own peak, which includes that of the stages
+        # nested within it, even after the memory has been freed.
+        size = 64 * 2**20
+        profile = Profile()
+        with profile.stage('outer'):
+            with profile.stage('allocate'):
+                data = numpy.ones(size // 8)
+                del data
+            with profile.stage('small'):
+                pass
+        stages = profile.stages
+        self.assertTrue(stages['allocate']['peak_rss'] >
+                        stages['small']['peak_rss'] + size / 2)
+        self.assertTrue(stages['outer']['peak_rss'] >=
+                        stages['allocate']['peak_rss'])
+        self.assertTrue(stages['allocate']['rss_increase'] < size / 2)
+        self.assertTrue(profile.report()['peak_rss'] >=
+                        stages['allocate']['peak_rss'])
+        self.assertTrue(profiling.lifetime_peak_rss() >=
+                        stages['allocate']['peak_rss'])
+
+
+class TestImageDataProfile(unittest.TestCase):
+    def test_stages(self):
+        profile = Profile()
+        detections = make_imagedata(profile).extract(det=10, anl=3,
+                                                     deblend_nthresh=2)
+        self.assertEqual(len(detections), 2)
+        self.assertEqual(sorted(profile.stages), [
+            'deblend', 'detections', 'errors', 'fit', 'grids', 'interpolate',
+            'label_islands', 'measure'])
+        self.assertEqual(profile.stages['interpolate']['calls'], 2)
+        self.assertEqual(profile.islands['fit'], {
+            '1-9': profile.stages['fit']})
+        report = profile.report()
+        self.assertTrue(report['peak_rss'] > 0)
+        for totals in report['stages'].values():
+            self.assertTrue(totals['wall'] >= 0)
+            self.assertTrue(totals['cpu'] >= 0)
+            if 'peak_rss' in totals:
+                self.assertTrue(0 < totals['peak_rss'] <= report['peak_rss'])
+            else:
+                self.assertTrue(totals['max_rss_growth'] >= 0)
+
+    def test_unprofiled(self):
+        self.assertEqual(
+            len(make_imagedata(None).extract(det=10, anl=3)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import unittest
 
+import numpy
+
 from tkp.utility import coordinates
 from tkp.sourcefinder import extract
 from tkp.utility.uncertain import Uncertain
@@ -115,6 +117,30 @@ class wcsSin(unittest.TestCase):
         result = map(round, self.wcs.s2p(self.wcs.p2s(pixel)))
         self.assertEqual(result, pixel)
 
+    def testAllPixelToSpatial(self):
+        pixels = [pixel for pixel, spatial in self.known_values]
+        result = self.wcs.all_p2s(pixels)
+        self.assertEqual(result.shape, (len(pixels), 2))
+        for pixel, position in zip(pixels, result):
+            self.assertEqual(list(position), list(self.wcs.p2s(pixel)))
+
+    def testAllSpatialToPixel(self):
+        positions = [spatial for pixel, spatial in self.known_values]
+        result = self.wcs.all_s2p(positions)
+        self.assertEqual(result.shape, (len(positions), 2))
+        for position, pixel in zip(positions, result):
+            self.assertEqual(list(pixel), list(self.wcs.s2p(position)))
+
+    def testAllInvalid(self):
+        # Rather than raising, invalid positions are NaN.
+        result = self.wcs.all_p2s([[1442.0, 1442.0], [1e6, 1e6]])
+        self.assertEqual(list(result[0]), list(self.wcs.p2s([1442.0, 1442.0])))
+        self.assertTrue(numpy.isnan(result[1]).all())
+        self.assertRaises(RuntimeError, self.wcs.p2s, [1e6, 1e6])
+
+    def testAllEmpty(self):
+        self.assertEqual(self.wcs.all_p2s(numpy.zeros((0, 2))).shape, (0, 2))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -82,12 +82,22 @@ def open(path, *args, **kwargs):
 
     Will raise an exception if something went wrong or no matching accessor
     class is found.
+
+    A FITS file is opened only once, for both detecting and constructing its
+    accessor.
+
+    If lazy=True is given, the accessor parses the image's metadata but
+    reads its pixels only when they are used.
     """
     if not os.access(path, os.F_OK):
         raise IOError("%s does not exist!" % path)
     if not os.access(path, os.R_OK):
         raise IOError("Don't have permission to read %s!" % path)
-    Accessor = tkp.accessors.detection.detect(path)
+    memmap = kwargs.get('memmap', False) or kwargs.get('lazy', False)
+    hdulist = tkp.accessors.detection.open_fits(path, memmap=memmap)
+    Accessor = tkp.accessors.detection.detect(path, hdulist)
     if not Accessor:
         raise IOError("no accessor found for %s" % path)
+    if hdulist is not None:
+        kwargs['hdulist'] = hdulist
     return Accessor(path, *args, **kwargs)
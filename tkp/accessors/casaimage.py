@@ -11,11 +11,14 @@ logger = logging.getLogger(__name__)
 class CasaImage(DataAccessor):
     # NB CasaImage does not provide tau_time or taustart_ts, so cannot be
     # instantiated.
-    def __init__(self, url, plane=0, beam=None):
+    def __init__(self, url, plane=0, beam=None, dtype=None, lazy=False):
         super(CasaImage, self).__init__()
         self._url = url
-        table = pyrap_table(self.url.encode(), ack=False)
-        self._data = parse_data(table, plane)
+        self._table = None
+        table = self.table
+        # If lazy, the data is only read from the table when it is used.
+        self._plane, self._dtype = plane, dtype
+        self._data = None if lazy else parse_data(table, plane, dtype)
         self._wcs = parse_coordinates(table)
         self._centre_ra, self._centre_decl = parse_phase_centre(table)
         self._freq_eff, self._freq_bw = parse_frequency(table)
@@ -32,8 +35,17 @@ class CasaImage(DataAccessor):
     def wcs(self):
         return self._wcs
 
+    @property
+    def table(self):
+        """The main table of the image, opened once and reused."""
+        if self._table is None:
+            self._table = pyrap_table(self.url.encode(), ack=False)
+        return self._table
+
     @property
     def data(self):
+        if self._data is None:
+            self._data = parse_data(self.table, self._plane, self._dtype)
         return self._data
 
     @property
@@ -65,16 +77,32 @@ class CasaImage(DataAccessor):
         return self._beam
 
 
-def parse_data(table, plane=0):
-    """extract and massage data from CASA table"""
-    data = table[0]['map'].squeeze()
-    planes = len(data.shape)
-    if planes != 2:
-        msg = "received datacube with %s planes, assuming Stokes I and taking plane 0" % planes
+def parse_data(table, plane=0, dtype=None):
+    """extract and massage data from CASA table
+
+    Only the requested plane of a datacube is read from the table: the first
+    axis, beyond the two image axes, which has more than one pixel is
+    indexed by plane, and any others by 0.
+
+    The data is converted to dtype, if given.
+    """
+    # Shape of the map, in numpy order: the image axes are last.
+    shape = [int(n) for n in
+             table.getcolshapestring('map', 0, 1)[0].strip('[]').split(',')]
+    blc = [0] * len(shape)
+    trc = [n - 1 for n in shape]
+    cube_axes = [axis for axis, n in enumerate(shape[:-2]) if n > 1]
+    if cube_axes:
+        msg = "received datacube with %s planes, assuming Stokes I and taking plane 0" % (len(cube_axes) + 2)
         logger.warn(msg)
         warnings.warn(msg)
-        data = data[plane, :, :]
+        blc[cube_axes[0]] = trc[cube_axes[0]] = plane
+        for axis in cube_axes[1:]:
+            trc[axis] = 0
+    data = table.getcellslice('map', 0, blc, trc).reshape(shape[-2:])
     data = data.transpose()
+    if dtype is not None:
+        data = data.astype(dtype)
     return data
 
 def parse_coordinates(table):
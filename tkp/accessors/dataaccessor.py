@@ -1,6 +1,6 @@
 import abc
 import logging
-from tkp.quality.statistics import rms_with_clipped_subregion
+from tkp.quality.statistics import rms, clip, subregion
 
 logger = logging.getLogger(__name__)
 
@@ -112,7 +112,16 @@ class DataAccessor(object):
         We sigma-clip the input-data in an attempt to exclude source-pixels
         and keep only background-pixels.
         """
-        return rms_with_clipped_subregion(self.data, sigma=self.sigma, f=self.f)
+        return rms(clip(self.subregion(self.f), sigma=self.sigma))
+
+    def subregion(self, f):
+        """
+        The central region of the data, as selected by
+        :func:`tkp.quality.statistics.subregion`.
+
+        Subclasses may override this to read only that region of the image.
+        """
+        return subregion(self.data, f)
 
     def extract_metadata(self):
         """
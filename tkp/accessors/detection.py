@@ -32,18 +32,42 @@ casa_telescope_keyword_mapping = {
     'KAT-7': Kat7CasaImage,
 }
 
+# The accessor class detected for each file, keyed by cache_key(), so that
+# each file is inspected only once per process however often it is opened.
+_detection_cache = {}
 
-def isfits(filename):
-    """returns True if filename is a fits file"""
+
+def cache_key(filename):
+    """
+    Key identifying the current version of filename in the detection cache:
+    its real path, modification time and size, or None if it can't be
+    stat()ed.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return os.path.realpath(filename), stat.st_mtime, stat.st_size
+
+
+def open_fits(filename, memmap=False):
+    """
+    Returns the pyfits HDUList of filename, or None if filename is not a
+    fits file.
+    """
     if not os.path.isfile(filename):
-        return False
+        return None
     if filename[-4:].lower() != 'fits':
-        return False
+        return None
     try:
-        pyfits.open(filename)
+        return pyfits.open(filename, memmap=memmap)
     except IOError:
-        return False
-    return True
+        return None
+
+
+def isfits(filename):
+    """returns True if filename is a fits file"""
+    return open_fits(filename) is not None
 
 
 def iscasa(filename):
@@ -77,15 +101,19 @@ def islofarhdf5(filename):
     return True
 
 
-def fits_detect(filename):
+def fits_detect(filename, hdulist=None):
     """
     Detect which telescope produced FITS data, return corresponding accessor.
 
     Checks for known FITS image types where we expect additional metadata.
     If the telescope is unknown we default to a regular FitsImage.
+
+    If hdulist, the already opened filename, is given, it is used rather
+    than opening the file again.
     """
-    hdu = pyfits.open(filename)
-    hdr = hdu[0].header
+    if hdulist is None:
+        hdulist = pyfits.open(filename)
+    hdr = hdulist[0].header
     for fits_test in fits_type_mapping:
         if fits_test.test(hdr):
             return fits_test.accessor
@@ -104,13 +132,27 @@ def casa_detect(filename):
     return casa_telescope_keyword_mapping.get(telescope, None)
 
 
-def detect(filename):
-    """returns the accessor class that should be used to process filename"""
-    if isfits(filename):
-        return fits_detect(filename)
+def detect(filename, hdulist=None):
+    """
+    returns the accessor class that should be used to process filename
+
+    The result is cached for as long as the file isn't modified. If filename
+    is a fits file, its already opened hdulist may be given to save opening
+    it again.
+    """
+    key = cache_key(filename)
+    if key in _detection_cache:
+        return _detection_cache[key]
+    if hdulist is None:
+        hdulist = open_fits(filename)
+    if hdulist is not None:
+        accessor = fits_detect(filename, hdulist)
     elif iscasa(filename):
-        return casa_detect(filename)
+        accessor = casa_detect(filename)
     elif islofarhdf5(filename):
-        return LofarHdf5Image
+        accessor = LofarHdf5Image
     else:
         raise IOError("unsupported format: %s" % filename)
+    if key is not None:
+        _detection_cache[key] = accessor
+    return accessor
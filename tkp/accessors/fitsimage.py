@@ -11,6 +11,7 @@ import pyfits
 
 from tkp.accessors.common import parse_pixelsize, degrees2pixels
 from tkp.accessors.dataaccessor import DataAccessor
+from tkp.quality.statistics import subregion_slices
 from tkp.utility.coordinates import WCS
 
 logger = logging.getLogger(__name__)
@@ -22,13 +23,35 @@ class FitsImage(DataAccessor):
     Provide standard attributes, as per :class:`DataAccessor`. In addition, we
     provide a ``telescope`` attribute if the FITS file has a ``TELESCOP``
     header.
+
+    The data is converted to ``dtype`` (by default, double precision). If
+    ``memmap`` is true, it is instead memory mapped from the file rather
+    than read into memory, and is left in the type used by the file; see
+    :func:`read_data`.
+
+    The file is opened once, unless its pyfits ``hdulist`` is given (opened
+    with the same ``memmap``), in which case it isn't opened at all.
+
+    If ``lazy`` is true, only the header is parsed when the image is opened,
+    memory mapping the file. The data is read when it is first used, and
+    :meth:`rms_qc` reads only the central region of the image it needs.
     """
-    def __init__(self, url, plane=None, beam=None, hdu=0):
+    def __init__(self, url, plane=None, beam=None, hdu=0, memmap=False,
+                 dtype=numpy.float64, hdulist=None, lazy=False):
         super(FitsImage, self).__init__()
         self._url = url
-        header = self._get_header(hdu)
+        if hdulist is None:
+            hdulist = pyfits.open(self.url, memmap=memmap or lazy)
+        header = self._header = hdulist[hdu].header.copy()
         self._wcs = parse_coordinates(header)
-        self._data = read_data(pyfits.open(self.url)[hdu], plane)
+        if lazy:
+            self._hdu = hdulist[hdu]
+            self._read_args = (plane, memmap, dtype)
+            self._data = None
+            self._shape = (header['NAXIS1'], header['NAXIS2'])
+        else:
+            self._data = read_data(hdulist[hdu], plane, memmap, dtype)
+            self._shape = self._data.shape
         self._taustart_ts, self._tau_time = parse_times(header)
         self._freq_eff, self._freq_bw = parse_frequency(header)
         if beam:
@@ -44,17 +67,14 @@ class FitsImage(DataAccessor):
             # Otherwise, it defaults to None.
             self.telescope = header['TELESCOP']
 
-    def _get_header(self, hdu):
-        hdulist = pyfits.open(self.url)
-        hdu = hdulist[hdu]
-        return hdu.header.copy()
-
     @property
     def wcs(self):
         return self._wcs
 
     @property
     def data(self):
+        if self._data is None:
+            self._data = read_data(self._hdu, *self._read_args)
         return self._data
 
     @property
@@ -75,11 +95,11 @@ class FitsImage(DataAccessor):
 
     @property
     def centre_ra(self):
-        return calculate_phase_centre(self.data.shape, self.wcs)[0]
+        return calculate_phase_centre(self._shape, self.wcs)[0]
 
     @property
     def centre_decl(self):
-        return calculate_phase_centre(self.data.shape, self.wcs)[1]
+        return calculate_phase_centre(self._shape, self.wcs)[1]
 
     @property
     def freq_eff(self):
@@ -93,8 +113,14 @@ class FitsImage(DataAccessor):
     def beam(self):
         return self._beam
 
+    def subregion(self, f):
+        if self._data is None:
+            plane, memmap, dtype = self._read_args
+            return read_subregion(self._hdu, plane, f, dtype)
+        return super(FitsImage, self).subregion(f)
+
 
-def read_data(hdu, plane):
+def read_data(hdu, plane, memmap=False, dtype=numpy.float64):
     """
     Read and store data from our FITS file.
 
@@ -103,8 +129,15 @@ def read_data(hdu, plane):
     consistent with (eg) ds9 display of the FitsFile. Transpose back
     before viewing the array with RO.DS9, saving to a FITS file,
     etc.
+
+    The data is converted to dtype; reading float32 images with
+    dtype=numpy.float32 halves the memory they use. If memmap is true, the
+    data isn't converted at all, so that (for unscaled data, opened with
+    memmap=True) the result is a view of the memory mapped file.
     """
-    data = numpy.float64(hdu.data.squeeze())
+    data = hdu.data.squeeze()
+    if not memmap:
+        data = numpy.asarray(data, dtype=dtype)
     if plane is not None and len(data.shape) > 2:
         data = data[plane].squeeze()
     n_dim = len(data.shape)
@@ -114,6 +147,30 @@ def read_data(hdu, plane):
     data = data.transpose()
     return data
 
+def read_subregion(hdu, plane, f, dtype=numpy.float64):
+    """
+    Read only the central region of the data in a FITS hdu, as selected by
+    :func:`tkp.quality.statistics.subregion` from the data returned by
+    :func:`read_data`.
+
+    The plane of a datacube is chosen as by :func:`read_data`: the first
+    axis beyond the image axes with more than one pixel is indexed by plane,
+    and any others by 0.
+    """
+    header = hdu.header
+    index = []
+    for axis in range(header['NAXIS'], 2, -1):
+        if header['NAXIS%d' % axis] > 1 and plane is not None:
+            index.append(int(plane))
+            plane = None
+        else:
+            index.append(0)
+    x_slice, y_slice = subregion_slices(
+        (header['NAXIS1'], header['NAXIS2']), f)
+    data = hdu.section[tuple(index) + (y_slice, x_slice)]
+    return numpy.asarray(data, dtype=dtype).transpose()
+
+
 def parse_coordinates(header):
     """Returns a WCS object"""
     wcs = WCS()
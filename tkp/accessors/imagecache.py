@@ -0,0 +1,174 @@
+"""
+Node-local cache of decoded images.
+
+Each step of the pipeline opens the images it processes afresh: the
+persistence, quality, source extraction and forced fitting steps each decode
+the pixels, parse the WCS and derive the beam of the same image, usually in
+different processes. An ImageCache stores the decoded pixels of an image as
+a .npy file, next to a pickled sidecar holding the rest of its accessor. The
+first step to open an image through the cache fills it; later steps on the
+same node memory map the stored pixels rather than decoding the image again,
+so that processes share them through the page cache.
+
+Images opened lazily are not cached: only the parts of them which are used
+are read, which is cheaper than reading them in full to fill the cache. In
+the pipeline, the persistence step opens its images lazily, so the cache is
+filled by the quality check, and used by source extraction and forced
+fitting.
+
+The pixels are stored once, in the type they have in the image, whatever
+type they are asked for in. They are converted to the requested type (the
+accessor's default type, if none is given) on loading. Data which already
+has the requested type stays memory mapped; otherwise each accessor gets a
+converted copy of its own. Single-precision images are therefore shared by
+the steps which work in single precision.
+
+Entries are keyed by the path, modification time and size of the image (or
+of the files in it, for a CASA image), and the other arguments used to open
+it, so that a changed image is never matched with a stale entry. The cache
+is limited in size: the least recently used images are discarded to make
+room for new ones.
+"""
+
+import os
+import logging
+import inspect
+import importlib
+import cPickle as pickle
+import numpy
+
+import tkp.accessors
+from tkp.utility.coordinates import WCS
+from tkp.utility.filecache import FileCache, file_status, digest
+
+
+logger = logging.getLogger(__name__)
+
+DATA_SUFFIX = ".npy"
+METADATA_SUFFIX = ".meta"
+
+# Attributes of an accessor which aren't cached, but set to None: the data
+# is stored separately, the WCS rebuilt from its parameters, and open files
+# and tables are reopened by the accessor if it needs them.
+_UNCACHED = ('_data', '_wcs', '_header', '_hdu', '_table', '_subtables')
+
+
+class ImageCache(FileCache):
+    """A directory holding cached images.
+
+    Args:
+
+        directory (str): where to store the images. Created if necessary.
+
+    Kwargs:
+
+        max_size (int): maximum total size of the cached images, in bytes.
+    """
+    suffixes = (DATA_SUFFIX, METADATA_SUFFIX)
+
+    def __init__(self, directory, max_size=2**33):
+        super(ImageCache, self).__init__(directory, max_size)
+
+    def open(self, path, **kwargs):
+        """Return an accessor for the image at path, as tkp.accessors.open()
+        does, loading it from the cache if possible and otherwise storing it
+        there.
+
+        Memory mapped and lazily opened images (see
+        :class:`tkp.accessors.fitsimage.FitsImage`) are not cached.
+        """
+        if kwargs.get('memmap') or kwargs.get('lazy'):
+            return tkp.accessors.open(path, **kwargs)
+        kwargs.pop('lazy', None)
+        key = self.key(path, **kwargs)
+        accessor = self.load(key)
+        if accessor is None:
+            accessor = tkp.accessors.open(path, **dict(kwargs, dtype=None))
+            self.save(key, accessor)
+        if 'dtype' in kwargs:
+            dtype = kwargs['dtype']
+        else:
+            dtype = _default_dtype(type(accessor))
+        if dtype is not None and accessor.data.dtype != dtype:
+            accessor._data = numpy.asarray(accessor.data, dtype=dtype)
+        return accessor
+
+    def key(self, path, **kwargs):
+        """The key of the image at path, opened with kwargs.
+
+        The type of the data is not part of the key, since the data is
+        stored in its own type.
+        """
+        path = os.path.abspath(path)
+        kwargs.pop('dtype', None)
+        return digest(path, file_status(path), sorted(kwargs.items()))
+
+    def load(self, key):
+        """Load the accessor stored under key.
+
+        Its data is memory mapped, copy on write, from the cache, in the
+        type it has in the image.
+
+        Returns:
+
+            (DataAccessor): None if it isn't cached.
+        """
+        try:
+            with open(self.path(key, METADATA_SUFFIX), 'rb') as f:
+                metadata = pickle.load(f)
+            data = numpy.load(self.path(key, DATA_SUFFIX), mmap_mode='c')
+            # Mark the entry as recently used.
+            self.touch(key)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            # A corrupt entry is no worse than a missing one.
+            logger.warn("Ignoring unreadable cached image %s: %s", key, e)
+            return None
+        module, name = metadata['class']
+        cls = getattr(importlib.import_module(module), name)
+        accessor = cls.__new__(cls)
+        accessor.__dict__.update(metadata['state'])
+        accessor._wcs = WCS()
+        for attrname, value in metadata['wcs'].iteritems():
+            setattr(accessor._wcs, attrname, value)
+        accessor._data = data
+        logger.debug("Loaded cached image %s", accessor.url)
+        return accessor
+
+    def save(self, key, accessor):
+        """Store accessor, and its data, under key."""
+        metadata = {
+            'class': (type(accessor).__module__, type(accessor).__name__),
+            'state': dict((attrname, None if attrname in _UNCACHED else value)
+                          for attrname, value
+                          in accessor.__dict__.iteritems()),
+            'wcs': dict((attrname, getattr(accessor.wcs, attrname))
+                        for attrname in WCS.WCS_ATTRS),
+        }
+        # FITS data is big-endian; it is stored in the byte order of this
+        # machine, so that it has the type it is asked for in.
+        data = accessor.data
+        if not data.dtype.isnative:
+            data = data.astype(data.dtype.newbyteorder('='))
+        try:
+            # The data goes first: an entry is only loaded once its metadata
+            # is in place.
+            self.write(key, DATA_SUFFIX, lambda f: numpy.save(f, data))
+            self.write(key, METADATA_SUFFIX,
+                       lambda f: pickle.dump(metadata, f, -1))
+        except (IOError, OSError, pickle.PicklingError) as e:
+            logger.warn("Failed to cache image %s: %s", accessor.url, e)
+            return
+        self.evict()
+
+
+def _default_dtype(cls):
+    """The type an accessor class converts its data to by default.
+
+    Returns:
+
+        (numpy.dtype): None if the data is kept in its own type.
+    """
+    args, varargs, keywords, defaults = inspect.getargspec(cls.__init__)
+    return dict(zip(reversed(args), reversed(defaults or ()))).get('dtype')
@@ -2,7 +2,6 @@
 This module implements the CASA kat7 data container format.
 """
 import logging
-from pyrap.tables import table as pyrap_table
 from tkp.accessors.casaimage import CasaImage
 from tkp.utility.coordinates import mjd2datetime
 
@@ -24,12 +23,13 @@ class Kat7CasaImage(CasaImage):
       - beam: (optional) beam parameters in degrees, in the form
         (bmaj, bmin, bpa). Will attempt to read from header if
         not supplied.
+      - dtype: (optional) numpy type to convert the data to; by default, it
+        is left as stored.
+      - lazy: (optional) if True, the data is only read when it is used.
     """
-    def __init__(self, url, plane=0, beam=None):
-        super(Kat7CasaImage, self).__init__(url, plane, beam)
-
-        table = pyrap_table(self.url.encode(), ack=False)
-        self._taustart_ts = parse_taustartts(table)
+    def __init__(self, url, plane=0, beam=None, dtype=None, lazy=False):
+        super(Kat7CasaImage, self).__init__(url, plane, beam, dtype, lazy)
+        self._taustart_ts = parse_taustartts(self.table)
 
     @property
     def tau_time(self):
@@ -40,66 +40,87 @@ class LofarCasaImage(CasaImage, LofarAccessor):
       - beam: (optional) beam parameters in degrees, in the form
         (bmaj, bmin, bpa). Will attempt to read from header if
         not supplied.
-    """
-    def __init__(self, url, plane=0, beam=None):
-        super(LofarCasaImage, self).__init__(url, plane, beam)
-
-        table = pyrap_table(self.url.encode(), ack=False)
-        subtables = open_subtables(table)
-        self._taustart_ts = parse_taustartts(subtables)
-        self._tau_time = parse_tautime(subtables)
+      - dtype: (optional) numpy type to convert the data to; by default, it
+        is left as stored.
+      - lazy: (optional) if True, the data is only read when it is used.
 
-        # Additional, LOFAR-specific metadata
-        self._antenna_set = parse_antennaset(subtables)
-        self._ncore, self._nremote, self._nintl =  parse_stations(subtables)
-        self._subbandwidth = parse_subbandwidth(subtables)
-        self._subbands = parse_subbands(subtables)
+    The metadata held in the LOFAR subtables is only read when it is first
+    used, opening just the subtables it comes from.
+    """
+    def __init__(self, url, plane=0, beam=None, dtype=None, lazy=False):
+        super(LofarCasaImage, self).__init__(url, plane, beam, dtype, lazy)
+        self._subtables = None
+        self._parsed = {}
+
+    def _parse(self, parse):
+        """The result of parse(subtables), calculated when first needed."""
+        name = parse.__name__
+        if name not in self._parsed:
+            if self._subtables is None:
+                self._subtables = open_subtables(self.table)
+            self._parsed[name] = parse(self._subtables)
+        return self._parsed[name]
 
     @property
     def tau_time(self):
-        return self._tau_time
+        return self._parse(parse_tautime)
 
     @property
     def taustart_ts(self):
-        return self._taustart_ts
+        return self._parse(parse_taustartts)
 
     @property
     def antenna_set(self):
-        return self._antenna_set
+        return self._parse(parse_antennaset)
 
     @property
     def ncore(self):
-        return self._ncore
+        return self._parse(parse_stations)[0]
 
     @property
     def nremote(self):
-        return self._nremote
+        return self._parse(parse_stations)[1]
 
     @property
     def nintl(self):
-        return self._nintl
+        return self._parse(parse_stations)[2]
 
     @property
     def subbandwidth(self):
-        return self._subbandwidth
+        return self._parse(parse_subbandwidth)
 
     @property
     def subbands(self):
-        return self._subbands
+        return self._parse(parse_subbands)
+
+
+class Subtables(object):
+    """
+    The subtables defined in the LOFAR format of a table, by name. Each is
+    opened when it is first used.
+    """
+    def __init__(self, table):
+        self._table = table
+        self._opened = {}
+
+    def __getitem__(self, name):
+        if name not in subtable_names:
+            raise KeyError(name)
+        if name not in self._opened:
+            subtable_location = self._table.getkeyword("ATTRGROUPS")[name]
+            self._opened[name] = pyrap_table(subtable_location, ack=False)
+        return self._opened[name]
 
 
 def open_subtables(table):
-    """open all subtables defined in the LOFAR format
+    """open the subtables defined in the LOFAR format, as they are used
     args:
         table: a pyrap table handler to a LOFAR CASA table
     returns:
-        a dict containing all LOFAR CASA subtables
+        a Subtables, mapping the name of each LOFAR CASA subtable to the
+        subtable
     """
-    subtables = {}
-    for subtable in subtable_names:
-        subtable_location = table.getkeyword("ATTRGROUPS")[subtable]
-        subtables[subtable] = pyrap_table(subtable_location, ack=False)
-    return subtables
+    return Subtables(table)
 
 
 def parse_taustartts(subtables):
@@ -1,11 +1,14 @@
+import numpy
 from tkp.accessors import FitsImage
 from tkp.accessors.lofaraccessor import LofarAccessor
 
 
 class LofarFitsImage(FitsImage, LofarAccessor):
-    def __init__(self, url, plane=False, beam=False, hdu=0):
-        super(LofarFitsImage, self).__init__(url, plane, beam, hdu)
-        header = self._get_header(hdu)
+    def __init__(self, url, plane=False, beam=False, hdu=0, memmap=False,
+                 dtype=numpy.float64, hdulist=None, lazy=False):
+        super(LofarFitsImage, self).__init__(url, plane, beam, hdu, memmap,
+                                             dtype, hdulist, lazy)
+        header = self._header
         self._antenna_set = header['ANTENNA']
         self._ncore = header['NCORE']
         self._nintl = header['NINTL']
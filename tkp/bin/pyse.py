@@ -32,6 +32,9 @@ import logging
 from tkp.accessors import open as open_accessor
 from tkp.accessors import sourcefinder_image_from_accessor
 from tkp.accessors import writefits as tkp_writefits
+from tkp.accessors.detection import detect as detect_accessor
+from tkp.accessors.fitsimage import FitsImage
+from tkp.sourcefinder.tiled import TiledImage
 from tkp.sourcefinder.utils import generate_result_maps
 from tkp.management import parse_monitoringlist_positions
 
@@ -142,7 +145,10 @@ def handle_args(args=None):
     parser.add_option("--rmsmap", action="store_true", help="Generate RMS map")
     parser.add_option("--sigmap", action="store_true", help="Generate significance map")
     parser.add_option("--force-beam", action="store_true", help="Force fit axis lengths to beam size")
+    parser.add_option("--processes", default=1, type="int", help="Number of processes used to fit islands in parallel")
     parser.add_option("--detection-image", type="string", help="Find islands on different image")
+    parser.add_option("--float32", action="store_true", help="Hold images in single precision, halving memory use")
+    parser.add_option("--tile-memory", default=0, type="int", help="Extract sources from FITS images in tiles, using about this much memory (MB); 0 to disable")
     parser.add_option('--fixed-posns', help="List of position coordinates to "
         "force-fit (decimal degrees, JSON, e.g [[123.4,56.7],[359.9,89.9]]) "
         "(Will not perform blind extraction in this mode)"              ,
@@ -190,6 +196,16 @@ def handle_args(args=None):
     else:
         options.mode = "threshold" # mode 1.1 above
 
+    # Tiled extraction only supports plain thresholding, and never has the
+    # whole image in memory to write out maps.
+    if options.tile_memory:
+        if options.mode != "threshold":
+            parser.error("--tile-memory only supported for thresholding "
+                         "without a detection image")
+        for option in ("residuals", "islands", "rmsmap", "sigmap"):
+            if getattr(options, option):
+                parser.error("--%s not supported with --tile-memory" % option)
+
     return options, files
 
 def writefits(filename, data, header={}):
@@ -200,10 +216,16 @@ def writefits(filename, data, header={}):
         pass
     tkp_writefits(data, filename, header)
 
+def get_accessor(filename, beam, configuration, plane=0):
+    if configuration.get('float32'):
+        return open_accessor(filename, beam=beam, plane=plane,
+                             dtype=numpy.float32)
+    return open_accessor(filename, beam=beam, plane=plane)
+
 def get_detection_labels(filename, det, anl, beam, configuration, plane=0):
     print "Detecting islands in %s" % (filename,)
     print "Thresholding with det = %f sigma, analysis = %f sigma" % (det, anl)
-    ff = open_accessor(filename, beam=beam, plane=plane)
+    ff = get_accessor(filename, beam, configuration, plane)
     imagedata = sourcefinder_image_from_accessor(ff, **configuration)
     labels, labelled_data = imagedata.label_islands(
         det * imagedata.rmsmap, anl * imagedata.rmsmap
@@ -216,11 +238,24 @@ def get_sourcefinder_configuration(options):
         "back_size_y": options.grid,
         "margin": options.margin,
         "radius": options.radius,
+        "float32": bool(options.float32),
     }
     if options.residuals or options.islands:
         configuration['residuals'] = True
     return configuration
 
+def get_tiled_image(filename, beam, configuration, memory_budget):
+    """
+    Return a TiledImage for the FITS file filename, with its data memory
+    mapped from the file.
+    """
+    Accessor = detect_accessor(filename)
+    if not (Accessor and issubclass(Accessor, FitsImage)):
+        bailout("tiled extraction only supported for FITS images")
+    ff = Accessor(filename, beam=beam, plane=0, memmap=True)
+    return ff, TiledImage(ff.data, ff.beam, ff.wcs,
+                          memory_budget=memory_budget, **configuration)
+
 def get_beam(bmaj, bmin, bpa):
 
     if (
@@ -260,8 +295,12 @@ def run_sourcefinder(files, options):
     for counter, filename in enumerate(files):
         print "Processing %s (file %d of %d)." % (filename, counter+1, len(files))
         imagename = os.path.splitext(os.path.basename(filename))[0]
-        ff = open_accessor(filename, beam=beam, plane=0)
-        imagedata = sourcefinder_image_from_accessor(ff, **configuration)
+        if options.tile_memory:
+            ff, imagedata = get_tiled_image(filename, beam, configuration,
+                                            options.tile_memory * 2**20)
+        else:
+            ff = get_accessor(filename, beam, configuration)
+            imagedata = sourcefinder_image_from_accessor(ff, **configuration)
 
         if options.mode == "fixed":
             sr = imagedata.fit_fixed_positions(options.fixed_coords,
@@ -274,18 +313,28 @@ def run_sourcefinder(files, options):
                 sr = imagedata.fd_extract(
                     alpha=options.alpha,
                     deblend_nthresh=options.deblend_thresholds,
-                    force_beam=options.force_beam
+                    force_beam=options.force_beam,
+                    nr_processes=options.processes
                 )
             else:
                 if labelled_data is None:
                     print "Thresholding with det = %f sigma, analysis = %f sigma" % (options.detection, options.analysis)
 
-                sr = imagedata.extract(
-                    det=options.detection, anl=options.analysis,
-                    labelled_data=labelled_data, labels=labels,
-                    deblend_nthresh=options.deblend_thresholds,
-                    force_beam=options.force_beam
-                )
+                if options.tile_memory:
+                    sr = imagedata.extract(
+                        det=options.detection, anl=options.analysis,
+                        deblend_nthresh=options.deblend_thresholds,
+                        force_beam=options.force_beam,
+                        nr_processes=options.processes
+                    )
+                else:
+                    sr = imagedata.extract(
+                        det=options.detection, anl=options.analysis,
+                        labelled_data=labelled_data, labels=labels,
+                        deblend_nthresh=options.deblend_thresholds,
+                        force_beam=options.force_beam,
+                        nr_processes=options.processes
+                    )
 
         if options.regions:
             regionfile = imagename + ".reg"
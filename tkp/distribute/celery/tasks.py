@@ -31,22 +31,24 @@ def setup_task_log_emitter(sender=None, logger=None, loglevel=None,
 
 
 @celery_app.task
-def persistence_node_step(images, image_cache_config, sigma, f):
+def persistence_node_step(images, image_cache_config, sigma, f,
+                          manifest_path=None):
     worker_logger.info("running persistence task")
     return tkp.steps.persistence.node_steps(images, image_cache_config, sigma,
-                                            f)
+                                            f, manifest_path)
 
 
 @celery_app.task
-def quality_reject_check(url, job_config):
+def quality_reject_check(url, job_config, image_cache_config=None):
     worker_logger.info("running quality task")
-    return tkp.steps.quality.reject_check(url, job_config)
+    return tkp.steps.quality.reject_check(url, job_config, image_cache_config)
 
 
 @celery_app.task
-def extract_sources(url, extraction_params):
+def extract_sources(url, extraction_params, image_cache_config=None):
     worker_logger.info("running extracted sources task")
-    return tkp.steps.source_extraction.extract_sources(url, extraction_params)
+    return tkp.steps.source_extraction.extract_sources(url, extraction_params,
+                                                       image_cache_config)
 
 
 @celery_app.task
@@ -6,17 +6,19 @@ import tkp.steps
 logger = logging.getLogger(__name__)
 
 
-def persistence_node_step(images, image_cache_config, sigma, f):
+def persistence_node_step(images, image_cache_config, sigma, f,
+                          manifest_path=None):
     logger.info("running persistence task")
     return tkp.steps.persistence.node_steps(images, image_cache_config,
-                                            sigma, f)
+                                            sigma, f, manifest_path)
 
 
-def quality_reject_check(url, job_config):
+def quality_reject_check(url, job_config, image_cache_config=None):
     logger.info("running quality task")
-    return tkp.steps.quality.reject_check(url, job_config)
+    return tkp.steps.quality.reject_check(url, job_config, image_cache_config)
 
 
-def extract_sources(url, extraction_params):
+def extract_sources(url, extraction_params, image_cache_config=None):
     logger.info("running extracted sources task")
-    return tkp.steps.source_extraction.extract_sources(url, extraction_params)
+    return tkp.steps.source_extraction.extract_sources(url, extraction_params,
+                                                       image_cache_config)
@@ -24,7 +24,8 @@ from tkp.steps.misc import (load_job_config, dump_configs_to_logdir,
                                 group_per_timestep
                             )
 from tkp.db.configstore import store_config, fetch_config
-from tkp.steps.persistence import create_dataset, store_images
+from tkp.steps.persistence import (create_dataset, store_images,
+                                   update_manifest, MANIFEST_FILENAME)
 import tkp.steps.forced_fitting as steps_ff
 
 
@@ -99,13 +100,18 @@ def run(job_name, supplied_mon_coords=[]):
 
     logger.info("performing persistence step")
     image_cache_params = pipe_config.image_cache
-    imgs = [[img] for img in all_images]
-
     sigma = job_config.persistence.sigma
     f = job_config.persistence.f
+
+    # Only images which are new, or have changed, since they were last
+    # scanned are opened; the metadata of the others is in the manifest.
+    manifest_path = os.path.join(job_dir, MANIFEST_FILENAME)
+    imgs = [[img] for img in all_images]
+
     metadatas = runner.map("persistence_node_step", imgs,
-                           [image_cache_params, sigma, f])
+                           [image_cache_params, sigma, f, manifest_path])
     metadatas = [m[0] for m in metadatas if m]
+    update_manifest(manifest_path, metadatas, sigma, f)
 
     logger.info("Storing images")
     image_ids = store_images(metadatas,
@@ -116,7 +122,7 @@ def run(job_name, supplied_mon_coords=[]):
 
     logger.info("performing quality check")
     urls = [img.url for img in db_images]
-    arguments = [job_config]
+    arguments = [job_config, image_cache_params]
     rejecteds = runner.map("quality_reject_check", urls, arguments)
 
     good_images = []
@@ -139,9 +145,11 @@ def run(job_name, supplied_mon_coords=[]):
 
         logger.info("performing source extraction")
         urls = [img.url for img in images]
-        arguments = [se_parset]
+        arguments = [se_parset, image_cache_params]
 
         extraction_results = runner.map("extract_sources", urls, arguments)
+        steps.source_extraction.dump_profiles(log_dir, timestep, urls,
+                                              extraction_results)
 
         logger.info("storing extracted sources to database")
         # we also set the image max,min RMS values which calculated during
@@ -165,7 +173,8 @@ def run(job_name, supplied_mon_coords=[]):
             all_fit_posns, all_fit_ids = steps_ff.get_forced_fit_requests(image)
             if all_fit_posns:
                 successful_fits, successful_ids = steps_ff.perform_forced_fits(
-                    all_fit_posns, all_fit_ids, image.url, se_parset)
+                    all_fit_posns, all_fit_ids, image.url, se_parset,
+                    image_cache_params)
 
                 steps_ff.insert_and_associate_forced_fits(image.id,successful_fits,
                                                           successful_ids)
@@ -29,6 +29,16 @@ def clip(data, sigma=3):
         return newdata
 
 
+def subregion_slices(shape, f=4):
+    """Returns the slices of the inner region of an image of the given
+    shape, as used by subregion().
+    Args:
+        shape: the (x, y) shape of the image
+    """
+    x, y = shape
+    return (slice(x/2 - x/f, x/2 + x/f), slice(y/2 - y/f, y/2 + y/f))
+
+
 def subregion(data, f=4):
     """Returns the inner region of a image, according to f.
 
@@ -36,8 +46,7 @@ def subregion(data, f=4):
     Args:
         data: a numpy array
     """
-    x, y = data.shape
-    return data[(x/2 - x/f):(x/2 + x/f), (y/2 - y/f):(y/2 + y/f)]
+    return data[subregion_slices(data.shape, f)]
 
 
 def rms_with_clipped_subregion(data, sigma=3, f=4):
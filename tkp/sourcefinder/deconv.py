@@ -2,7 +2,7 @@
 Gaussian deconvolution.
 """
 
-from math import sin, cos, atan, sqrt, pi
+import numpy
 
 def deconv(fmaj, fmin, fpa, cmaj, cmin, cpa):
     """
@@ -31,44 +31,56 @@ def deconv(fmaj, fmin, fpa, cmaj, cmin, cpa):
         rpa (float):  Real position angle of major axis
         ierr (int):   Number of components which failed to deconvolve
     """
-    HALF_RAD = 90.0 / pi
+    rmaj, rmin, rpa, ierr = deconv_array(fmaj, fmin, fpa, cmaj, cmin, cpa)
+    return float(rmaj), float(rmin), float(rpa), int(ierr)
+
+
+def deconv_array(fmaj, fmin, fpa, cmaj, cmin, cpa):
+    """
+    Deconvolve a Gaussian "beam" from many Gaussian components at once.
+
+    This does the same as deconv(), but each argument may be an array, and
+    they are broadcast against each other. The results are arrays of the
+    broadcast shape.
+    """
+    HALF_RAD = 90.0 / numpy.pi
+    fmaj, fmin, fpa, cmaj, cmin, cpa = [
+        numpy.asarray(arg, dtype=numpy.float64)
+        for arg in (fmaj, fmin, fpa, cmaj, cmin, cpa)]
     cmaj2 = cmaj * cmaj
     cmin2 = cmin * cmin
     fmaj2 = fmaj * fmaj
     fmin2 = fmin * fmin
     theta = (fpa - cpa) / HALF_RAD
     det = ((fmaj2 + fmin2) - (cmaj2 + cmin2)) / 2.0
-    rhoc = (fmaj2 - fmin2) * cos(theta) - (cmaj2 - cmin2)
-    sigic2 = 0.0
-    rhoa = 0.0
-    ierr = 0
+    rhoc = (fmaj2 - fmin2) * numpy.cos(theta) - (cmaj2 - cmin2)
 
-    if abs(rhoc) > 0.0:
-        sigic2 = atan((fmaj2 - fmin2) * sin(theta) / rhoc)
-        rhoa = (((cmaj2 - cmin2) - (fmaj2 - fmin2) * cos(theta)) /
-                (2.0 * cos(sigic2)))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rotated = numpy.abs(rhoc) > 0.0
+        sigic2 = numpy.where(
+            rotated, numpy.arctan((fmaj2 - fmin2) * numpy.sin(theta) / rhoc),
+            0.0)
+        rhoa = numpy.where(
+            rotated, (((cmaj2 - cmin2) - (fmaj2 - fmin2) * numpy.cos(theta)) /
+                      (2.0 * numpy.cos(sigic2))),
+            0.0)
 
     rpa = sigic2 * HALF_RAD + cpa
     rmaj = det - rhoa
     rmin = det + rhoa
 
-    if rmaj < 0:
-        ierr += 1
-        rmaj = 0
-    if rmin < 0:
-        ierr += 1
-        rmin = 0
-
-    rmaj = sqrt(rmaj)
-    rmin = sqrt(rmin)
-    if rmaj < rmin:
-        rmaj, rmin = rmin, rmaj
-        rpa += 90
+    ierr = (rmaj < 0).astype(numpy.int) + (rmin < 0)
+    rmaj = numpy.sqrt(numpy.where(rmaj < 0, 0.0, rmaj))
+    rmin = numpy.sqrt(numpy.where(rmin < 0, 0.0, rmin))
+    swap = rmaj < rmin
+    rmaj, rmin = numpy.where(swap, rmin, rmaj), numpy.where(swap, rmaj, rmin)
+    rpa = numpy.where(swap, rpa + 90, rpa)
 
     rpa = (rpa + 900) % 180
-    if not abs(rmaj):
-        rpa = 0.0
-    elif not abs(rmin) and (45.0 < abs(rpa-fpa) < 135.0):
-        rpa = (rpa + 450.0) % 180.0
+    offset = numpy.abs(rpa - fpa)
+    rpa = numpy.where(
+        rmaj == 0, 0.0,
+        numpy.where((rmin == 0) & (45.0 < offset) & (offset < 135.0),
+                    (rpa + 450.0) % 180.0, rpa))
 
     return rmaj, rmin, rpa, ierr
@@ -6,6 +6,7 @@ These are used in conjunction with image.ImageData.
 
 import logging
 import math
+import itertools
 # DictMixin may need to be replaced using collections.MutableMapping;
 # see http://docs.python.org/library/userdict.html#UserDict.DictMixin
 from UserDict import DictMixin
@@ -14,8 +15,7 @@ try:
     import ndimage
 except ImportError:
     from scipy import ndimage
-from tkp.sourcefinder.deconv import deconv
-from ..utility import coordinates
+from tkp.sourcefinder.deconv import deconv_array
 from ..utility.uncertain import Uncertain
 from .gaussian import gaussian
 from . import fitting
@@ -39,21 +39,21 @@ class Island(object):
 
     The island should provide a means of deblending: splitting itself
     apart and returning multiple sub-islands, if necessary.
+
+    The position of the highest pixel and the raw moments of the island
+    (see fitting.labelled_moments()) may be given, if they have already been
+    measured; otherwise they are measured here and when fitting.
     """
 
     def __init__(self, data, rms, chunk, analysis_threshold, detection_map,
         beam, deblend_nthresh, deblend_mincont, structuring_element,
-        rms_orig=None, flux_orig=None, subthrrange=None
+        rms_orig=None, flux_orig=None, subthrrange=None, max_pos=None,
+        moments=None
     ):
 
         # deblend_nthresh is the number of subthresholds used when deblending.
         self.deblend_nthresh = deblend_nthresh
-        # If we deblend too far, we hit the recursion limit. And it's slow.
-        if self.deblend_nthresh > 300:
-            logger.warn("Limiting to 300 deblending subtresholds")
-            self.deblend_nthresh = 300
-        else:
-            logger.debug("Using %d subthresholds", deblend_nthresh)
+        logger.debug("Using %d subthresholds", deblend_nthresh)
 
         # Deblended components of this island must contain at least
         # deblend_mincont times the total flux of the original to be regarded
@@ -63,6 +63,12 @@ class Island(object):
         # The structuring element defines connectivity between pixels.
         self.structuring_element = structuring_element
 
+        # The image may be held in single precision, but islands are small
+        # enough to measure in double precision.
+        data = numpy.asarray(data, dtype=numpy.float64)
+        if rms.dtype != numpy.float64:
+            rms = rms.astype(numpy.float64)
+
         # NB we have set all unused data to -(lots) before passing it to
         # Island().
         mask = numpy.where(data > -BIGNUM / 10.0, 0, 1)
@@ -72,7 +78,10 @@ class Island(object):
         self.analysis_threshold = analysis_threshold
         self.detection_map = detection_map
         self.beam = beam
-        self.max_pos = ndimage.maximum_position(self.data.filled(fill_value=0))
+        if max_pos is None:
+            max_pos = ndimage.maximum_position(self.data.filled(fill_value=0))
+        self.max_pos = tuple(max_pos)
+        self.moments = moments
         self.position = (self.chunk[0].start, self.chunk[1].start)
         if not isinstance(rms_orig, numpy.ndarray):
             self.rms_orig = self.rms
@@ -95,105 +104,85 @@ class Island(object):
         """Return a decomposed numpy array of all the subislands.
 
         Iterate up through subthresholds, looking for our island
-        splitting into two. If it does, start again, with two or more
-        separate islands.
+        splitting into two. If it does, carry on upwards with each of the
+        significant parts as separate islands.
+
+        The parts of the island above each subthreshold are taken from its
+        component tree (see ThresholdTree), which is built in one pass, so
+        no subthreshold has to be labelled separately.
+
+        Kwargs:
+
+            niter (int): index of the first subthreshold to consider.
         """
 
         logger.debug("Deblending source")
-        for level in self.subthrrange[niter:]:
-
-            # The idea is to retain the parent island when no significant
-            # subislands are found and jump to the next subthreshold
-            # using niter.
-            # Deblending is started at a level higher than the lowest
-            # pixel value in the island.
-            # Deblending at the level of the lowest pixel value will
-            # likely not yield anything, because the island was formed at
-            # threshold just below that.
-            # So that is why we use niter+1 (>=1) instead of niter (>=0).
-
-            if level > self.data.max():
-                # level is above the highest pixel value...
-                # Return the current island.
-                break
-            clipped_data = numpy.where(
-                self.data.filled(fill_value=0) >= level, 1, 0)
-            labels, number = ndimage.label((clipped_data),
-                                           self.structuring_element)
-            # If we have more than one island, then we need to make subislands.
-            if number > 1:
-                subislands = []
-                label = 0
-                for chunk in ndimage.find_objects(labels):
-                    label += 1
-                    newdata = numpy.where(
-                        labels == label,
-                        self.data.filled(fill_value=-BIGNUM), -BIGNUM
-                    )
-                    # NB: In class Island(object), rms * analysis_threshold
-                    # is taken as the threshold for the bottom of the island.
-                    # Everything below that level is masked.
-                    # For subislands, this product should be equal to level
-                    # and flat, i.e., horizontal.
-                    # We can achieve this by setting rms=level*ones and
-                    # analysis_threshold=1.
-                    island = Island(
-                                 newdata[chunk],
-                                 (numpy.ones(self.data[chunk].shape) * level),
-                                 (
-                                     slice(self.chunk[0].start + chunk[0].start,
-                                        self.chunk[0].start + chunk[0].stop),
-                                     slice(self.chunk[1].start + chunk[1].start,
-                                        self.chunk[1].start + chunk[1].stop)
-                                 ),
-                                 1,
-                                 self.detection_map[chunk],
-                                 self.beam,
-                                 self.deblend_nthresh,
-                                 self.deblend_mincont,
-                                 self.structuring_element,
-                                 self.rms_orig[chunk[0].start:chunk[0].stop, chunk[1].start:chunk[1].stop],
-                                 self.flux_orig,
-                                 self.subthrrange
-                            )
-
-                    subislands.append(island)
-                # This line should filter out any subisland with insufficient
-                # flux, in about the same way as SExtractor.
-                # Sufficient means: the flux of the branch above the
-                # subthreshold (=level) must exceed some user given fraction
-                # of the composite object, i.e., the original island.
-                subislands = filter(
-                    lambda isl: (isl.data-numpy.ma.array(
-                    numpy.ones(isl.data.shape)*level,
-                    mask=isl.data.mask)).sum() > self.deblend_mincont *
-                                    self.flux_orig, subislands)
-                # Discard subislands below detection threshold
-                subislands = filter(
-                    lambda isl: (isl.data - isl.detection_map).max() >= 0,
-                    subislands)
-                numbersignifsub = len(subislands)
-                # Proceed with the previous island, but make sure the next
-                # subthreshold is higher than the present one.
-                # Or we would end up in an infinite loop...
-                if numbersignifsub > 1:
-                    if niter+1 < self.deblend_nthresh:
-                        # Apparently, the map command always results in
-                        # nested lists.
-                        return list(utils.flatten(map(
-                            lambda island: island.deblend(niter=niter+1),
-                            subislands)))
-                    else:
-                        return subislands
-                elif numbersignifsub == 1 and niter+1 < self.deblend_nthresh:
-                    return Island.deblend(self, niter=niter+1)
-                else:
-                    # In this case we have numbersignifsub == 0 or
-                    # (1 and reached the highest subthreshold level).
-                    # Pull out of deblending loop, return current island.
-                    break
-        # We've not found any subislands: just return this island.
-        return self
+        levels = self.subthrrange[niter:]
+        if not self._may_split(levels):
+            return self
+        tree = ThresholdTree(self.data, self.detection_map, levels,
+                             self.structuring_element)
+        branches = tree.deblend(self.deblend_mincont * self.flux_orig)
+        if branches == [tree.root]:
+            # We've not found any subislands: just return this island.
+            return self
+        return [self._subisland(tree, branch) for branch in branches]
+
+    def _may_split(self, levels):
+        """
+        Whether the island has more than one peak above the lowest level.
+
+        Every part of the island above a subthreshold contains a local
+        maximum, and connected local maxima are all equally bright, so an
+        island whose local maxima above the lowest level are connected
+        cannot be split.
+        """
+        if not len(levels):
+            return False
+        data = self.data.filled(fill_value=-BIGNUM)
+        peaks = data == ndimage.maximum_filter(
+            data, footprint=numpy.asarray(self.structuring_element),
+            mode='constant', cval=-BIGNUM)
+        peaks &= data >= levels[0]
+        number = ndimage.label(peaks, self.structuring_element)[1]
+        return number > 1
+
+    def _subisland(self, tree, branch):
+        """The Island made up of a branch of our threshold tree."""
+        rows, cols = tree.pixels(branch)
+        chunk = (slice(rows.min(), rows.max() + 1),
+                 slice(cols.min(), cols.max() + 1))
+        newdata = numpy.empty((chunk[0].stop - chunk[0].start,
+                               chunk[1].stop - chunk[1].start))
+        newdata.fill(-BIGNUM)
+        newdata[rows - chunk[0].start, cols - chunk[1].start] = (
+            self.data.data[rows, cols])
+        # NB: In class Island(object), rms * analysis_threshold
+        # is taken as the threshold for the bottom of the island.
+        # Everything below that level is masked.
+        # For subislands, this product should be equal to level
+        # and flat, i.e., horizontal.
+        # We can achieve this by setting rms=level*ones and
+        # analysis_threshold=1.
+        return Island(
+            newdata,
+            numpy.ones(newdata.shape) * tree.levels[branch.level],
+            (
+                slice(self.chunk[0].start + chunk[0].start,
+                      self.chunk[0].start + chunk[0].stop),
+                slice(self.chunk[1].start + chunk[1].start,
+                      self.chunk[1].start + chunk[1].stop)
+            ),
+            1,
+            self.detection_map[chunk],
+            self.beam,
+            self.deblend_nthresh,
+            self.deblend_mincont,
+            self.structuring_element,
+            self.rms_orig[chunk],
+            self.flux_orig,
+            self.subthrrange
+        )
 
     def threshold(self):
         """Threshold"""
@@ -207,20 +196,226 @@ class Island(object):
         """Deviation"""
         return (self.data/ self.rms_orig).max()
 
-    def fit(self, fixed=None):
+    def fit(self, fixed=None, errors=True):
         """Fit the position"""
-        try:
-            measurement, gauss_residual = source_profile_and_errors(
-                self.data, self.threshold(), self.noise(), self.beam, fixed=fixed
-            )
-        except ValueError:
-            # Fitting failed
-            logger.error("Moments & Gaussian fitting failed at %s" % (str(self.position)))
-            return None
-        measurement["xbar"] += self.position[0]
-        measurement["ybar"] += self.position[1]
-        measurement.sig = self.sig()
-        return measurement, gauss_residual
+        return fit_island(self.compact(fixed=fixed), errors=errors)
+
+    def compact(self, fixed=None):
+        """
+        Everything needed to fit this island, as a tuple of plain arrays and
+        numbers.
+
+        This is much cheaper to pickle than the island itself, so it is what
+        we pass to other processes for fitting. See fit_island().
+        """
+        return (self.data.filled(fill_value=-BIGNUM), self.threshold(),
+                self.noise(), self.beam, self.position, self.sig(), fixed,
+                self.moments)
+
+
+class Branch(object):
+    """A connected part of an island above one of its subthresholds."""
+    __slots__ = ('level', 'count', 'flux', 'significance', 'first',
+                 'children', 'pixels')
+
+    def __init__(self, level, count, flux, significance, first):
+        self.level = level
+        # Number of pixels, and their summed values.
+        self.count = count
+        self.flux = flux
+        # Highest excess of a pixel over the detection threshold.
+        self.significance = significance
+        # Index of the first pixel, in raster order.
+        self.first = first
+        # The branches it contains at the next level up.
+        self.children = []
+        # The pixels that are in none of its children.
+        self.pixels = []
+
+
+class ThresholdTree(object):
+    """
+    The component tree of an island over a series of subthresholds.
+
+    The parts of the island above a subthreshold are nested within those
+    above any lower subthreshold, so they form a tree. It is built in a
+    single union-find pass over the pixels, from the brightest to the
+    faintest, recording the connected parts each time a subthreshold is
+    passed.
+
+    Args:
+
+        data (numpy.ma.MaskedArray): the island.
+
+        detection_map (numpy.ndarray): the detection threshold for each
+            pixel of the island.
+
+        levels (numpy.ndarray): increasing subthresholds.
+
+        structuring_element: connectivity between pixels.
+    """
+    def __init__(self, data, detection_map, levels, structuring_element):
+        self.levels = levels
+        # Pixels are numbered in an array with a border of one pixel, so
+        # that their neighbours can be found without bounds checks.
+        self.width = data.shape[1] + 2
+        structure = numpy.asarray(structuring_element)
+        offsets = [(row - 1) * self.width + col - 1
+                   for row, col in zip(*numpy.nonzero(structure))
+                   if (row, col) != (1, 1)]
+
+        rows, cols = numpy.nonzero(~numpy.ma.getmaskarray(data))
+        values = data.data[rows, cols]
+        order = numpy.argsort(-values, kind='mergesort')
+        rows, cols, values = rows[order], cols[order], values[order]
+        significances = (values - detection_map[rows, cols]).tolist()
+        # The number of subthresholds each pixel reaches.
+        tops = numpy.searchsorted(levels, values, side='right').tolist()
+        indices = ((rows + 1) * self.width + cols + 1).tolist()
+        values = values.tolist()
+
+        size = (data.shape[0] + 2) * self.width
+        parent = [-1] * size
+        count = [0] * size
+        flux = [0.0] * size
+        significance = [0.0] * size
+        first = [0] * size
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        # The roots of the union-find forest are the parts of the island.
+        roots = set()
+        self.branches = [[] for level in levels]
+        position = 0
+        for level in xrange(len(levels) - 1, -1, -1):
+            added = position
+            while position < len(indices) and tops[position] > level:
+                index = indices[position]
+                parent[index] = index
+                count[index] = 1
+                flux[index] = values[position]
+                significance[index] = significances[position]
+                first[index] = index
+                roots.add(index)
+                for offset in offsets:
+                    neighbour = index + offset
+                    if parent[neighbour] < 0:
+                        continue
+                    root, other = find(index), find(neighbour)
+                    if root == other:
+                        continue
+                    if count[root] < count[other]:
+                        root, other = other, root
+                    parent[other] = root
+                    count[root] += count[other]
+                    flux[root] += flux[other]
+                    significance[root] = max(significance[root],
+                                             significance[other])
+                    first[root] = min(first[root], first[other])
+                    roots.discard(other)
+                position += 1
+
+            by_root = {}
+            for root in roots:
+                by_root[root] = Branch(level, count[root], flux[root],
+                                       significance[root], first[root])
+            for index in indices[added:position]:
+                by_root[find(index)].pixels.append(index)
+            if level + 1 < len(levels):
+                for branch in self.branches[level + 1]:
+                    by_root[find(branch.first)].children.append(branch)
+            # Order the branches as ndimage.label() would number them.
+            self.branches[level] = sorted(by_root.values(),
+                                          key=lambda branch: branch.first)
+
+        # The whole island; it is not a branch at any subthreshold.
+        self.root = Branch(-1, 0, 0.0, 0.0, 0)
+        if levels.size:
+            self.root.children = self.branches[0]
+
+    def deblend(self, min_flux):
+        """
+        Split the island in the way of SExtractor.
+
+        Going up through the subthresholds, the island is split where it
+        has more than one significant branch. A branch is significant if
+        its flux above the subthreshold exceeds min_flux and it rises above
+        the detection threshold. Each significant branch is then split in
+        the same way. Splitting stops where no branch is significant.
+
+        Returns:
+
+            (list): the resulting branches; [self.root] if the island is
+            not split.
+        """
+        result = []
+        stack = [self.root]
+        while stack:
+            branch = stack.pop()
+            significant = []
+            parts = branch.children
+            for level in xrange(branch.level + 1, len(self.levels)):
+                if not parts:
+                    break
+                if len(parts) > 1:
+                    significant = [
+                        part for part in parts if
+                        part.flux - self.levels[level] * part.count > min_flux
+                        and part.significance >= 0
+                    ]
+                    if len(significant) != 1:
+                        break
+                parts = [child for part in parts for child in part.children]
+            if len(significant) > 1:
+                stack.extend(reversed(significant))
+            else:
+                result.append(branch)
+        return result
+
+    def pixels(self, branch):
+        """Row and column indices of the pixels of a branch"""
+        indices = []
+        branches = [branch]
+        while branches:
+            branch = branches.pop()
+            indices.extend(branch.pixels)
+            branches.extend(branch.children)
+        rows, cols = numpy.divmod(numpy.array(indices), self.width)
+        return rows - 1, cols - 1
+
+
+def fit_island(compact_island, errors=True):
+    """
+    Fit an island, given in the form returned by Island.compact().
+
+    This is a module level function so that it can be handed to a
+    multiprocessing pool. If errors is False, the errors and deconvolved
+    shape are left for the caller to calculate, e.g. with
+    calculate_all_errors() and deconvolve_all() for many islands at once.
+
+    Returns a tuple of the measurement (ParamSet) and the Gaussian residual,
+    or None if fitting failed.
+    """
+    (data, threshold, noise, beam, position, sig, fixed,
+     moments) = compact_island
+    data = numpy.ma.array(data, mask=numpy.where(data > -BIGNUM / 10.0, 0, 1))
+    try:
+        measurement, gauss_residual = source_profile_and_errors(
+            data, threshold, noise, beam, fixed=fixed, moments=moments,
+            errors=errors
+        )
+    except ValueError:
+        # Fitting failed
+        logger.error("Moments & Gaussian fitting failed at %s" % (str(position)))
+        return None
+    measurement["xbar"] += position[0]
+    measurement["ybar"] += position[1]
+    measurement.sig = sig
+    return measurement, gauss_residual
 
 
 class ParamSet(DictMixin):
@@ -303,37 +498,167 @@ class ParamSet(DictMixin):
         """Returns the errors on parameters from Gaussian fits according to
         the Condon (PASP 109, 166 (1997)) formulae.
 
-        These formulae are not perfect, but we'll use them for the
-        time being.  (See Refregier and Brown (astro-ph/9803279v1) for
-        a more rigorous approach.) It also returns the corrected peak.
-        The peak is corrected for the overestimate due to the local
-        noise gradient.
+        See condon_formulae(), which does this for many sources at once.
         """
-        peak = self['peak'].value
-        flux = self['flux'].value
-        smaj = self['semimajor'].value
-        smin = self['semiminor'].value
-        theta = self['theta'].value
+        _apply_error_formulae([self], condon_formulae, _CONDON_COLUMNS,
+                              noise=noise, beam=beam)
+        return self
+
+    def _error_bars_from_moments(self, noise, beam, threshold):
+        """Provide reasonable error estimates from the moments
+
+        See error_bars_from_moments(), which does this for many sources at
+        once.
+        """
+        _apply_error_formulae([self], error_bars_from_moments,
+                              _MOMENTS_COLUMNS, noise=noise, beam=beam,
+                              threshold=threshold)
+        return self
+
+    def deconvolve_from_clean_beam(self, beam):
+        """Deconvolve with the clean beam
+
+        See deconvolve_from_clean_beam(), which does this for many sources at
+        once.
+        """
+        deconvolve_all([self], beam)
+        return self
+
+
+# The parameters, and constants, of a ParamSet which each of the functions
+# below takes as columns.
+_SHAPE_COLUMNS = ('peak', 'flux', 'semimajor', 'semiminor', 'theta')
+_CONDON_COLUMNS = _SHAPE_COLUMNS + (
+    'clean_bias', 'clean_bias_error', 'frac_flux_cal_error', 'alpha_maj1',
+    'alpha_min1', 'alpha_maj2', 'alpha_min2', 'alpha_maj3', 'alpha_min3')
+_MOMENTS_COLUMNS = _SHAPE_COLUMNS + ('clean_bias_error',
+                                     'frac_flux_cal_error')
+_DECONV_COLUMNS = ('semimajor', 'errsemimajor', 'semiminor', 'errsemiminor',
+                  'theta', 'errtheta')
+
+
+def _param_columns(params, names):
+    """
+    Arrays of the given parameters (or errors, or constants) of a list of
+    ParamSets, by name.
+    """
+    columns = {}
+    for name in names:
+        if name in params[0].values:
+            column = [param[name].value for param in params]
+        elif name[:3] == 'err':
+            column = [param[name[3:]].error for param in params]
+        else:
+            column = [getattr(param, name) for param in params]
+        columns[name] = numpy.array(column, dtype=numpy.float64)
+    return columns
+
+
+def _update_params(params, columns):
+    """Store the columns calculated for a list of ParamSets in them."""
+    for name, column in columns.iteritems():
+        for param, value in itertools.izip(params, column):
+            param[name] = value
+
+
+def _apply_error_formulae(params, formulae, names, **kwargs):
+    """
+    Apply condon_formulae() or error_bars_from_moments() to a list of
+    ParamSets, and store the results in them.
+    """
+    kwargs.update(_param_columns(params, names))
+    columns = formulae(**kwargs)
+    unknown = columns.pop('unknown', None)
+    if unknown is not None and unknown.any():
+        # Position errors are left alone where they can't be estimated.
+        known = numpy.flatnonzero(~unknown)
+        _update_params([params[index] for index in known],
+                       dict((name, columns.pop(name)[known])
+                            for name in ('errxbar', 'errybar')))
+    _update_params(params, columns)
+
+
+def calculate_all_errors(params, noise, beam, threshold):
+    """
+    Calculate the errors of a list of ParamSets, as their calculate_errors()
+    would, with each formula applied to all of them at once.
+
+    Args:
+
+        params (list): ParamSets
+
+        noise, threshold (float or sequence): the noise and threshold used
+            for each ParamSet; the threshold may be None.
 
-        theta_B, theta_b = utils.calculate_correlation_lengths(
-            beam[0], beam[1])
+        beam (3-tuple of float): beam parameters
+    """
+    if not params:
+        return
+    noise = numpy.broadcast_to(numpy.asarray(noise, dtype=numpy.float64),
+                               (len(params),))
+    threshold = numpy.broadcast_to(numpy.asarray(threshold), (len(params),))
+    gaussian = numpy.array([param.gaussian for param in params])
+    moments = numpy.array([param.moments for param in params]) & ~gaussian
+    for selected, formulae, names in (
+            (gaussian, condon_formulae, _CONDON_COLUMNS),
+            (moments, error_bars_from_moments, _MOMENTS_COLUMNS)):
+        indices = numpy.flatnonzero(selected)
+        if not len(indices):
+            continue
+        kwargs = {'noise': noise[indices], 'beam': beam}
+        if formulae is error_bars_from_moments:
+            kwargs['threshold'] = numpy.array(
+                [value or 0 for value in threshold[indices]],
+                dtype=numpy.float64)
+        _apply_error_formulae([params[index] for index in indices],
+                              formulae, names, **kwargs)
+
+
+def condon_formulae(peak, flux, semimajor, semiminor, theta, noise, beam,
+                    clean_bias=0.0, clean_bias_error=0.0,
+                    frac_flux_cal_error=0.0, alpha_maj1=2.5, alpha_min1=0.5,
+                    alpha_maj2=0.5, alpha_min2=2.5, alpha_maj3=1.5,
+                    alpha_min3=1.5):
+    """Returns the errors on parameters from Gaussian fits according to
+    the Condon (PASP 109, 166 (1997)) formulae.
+
+    These formulae are not perfect, but we'll use them for the
+    time being.  (See Refregier and Brown (astro-ph/9803279v1) for
+    a more rigorous approach.) It also returns the corrected peak.
+    The peak is corrected for the overestimate due to the local
+    noise gradient.
+
+    The parameters of the sources, and the noise, may be given as arrays,
+    with one entry per source.
+
+    Returns:
+
+        (dict): columns of the corrected peaks and the errors, by the names
+            under which ParamSet stores them.
+    """
+    peak = numpy.asarray(peak, dtype=numpy.float64)
+    smaj = semimajor
+    smin = semiminor
 
+    theta_B, theta_b = utils.calculate_correlation_lengths(
+        beam[0], beam[1])
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
         rho_sq1 = ((smaj*smin/(theta_B*theta_b)) *
-                   (1.+(theta_B/(2.*smaj))**2)**self.alpha_maj1 *
-                   (1.+(theta_b/(2.*smin))**2)**self.alpha_min1 *
+                   (1.+(theta_B/(2.*smaj))**2)**alpha_maj1 *
+                   (1.+(theta_b/(2.*smin))**2)**alpha_min1 *
                    (peak/noise)**2)
         rho_sq2 = ((smaj*smin/(theta_B*theta_b)) *
-                   (1.+(theta_B/(2.*smaj))**2)**self.alpha_maj2 *
-                   (1.+(theta_b/(2.*smin))**2)**self.alpha_min2 *
+                   (1.+(theta_B/(2.*smaj))**2)**alpha_maj2 *
+                   (1.+(theta_b/(2.*smin))**2)**alpha_min2 *
                    (peak/noise)**2)
         rho_sq3 = ((smaj*smin/(theta_B*theta_b)) *
-                   (1.+(theta_B/(2.*smaj))**2)**self.alpha_maj3 *
-                   (1.+(theta_b/(2.*smin))**2)**self.alpha_min3 *
+                   (1.+(theta_B/(2.*smaj))**2)**alpha_maj3 *
+                   (1.+(theta_b/(2.*smin))**2)**alpha_min3 *
                    (peak/noise)**2)
 
         rho1 = numpy.sqrt(rho_sq1)
         rho2 = numpy.sqrt(rho_sq2)
-        rho3 = numpy.sqrt(rho_sq3)
 
         denom1 = numpy.sqrt(2.*numpy.log(2.)) * rho1
         denom2 = numpy.sqrt(2.*numpy.log(2.)) * rho2
@@ -360,17 +685,12 @@ class ParamSet(DictMixin):
         errorsmaj = numpy.sqrt(2) * smaj / rho1
         errorsmin = numpy.sqrt(2) * smin / rho2
 
-        if smaj > smin:
-            errortheta = 2.0 * (smaj*smin/(smaj**2-smin**2))/rho2
-        else:
-            errortheta = numpy.pi
-        if errortheta > numpy.pi:
-            errortheta = numpy.pi
+        errortheta = _theta_error(smaj, smin, rho2)
 
-        peak += -noise**2/peak + self.clean_bias
+        peak = peak + (-noise**2/peak + clean_bias)
 
-        errorpeaksq = ((self.frac_flux_cal_error * peak)**2 +
-                       self.clean_bias_error**2 +
+        errorpeaksq = ((frac_flux_cal_error * peak)**2 +
+                       clean_bias_error**2 +
                        2. * peak**2 / rho_sq3)
 
         errorpeak = numpy.sqrt(errorpeaksq)
@@ -378,46 +698,47 @@ class ParamSet(DictMixin):
         help1 = (errorsmaj/smaj)**2
         help2 = (errorsmin/smin)**2
         help3 = theta_B * theta_b / (4. * smaj * smin)
-        errorflux = numpy.abs(flux)*numpy.sqrt(errorpeaksq/peak**2+help3*(help1+help2))
+        errorflux = numpy.abs(flux)*numpy.sqrt(
+            errorpeaksq/peak**2+help3*(help1+help2))
 
-        self['peak'] = Uncertain(peak, errorpeak)
-        self['flux'].error = errorflux
-        self['xbar'].error = errorx
-        self['ybar'].error = errory
-        self['semimajor'].error = errorsmaj
-        self['semiminor'].error = errorsmin
-        self['theta'].error = errortheta
+    return {
+        'peak': peak,
+        'errpeak': numpy.abs(errorpeak),
+        'errflux': errorflux,
+        'errxbar': errorx,
+        'errybar': errory,
+        'errsemimajor': errorsmaj,
+        'errsemiminor': errorsmin,
+        'errtheta': errortheta
+    }
 
-        return self
 
-    def _error_bars_from_moments(self, noise, beam, threshold):
-        """Provide reasonable error estimates from the moments"""
-
-        # The formulae below should give some reasonable estimate of the
-        # errors from moments, should always be higher than the errors from
-        # Gauss fitting.
-        peak = self['peak'].value
-        flux = self['flux'].value
-        smaj = self['semimajor'].value
-        smin = self['semiminor'].value
-        theta = self['theta'].value
-
-        # This analysis is only possible if the peak flux is >= 0. This
-        # follows from the definition of eq. 2.81 in Spreeuw's thesis. In that
-        # situation, we set all errors to be infinite
-        if peak < 0:
-            self['peak'].error = float('inf')
-            self['flux'].error = float('inf')
-            self['semimajor'].error = float('inf')
-            self['semiminor'].error = float('inf')
-            self['theta'].error = float('inf')
-            return self
+def error_bars_from_moments(peak, flux, semimajor, semiminor, theta, noise,
+                            beam, threshold, clean_bias_error=0.0,
+                            frac_flux_cal_error=0.0):
+    """Provide reasonable error estimates from the moments
+
+    The parameters of the sources, the noise and the threshold may be given
+    as arrays, with one entry per source.
+
+    Returns:
+
+        (dict): columns of the errors, by the names under which ParamSet
+            stores them, and a column 'unknown' of the sources for which
+            the position errors can't be estimated (see below).
+    """
+
+    # The formulae below should give some reasonable estimate of the
+    # errors from moments, should always be higher than the errors from
+    # Gauss fitting.
+    peak = numpy.asarray(peak, dtype=numpy.float64)
+    smaj = semimajor
+    smin = semiminor
 
-        clean_bias_error = self.clean_bias_error
-        frac_flux_cal_error = self.frac_flux_cal_error
-        theta_B, theta_b = utils.calculate_correlation_lengths(
-            beam[0], beam[1])
+    theta_B, theta_b = utils.calculate_correlation_lengths(
+        beam[0], beam[1])
 
+    with numpy.errstate(divide='ignore', invalid='ignore'):
         # This is eq. 2.81 from Spreeuw's thesis.
         rho_sq = ((16. * smaj * smin /
                   (numpy.log(2.) * theta_B * theta_b*noise**2))
@@ -445,12 +766,7 @@ class ParamSet(DictMixin):
         errorsmaj = numpy.sqrt(2) * smaj / rho
         errorsmin = numpy.sqrt(2) * smin / rho
 
-        if smaj > smin:
-            errortheta = 2.0 * (smaj * smin / (smaj**2 -smin**2)) / rho
-        else:
-            errortheta = numpy.pi
-        if errortheta > numpy.pi:
-            errortheta = numpy.pi
+        errortheta = _theta_error(smaj, smin, rho)
 
         # The peak from "moments" is just the value of the maximum pixel
         # times a correction, fudge_max_pix, for the fact that the
@@ -475,130 +791,178 @@ class ParamSet(DictMixin):
         help3 = theta_B*theta_b/(4.*smaj*smin)
         errorflux = flux*numpy.sqrt(errorpeaksq/peak**2+help3*(help1+help2))
 
-        self['peak'].error = errorpeak
-        self['flux'].error = errorflux
-        self['xbar'].error = errorx
-        self['ybar'].error = errory
-        self['semimajor'].error = errorsmaj
-        self['semiminor'].error = errorsmin
-        self['theta'].error = errortheta
+    # This analysis is only possible if the peak flux is >= 0. This
+    # follows from the definition of eq. 2.81 in Spreeuw's thesis. In that
+    # situation, we set all errors to be infinite, but for those of the
+    # position, which are unknown.
+    unknown = peak < 0
+    columns = {
+        'errpeak': errorpeak,
+        'errflux': errorflux,
+        'errsemimajor': errorsmaj,
+        'errsemiminor': errorsmin,
+        'errtheta': errortheta
+    }
+    for name, column in columns.iteritems():
+        columns[name] = numpy.where(unknown, float('inf'), column)
+    columns['errxbar'] = numpy.where(unknown, numpy.nan, errorx)
+    columns['errybar'] = numpy.where(unknown, numpy.nan, errory)
+    columns['unknown'] = unknown
+    return columns
+
+
+def _theta_error(smaj, smin, rho):
+    """The error on the position angle, which is never more than pi."""
+    errortheta = numpy.where(
+        smaj > smin, 2.0 * (smaj * smin / (smaj**2 - smin**2)) / rho,
+        numpy.pi)
+    return numpy.where(errortheta > numpy.pi, numpy.pi, errortheta)
+
+
+def deconvolve_all(params, beam):
+    """
+    Deconvolve the clean beam from a list of ParamSets, as their
+    deconvolve_from_clean_beam() would, all at once.
 
-        return self
+    Raises ValueError if the error on any of their position angles is
+    infinite, as it is for moments with a negative peak.
+    """
+    if not params:
+        return
+    if any(numpy.isinf(param['theta'].error) for param in params):
+        # As math.cos() in the former deconv().
+        raise ValueError("Can't deconvolve a position angle with an "
+                         "infinite error")
+    columns = deconvolve_from_clean_beam(
+        beam=beam, **_param_columns(params, _DECONV_COLUMNS))
+    for param, ierr in itertools.izip(params, columns.pop('deconv_imposs')):
+        param.deconv_imposs = int(ierr)
+    _update_params(params, columns)
 
-    def deconvolve_from_clean_beam(self, beam):
-        """Deconvolve with the clean beam"""
-
-        # If the fitted axes are smaller than the clean beam
-        # (=restoring beam) axes, the axes and position angle
-        # can be deconvolved from it.
-        fmaj = 2.*self['semimajor'].value
-        fmajerror = 2.*self['semimajor'].error
-        fmin = 2.*self['semiminor'].value
-        fminerror = 2.*self['semiminor'].error
-        fpa = numpy.degrees(self['theta'].value)
-        fpaerror = numpy.degrees(self['theta'].error)
-        cmaj = 2.*beam[0]
-        cmin = 2.*beam[1]
-        cpa = numpy.degrees(beam[2])
-
-        rmaj, rmin, rpa, ierr = deconv(fmaj, fmin, fpa, cmaj, cmin, cpa)
-        # This parameter gives the number of components that could not be
-        # deconvolved, IERR from deconf.f.
-        self.deconv_imposs = ierr
-        # Now, figure out the error bars.
-        if rmaj > 0:
-            # In this case the deconvolved position angle is defined.
-            # For convenience we reset rpa to the interval [-90, 90].
-            if rpa > 90:
-                rpa = -numpy.mod(-rpa, 180.)
-            self['theta_deconv'].value = rpa
-
-            # In the general case, where the restoring beam is elliptic,
-            # calculating the error bars of the deconvolved position angle
-            # is more complicated than in the NVSS case, where a circular
-            # restoring beam was used.
-            # In the NVSS case the error bars of the deconvolved angle are
-            # equal to the fitted angle.
-            rmaj1, rmin1, rpa1, ierr1 = deconv(
-                fmaj, fmin, fpa+fpaerror, cmaj, cmin, cpa)
-            if ierr1 < 2:
-                if rpa1 > 90:
-                    rpa1 = -numpy.mod(-rpa1, 180.)
-                rpaerror1 = numpy.abs(rpa1-rpa)
-                # An angle error can never be more than 90 degrees.
-                if rpaerror1 > 90.:
-                    rpaerror1 = numpy.mod(-rpaerror1, 180.)
-            else:
-                rpaerror1 = numpy.nan
-            rmaj2, rmin2, rpa2, ierr2 = deconv(
-                fmaj, fmin, fpa-fpaerror, cmaj, cmin, cpa)
-            if ierr2 < 2:
-                if rpa2 > 90:
-                    rpa2 = -numpy.mod(-rpa2, 180.)
-                rpaerror2 = numpy.abs(rpa2 - rpa)
-                # An angle error can never be more than 90 degrees.
-                if rpaerror2 > 90.:
-                    rpaerror2 = numpy.mod(-rpaerror2, 180.)
-            else:
-                rpaerror2 = numpy.nan
-            if numpy.isnan(rpaerror1) or numpy.isnan(rpaerror2):
-                self['theta_deconv'].error = numpy.nansum(
-                    [rpaerror1, rpaerror2])
-            else:
-                self['theta_deconv'].error = numpy.mean(
-                    [rpaerror1, rpaerror2])
-            self['semimaj_deconv'].value = rmaj / 2.
-            rmaj3, rmin3, rpa3, ierr3 = deconv(
-                fmaj + fmajerror, fmin, fpa, cmaj, cmin, cpa)
-            # If rmaj>0, then rmaj3 should also be > 0,
-            # if I am not mistaken, see the formulas at
-            # the end of ch.2 of Spreeuw's Ph.D. thesis.
-            if fmaj-fmajerror > fmin:
-                rmaj4, rmin4, rpa4, ierr4 = deconv(
-                    fmaj-fmajerror, fmin, fpa, cmaj, cmin, cpa)
-                if rmaj4 > 0:
-                    self['semimaj_deconv'].error = numpy.mean(
-                        [numpy.abs(rmaj3-rmaj), numpy.abs(rmaj - rmaj4)])
-                else:
-                    self['semimaj_deconv'].error = numpy.abs(rmaj3 - rmaj)
-            else:
-                rmin4, rmaj4, rpa4, ierr4 = deconv(
-                    fmin, fmaj - fmajerror, fpa, cmaj, cmin, cpa)
-                if rmaj4>0:
-                    self['semimaj_deconv'].error = numpy.mean(
-                        [numpy.abs(rmaj3-rmaj), numpy.abs(rmaj - rmaj4)])
-                else:
-                    self['semimaj_deconv'].error = numpy.abs(rmaj3 - rmaj)
-            if rmin > 0:
-                self['semimin_deconv'].value = rmin / 2.
-                if fmin + fminerror < fmaj:
-                    rmaj5, rmin5, rpa5, ierr5 = deconv(
-                        fmaj, fmin+fminerror, fpa, cmaj, cmin, cpa)
-                else:
-                    rmin5, rmaj5, rpa5, ierr5 = deconv(
-                        fmin+fminerror, fmaj, fpa, cmaj, cmin, cpa)
-                # If rmin > 0, then rmin5 should also be > 0,
-                # if I am not mistaken, see the formulas at
-                # the end of ch.2 of Spreeuw's Ph.D. thesis.
-                rmaj6, rmin6, rpa6, ierr6 = deconv(
-                    fmaj, fmin-fminerror, fpa, cmaj, cmin, cpa)
-                if rmin6 > 0:
-                    self['semimin_deconv'].error = numpy.mean(
-                        [numpy.abs(rmin6-rmin), numpy.abs(rmin5 - rmin)])
-                else:
-                    self['semimin_deconv'].error = numpy.abs(rmin5 - rmin)
-            else:
-                self['semimin_deconv'] = Uncertain(
-                    numpy.nan, numpy.nan)
-        else:
-            self['semimaj_deconv'] = Uncertain(numpy.nan, numpy.nan)
-            self['semimin_deconv'] = Uncertain(numpy.nan, numpy.nan)
-            self['theta_deconv'] = Uncertain(numpy.nan, numpy.nan)
 
-        return self
+def _deconv_angle(rpa):
+    """Reset deconvolved position angles to the interval [-90, 90]."""
+    return numpy.where(rpa > 90, -numpy.mod(-rpa, 180.), rpa)
+
 
+def deconvolve_from_clean_beam(semimajor, errsemimajor, semiminor,
+                               errsemiminor, theta, errtheta, beam):
+    """Deconvolve with the clean beam
+
+    The fitted shapes, and their errors, may be given as arrays, with one
+    entry per source.
+
+    Returns:
 
-def source_profile_and_errors(data, threshold, noise, beam, fixed=None, residuals=True):
+        (dict): columns of the deconvolved shapes and their errors, by the
+            names under which ParamSet stores them, and deconv_imposs, the
+            number of components which could not be deconvolved.
+    """
+
+    # If the fitted axes are smaller than the clean beam
+    # (=restoring beam) axes, the axes and position angle
+    # can be deconvolved from it.
+    semimajor, errsemimajor, semiminor, errsemiminor, theta, errtheta = (
+        numpy.broadcast_arrays(*[
+            numpy.atleast_1d(numpy.asarray(column, dtype=numpy.float64))
+            for column in (semimajor, errsemimajor, semiminor, errsemiminor,
+                           theta, errtheta)]))
+    fmaj = 2.*semimajor
+    fmajerror = 2.*errsemimajor
+    fmin = 2.*semiminor
+    fminerror = 2.*errsemiminor
+    fpa = numpy.degrees(theta)
+    fpaerror = numpy.degrees(errtheta)
+    cmaj = 2.*beam[0]
+    cmin = 2.*beam[1]
+    cpa = numpy.degrees(beam[2])
+
+    # Besides the fitted shape itself, we deconvolve it with each of its
+    # parameters offset by its error. These are all done in one go.
+    longer = fmaj - fmajerror > fmin
+    shorter = fmin + fminerror < fmaj
+    offsets = [
+        (fmaj, fmin, fpa),
+        (fmaj, fmin, fpa + fpaerror),
+        (fmaj, fmin, fpa - fpaerror),
+        (fmaj + fmajerror, fmin, fpa),
+        (numpy.where(longer, fmaj - fmajerror, fmin),
+         numpy.where(longer, fmin, fmaj - fmajerror), fpa),
+        (numpy.where(shorter, fmaj, fmin + fminerror),
+         numpy.where(shorter, fmin + fminerror, fmaj), fpa),
+        (fmaj, fmin - fminerror, fpa)
+    ]
+    results = deconv_array(*[numpy.concatenate(args)
+                             for args in zip(*offsets)] +
+                           [cmaj, cmin, cpa])
+    ((rmaj, rmaj1, rmaj2, rmaj3, rmaj4, rmaj5, rmaj6),
+     (rmin, rmin1, rmin2, rmin3, rmin4, rmin5, rmin6),
+     (rpa, rpa1, rpa2, rpa3, rpa4, rpa5, rpa6),
+     (ierr, ierr1, ierr2, ierr3, ierr4, ierr5, ierr6)) = [
+        numpy.split(column, len(offsets)) for column in results]
+
+    with numpy.errstate(invalid='ignore'):
+        # Where rmaj > 0, the deconvolved position angle is defined.
+        rpa = _deconv_angle(rpa)
+
+        # In the general case, where the restoring beam is elliptic,
+        # calculating the error bars of the deconvolved position angle
+        # is more complicated than in the NVSS case, where a circular
+        # restoring beam was used.
+        # In the NVSS case the error bars of the deconvolved angle are
+        # equal to the fitted angle.
+        rpaerrors = []
+        for rpa_offset, ierr_offset in ((rpa1, ierr1), (rpa2, ierr2)):
+            rpaerror = numpy.abs(_deconv_angle(rpa_offset) - rpa)
+            # An angle error can never be more than 90 degrees.
+            rpaerror = numpy.where(rpaerror > 90.,
+                                   numpy.mod(-rpaerror, 180.), rpaerror)
+            rpaerrors.append(numpy.where(ierr_offset < 2, rpaerror,
+                                         numpy.nan))
+        rpaerror1, rpaerror2 = rpaerrors
+        either_nan = numpy.isnan(rpaerror1) | numpy.isnan(rpaerror2)
+        rpaerror = numpy.where(
+            either_nan,
+            numpy.where(numpy.isnan(rpaerror1), 0., rpaerror1) +
+            numpy.where(numpy.isnan(rpaerror2), 0., rpaerror2),
+            (rpaerror1 + rpaerror2) / 2.)
+
+        # If rmaj>0, then rmaj3 should also be > 0,
+        # if I am not mistaken, see the formulas at
+        # the end of ch.2 of Spreeuw's Ph.D. thesis.
+        rmaj4 = numpy.where(longer, rmaj4, rmin4)
+        rmajerror = numpy.where(
+            rmaj4 > 0,
+            (numpy.abs(rmaj3 - rmaj) + numpy.abs(rmaj - rmaj4)) / 2.,
+            numpy.abs(rmaj3 - rmaj))
+
+        # If rmin > 0, then rmin5 should also be > 0,
+        # if I am not mistaken, see the formulas at
+        # the end of ch.2 of Spreeuw's Ph.D. thesis.
+        rmin5 = numpy.where(shorter, rmin5, rmaj5)
+        rminerror = numpy.where(
+            rmin6 > 0,
+            (numpy.abs(rmin6 - rmin) + numpy.abs(rmin5 - rmin)) / 2.,
+            numpy.abs(rmin5 - rmin))
+
+        resolved = rmaj > 0
+        both_resolved = resolved & (rmin > 0)
+
+    return {
+        'semimaj_deconv': numpy.where(resolved, rmaj / 2., numpy.nan),
+        'errsemimaj_deconv': numpy.where(resolved, rmajerror, numpy.nan),
+        'semimin_deconv': numpy.where(both_resolved, rmin / 2., numpy.nan),
+        'errsemimin_deconv': numpy.where(both_resolved, rminerror, numpy.nan),
+        'theta_deconv': numpy.where(resolved, rpa, numpy.nan),
+        'errtheta_deconv': numpy.where(resolved, rpaerror, numpy.nan),
+        # The number of components that could not be deconvolved, IERR from
+        # deconf.f.
+        'deconv_imposs': ierr
+    }
+
+
+def source_profile_and_errors(data, threshold, noise, beam, fixed=None,
+                              residuals=True, moments=None, errors=True):
     """Return a number of measurable properties with errorbars
 
     Given an island of pixels it will return a number of measurable
@@ -627,6 +991,12 @@ def source_profile_and_errors(data, threshold, noise, beam, fixed=None, residual
             on to fitting.fitgaussian(): this will lock fit to only
             occur at that pixel coordinate.
 
+        moments: raw moments of the data, if already measured; see
+            fitting.labelled_moments().
+
+        errors (bool): whether to calculate the errors and the deconvolved
+            shape.
+
     Returns:
 
         (tuple): a populated ParamSet, and a residual array.
@@ -642,7 +1012,10 @@ def source_profile_and_errors(data, threshold, noise, beam, fixed=None, residual
         moments_threshold = threshold
 
     try:
-        param.update(fitting.moments(data, beam, moments_threshold))
+        if moments is None:
+            moments = fitting.raw_moments(data, beam)
+        param.update(fitting.moments_to_shape(moments, beam,
+                                              moments_threshold))
         param.moments = True
     except ValueError:
         # If this happens, we have two choices:
@@ -685,8 +1058,9 @@ def source_profile_and_errors(data, threshold, noise, beam, fixed=None, residual
     beamsize = utils.calculate_beamsize(beam[0], beam[1])
     param["flux"] = (numpy.pi * param["peak"] * param["semimajor"] *
                      param["semiminor"] / beamsize)
-    param.calculate_errors(noise, beam, threshold)
-    param.deconvolve_from_clean_beam(beam)
+    if errors:
+        param.calculate_errors(noise, beam, threshold)
+        param.deconvolve_from_clean_beam(beam)
     if residuals:
         gauss_arg = (param["peak"].value,
                      param["xbar"].value,
@@ -702,10 +1076,56 @@ def source_profile_and_errors(data, threshold, noise, beam, fixed=None, residual
     return param, gauss_resid
 
 
+# The properties of a Detection which are stored, with their errors, in a
+# record; see Detection.to_record().
+_UNCERTAIN_ATTRS = (
+    'peak', 'flux', 'x', 'y', 'smaj', 'smin', 'theta', 'smaj_dc', 'smin_dc',
+    'theta_dc', 'ra', 'dec', 'theta_celes', 'theta_dc_celes', 'smaj_asec',
+    'smin_asec'
+)
+_FLOAT_ATTRS = (
+    'eps_ra', 'eps_dec', 'sig', 'error_radius', 'end_smaj_x', 'start_smaj_x',
+    'end_smaj_y', 'start_smaj_y', 'end_smin_x', 'start_smin_x', 'end_smin_y',
+    'start_smin_y'
+)
+DETECTION_DTYPE = numpy.dtype(
+    [(name + suffix, numpy.float64)
+     for name in _UNCERTAIN_ATTRS for suffix in ("", "_err")] +
+    [(name, numpy.float64) for name in _FLOAT_ATTRS] +
+    [('dc_imposs', numpy.int32), ('gaussian', numpy.bool_),
+     ('chunk', numpy.int64, (4,))]
+)
+
+
+def detections_to_array(detections):
+    """
+    Return the measured properties of a list of detections as a structured
+    array with dtype DETECTION_DTYPE.
+
+    This is much cheaper to store or send to another process than the
+    detections themselves; see Detection.to_record().
+    """
+    return numpy.array([det.to_record() for det in detections],
+                       dtype=DETECTION_DTYPE)
+
+
+def detections_from_array(records):
+    """
+    Rebuild a list of detections from the output of detections_to_array().
+    """
+    return [Detection.from_record(record) for record in records]
+
+
 class Detection(object):
     """The result of a measurement at a given position in a given image."""
 
-    def __init__(self, paramset, imagedata, chunk=None, eps_ra=0, eps_dec=0):
+    def __init__(self, paramset, imagedata, chunk=None, eps_ra=0, eps_dec=0,
+                 convert_coordinates=True):
+        """
+        If convert_coordinates is False, the physical (celestial) coordinates
+        are not calculated; that is left to the caller, who should use
+        physical_coordinates() to do so for many detections at once.
+        """
 
         self.eps_ra = eps_ra
         self.eps_dec = eps_dec
@@ -732,51 +1152,67 @@ class Detection(object):
 
         self.sig = paramset.sig
 
-        try:
+        if convert_coordinates:
             self._physical_coordinates()
-        except RuntimeError:
-            logger.warn("Physical coordinates failed at %f, %f" % (
-                self.x, self.y))
-            raise
 
     def __getstate__(self):
-        return {
-            'imagedata': self.imagedata,
-            'chunk': (self.chunk[0].start, self.chunk[0].stop,
-                      self.chunk[1].start, self.chunk[1].stop),
-            'peak': self.peak,
-            'flux': self.flux,
-            'x': self.x,
-            'y': self.y,
-            'smaj': self.smaj,
-            'smin': self.smin,
-            'theta': self.theta,
-            'sig': self.sig,
-            'error_radius': self.error_radius,
-            'gaussian': self.gaussian,
-        }
-
-    def __setstate__(self, attrdict):
-        self.imagedata = attrdict['imagedata']
-        self.chunk = (slice(attrdict['chunk'][0], attrdict['chunk'][1]),
-                      slice(attrdict['chunk'][2], attrdict['chunk'][3]))
-        self.peak = attrdict['peak']
-        self.flux = attrdict['flux']
-        self.x = attrdict['x']
-        self.y = attrdict['y']
-        self.smaj = attrdict['smaj']
-        self.smin = attrdict['smin']
-        self.theta = attrdict['theta']
-        self.sig = attrdict['sig']
-        self.error_radius = attrdict['error_radius']
-        self.gaussian = attrdict['gaussian']
+        # We don't pickle the image: it's far bigger than the detection, and
+        # once the physical coordinates have been calculated we no longer
+        # need it. See to_record().
+        return self.to_record().item()
 
-        try:
-            self._physical_coordinates()
-        except RuntimeError, e:
-            logger.warn("Physical coordinates failed at %f, %f" % (
-                self.x, self.y))
-            raise
+    def __setstate__(self, state):
+        self._set_from_record(numpy.array(state, dtype=DETECTION_DTYPE)[()])
+
+    def to_record(self):
+        """
+        Return the measured properties of this detection as a record with
+        dtype DETECTION_DTYPE.
+
+        The record contains all the properties of the detection except for
+        the image it was found in. The physical coordinates must already have
+        been calculated.
+        """
+        record = numpy.zeros((), dtype=DETECTION_DTYPE)
+        for attrname in _UNCERTAIN_ATTRS:
+            record[attrname] = getattr(self, attrname).value
+            record[attrname + "_err"] = getattr(self, attrname).error
+        for attrname in _FLOAT_ATTRS:
+            record[attrname] = getattr(self, attrname)
+        record['dc_imposs'] = self.dc_imposs
+        record['gaussian'] = self.gaussian
+        if self.chunk is not None:
+            record['chunk'] = (self.chunk[0].start, self.chunk[0].stop,
+                               self.chunk[1].start, self.chunk[1].stop)
+        else:
+            record['chunk'] = -1
+        return record[()]
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Rebuild a detection from a record returned by to_record().
+
+        The detection doesn't refer to an image: its imagedata is None.
+        """
+        detection = cls.__new__(cls)
+        detection._set_from_record(record)
+        return detection
+
+    def _set_from_record(self, record):
+        self.imagedata = None
+        for attrname in _UNCERTAIN_ATTRS:
+            setattr(self, attrname, Uncertain(record[attrname],
+                                              record[attrname + "_err"]))
+        for attrname in _FLOAT_ATTRS:
+            setattr(self, attrname, record[attrname])
+        self.dc_imposs = int(record['dc_imposs'])
+        self.gaussian = bool(record['gaussian'])
+        if record['chunk'][0] >= 0:
+            self.chunk = (slice(record['chunk'][0], record['chunk'][1]),
+                          slice(record['chunk'][2], record['chunk'][3]))
+        else:
+            self.chunk = None
 
     def __getattr__(self, attrname):
         # Backwards compatibility for "errquantity" attributes
@@ -796,171 +1232,7 @@ class Detection(object):
     def _physical_coordinates(self):
         """Convert the pixel parameters for this object into something
         physical."""
-
-        # First, the RA & dec.
-        self.ra, self.dec = [Uncertain(x) for x in self.imagedata.wcs.p2s(
-            [self.x.value, self.y.value])]
-        if numpy.isnan(self.dec.value) or abs(self.dec) > 90.0:
-            raise ValueError("object falls outside the sky")
-
-        # First, determine local north.
-        help1 = numpy.cos(numpy.radians(self.ra.value))
-        help2 = numpy.sin(numpy.radians(self.ra.value))
-        help3 = numpy.cos(numpy.radians(self.dec.value))
-        help4 = numpy.sin(numpy.radians(self.dec.value))
-        center_position = numpy.array([help3*help1, help3*help2, help4])
-
-        # The length of this vector is chosen such that it touches
-        # the tangent plane at center position.
-        # The cross product of the local north vector and the local east
-        # vector will always be aligned with the center_position vector.
-        if center_position[2] != 0:
-            local_north_position = numpy.array([0., 0., 1./center_position[2]])
-        else:
-            # If we are right on the equator (ie dec=0) the division above
-            # will blow up: as a workaround, we use something Really Big
-            # instead.
-            local_north_position = numpy.array([0., 0., 99e99])
-        # Next, determine the orientation of the y-axis wrt local north
-        # by incrementing y by a small amount and converting that
-        # to celestial coordinates. That small increment is conveniently
-        # chosen to be an increment of 1 pixel.
-
-        endy_ra, endy_dec = self.imagedata.wcs.p2s(
-            [self.x.value, self.y.value+1.])
-        help5 = numpy.cos(numpy.radians(endy_ra))
-        help6 = numpy.sin(numpy.radians(endy_ra))
-        help7 = numpy.cos(numpy.radians(endy_dec))
-        help8 = numpy.sin(numpy.radians(endy_dec))
-        endy_position = numpy.array([help7*help5, help7*help6, help8])
-
-        # Extend the length of endy_position to make it touch the plane
-        # tangent at center_position.
-        endy_position /= numpy.dot(center_position, endy_position)
-
-        diff1 = endy_position-center_position
-        diff2 = local_north_position-center_position
-
-        cross_prod = numpy.cross(diff2, diff1)
-
-        length_cross_sq = numpy.dot(cross_prod, cross_prod)
-
-        normalization = numpy.dot(diff1, diff1) * numpy.dot(diff2, diff2)
-
-        # The length of the cross product equals the product of the lengths of
-        # the vectors times the sine of their angle.
-        # This is the angle between the y-axis and local north,
-        # measured eastwards.
-        # yoffset_angle = numpy.degrees(
-        #    numpy.arcsin(numpy.sqrt(length_cross_sq/normalization)))
-        # The formula above is commented out because the angle computed
-        # in this way will always be 0<=yoffset_angle<=90.
-        # We'll use the dotproduct instead.
-        yoffs_rad = (numpy.arccos(numpy.dot(diff1, diff2) /
-                                  numpy.sqrt(normalization)))
-
-        # The multiplication with -sign_cor makes sure that the angle
-        # is measured eastwards (increasing RA), not westwards.
-        sign_cor = (numpy.dot(cross_prod, center_position) /
-                    numpy.sqrt(length_cross_sq))
-        yoffs_rad *= -sign_cor
-        yoffset_angle = numpy.degrees(yoffs_rad)
-
-        # Now that we have the BPA, we can also compute the position errors
-        # properly, by projecting the errors in pixel coordinates (x and y)
-        # on local north and local east.
-        errorx_proj = numpy.sqrt(
-            (self.x.error*numpy.cos(yoffs_rad))**2 +
-            (self.y.error*numpy.sin(yoffs_rad))**2)
-        errory_proj = numpy.sqrt(
-            (self.x.error*numpy.sin(yoffs_rad))**2 +
-            (self.y.error*numpy.cos(yoffs_rad))**2)
-
-        # Now we have to sort out which combination of errorx_proj and
-        # errory_proj gives the largest errors in RA and Dec.
-        try:
-            end_ra1, end_dec1 = self.imagedata.wcs.p2s(
-                                       [self.x.value+errorx_proj, self.y.value])
-            end_ra2, end_dec2 = self.imagedata.wcs.p2s(
-                [self.x.value, self.y.value+errory_proj])
-            # Here we include the position calibration errors
-            self.ra.error = self.eps_ra + max(
-                numpy.fabs(self.ra.value - end_ra1),
-                numpy.fabs(self.ra.value - end_ra2))
-            self.dec.error = self.eps_dec + max(
-                numpy.fabs(self.dec.value - end_dec1),
-                numpy.fabs(self.dec.value - end_dec2))
-        except RuntimeError:
-            #We get a runtime error from wcs.p2s if the errors place the
-            #limits outside of the image.
-            #In which case we set the RA / DEC uncertainties to infinity
-            self.ra.error = float('inf')
-            self.dec.error = float('inf')
-
-        # Estimate an absolute angular error on our central position.
-        self.error_radius = utils.get_error_radius(
-            self.imagedata.wcs, self.x.value, self.x.error, self.y.value, self.y.error
-        )
-
-        # Now we can compute the BPA, east from local north.
-        # That these angles can simply be added is not completely trivial.
-        # First, the Gaussian in gaussian.py must be such that theta is
-        # measured from the positive y-axis in the direction of negative x.
-        # Secondly, x and y are defined such that the direction
-        # positive y-->negative x-->negative y-->positive x is the same
-        # direction (counterclockwise) as (local) north-->east-->south-->west.
-        # If these two conditions are matched, the formula below is valid.
-        # Of course, the formula is also valid if theta is measured
-        # from the positive y-axis towards positive x
-        # and both of these directions are equal (clockwise).
-        self.theta_celes = Uncertain(
-            (numpy.degrees(self.theta.value) + yoffset_angle) % 180,
-            numpy.degrees(self.theta.error))
-        self.theta_dc_celes = Uncertain(
-            (self.theta_dc.value + yoffset_angle) % 180,
-            numpy.degrees(self.theta_dc.error))
-
-        # Next, the axes.
-        # Note that the signs of numpy.sin and numpy.cos in the
-        # four expressions below are arbitrary.
-        self.end_smaj_x = (self.x.value - numpy.sin(self.theta.value) *
-                      self.smaj.value)
-        self.start_smaj_x = (self.x.value + numpy.sin(self.theta.value) *
-                      self.smaj.value)
-        self.end_smaj_y = (self.y.value + numpy.cos(self.theta.value) *
-                      self.smaj.value)
-        self.start_smaj_y = (self.y.value - numpy.cos(self.theta.value) *
-                      self.smaj.value)
-        self.end_smin_x = (self.x.value + numpy.cos(self.theta.value) *
-                      self.smin.value)
-        self.start_smin_x = (self.x.value - numpy.cos(self.theta.value) *
-                      self.smin.value)
-        self.end_smin_y = (self.y.value + numpy.sin(self.theta.value) *
-                      self.smin.value)
-        self.start_smin_y = (self.y.value - numpy.sin(self.theta.value) *
-                      self.smin.value)
-
-
-        def pixel_to_spatial(x, y):
-            try:
-                return self.imagedata.wcs.p2s([x, y])
-            except RuntimeError:
-                logger.debug("pixel_to_spatial failed at %f, %f" % (x, y))
-                return numpy.nan, numpy.nan
-        end_smaj_ra, end_smaj_dec = pixel_to_spatial(self.end_smaj_x, self.end_smaj_y)
-        end_smin_ra, end_smin_dec = pixel_to_spatial(self.end_smin_x, self.end_smin_y)
-
-        smaj_asec = coordinates.angsep(self.ra.value, self.dec.value,
-                                       end_smaj_ra, end_smaj_dec)
-        scaling_smaj = smaj_asec / self.smaj.value
-        errsmaj_asec = scaling_smaj * self.smaj.error
-        self.smaj_asec = Uncertain(smaj_asec, errsmaj_asec)
-
-        smin_asec = coordinates.angsep(self.ra.value, self.dec.value,
-                                       end_smin_ra, end_smin_dec)
-        scaling_smin = smin_asec / self.smin.value
-        errsmin_asec = scaling_smin * self.smin.error
-        self.smin_asec = Uncertain(smin_asec, errsmin_asec)
+        physical_coordinates([self])
 
     def distance_from(self, x, y):
         """Distance from center"""
@@ -992,3 +1264,218 @@ class Detection(object):
             self.error_radius,
             self.gaussian
         ]
+
+
+def _angsep(ra1, dec1, ra2, dec2):
+    """Array version of coordinates.angsep(), in arcseconds."""
+    b = (numpy.pi / 2) - numpy.radians(dec1)
+    c = (numpy.pi / 2) - numpy.radians(dec2)
+    temp = (numpy.cos(b) * numpy.cos(c) +
+            numpy.sin(b) * numpy.sin(c) * numpy.cos(numpy.radians(ra1 - ra2)))
+    return 3600 * numpy.degrees(numpy.arccos(numpy.clip(temp, -1.0, 1.0)))
+
+
+def _unit_vectors(ra, dec):
+    """Cartesian unit vectors (N x 3) pointing at the given positions."""
+    ra, dec = numpy.radians(ra), numpy.radians(dec)
+    return numpy.column_stack((numpy.cos(dec) * numpy.cos(ra),
+                               numpy.cos(dec) * numpy.sin(ra),
+                               numpy.sin(dec)))
+
+
+def physical_coordinates(detections):
+    """Convert the pixel parameters of detections into something physical.
+
+    This sets the celestial position and its errors, the error radius, the
+    position angles and the axis lengths in arcsec of each of the
+    detections, which must all come from the same image. Rather than
+    converting the positions of each detection in turn, all the conversions
+    are done with two calls to the WCS, in bulk.
+
+    Args:
+
+        detections (list): Detection instances.
+
+    Raises:
+
+        RuntimeError: if a central position can't be converted
+
+        ValueError: if a central position falls outside the sky
+    """
+    if not len(detections):
+        return
+    wcs = detections[0].imagedata.wcs
+    n = len(detections)
+    x = numpy.array([det.x.value for det in detections], dtype=numpy.float64)
+    y = numpy.array([det.y.value for det in detections], dtype=numpy.float64)
+    x_err = numpy.array([det.x.error for det in detections],
+                        dtype=numpy.float64)
+    y_err = numpy.array([det.y.error for det in detections],
+                        dtype=numpy.float64)
+
+    # First, the RA & dec. We also convert a position offset by one pixel
+    # along the y-axis, to determine the orientation of the y-axis wrt local
+    # north (below).
+    sky = wcs.all_p2s(numpy.column_stack((
+        numpy.concatenate((x, x)), numpy.concatenate((y, y + 1.)))))
+    ra, dec = sky[:n, 0], sky[:n, 1]
+    endy_ra, endy_dec = sky[n:, 0], sky[n:, 1]
+    failed = numpy.isnan(sky).any(axis=1)
+    failed = failed[:n] | failed[n:]
+    for index in numpy.flatnonzero(failed):
+        logger.warn("Physical coordinates failed at %f, %f" % (
+            x[index], y[index]))
+    if failed.any():
+        raise RuntimeError("Spatial position is not a number")
+    if (numpy.abs(dec) > 90.0).any():
+        raise ValueError("object falls outside the sky")
+
+    # Determine local north.
+    center_position = _unit_vectors(ra, dec)
+
+    # The length of this vector is chosen such that it touches
+    # the tangent plane at center position.
+    # The cross product of the local north vector and the local east
+    # vector will always be aligned with the center_position vector.
+    # If we are right on the equator (ie dec=0) the division would blow up:
+    # as a workaround, we use something Really Big instead.
+    local_north_position = numpy.zeros((n, 3))
+    on_equator = center_position[:, 2] == 0
+    local_north_position[:, 2] = numpy.where(
+        on_equator, 99e99,
+        1. / numpy.where(on_equator, 1., center_position[:, 2]))
+
+    # Next, determine the orientation of the y-axis wrt local north
+    # by incrementing y by a small amount and converting that
+    # to celestial coordinates. That small increment is conveniently
+    # chosen to be an increment of 1 pixel.
+    endy_position = _unit_vectors(endy_ra, endy_dec)
+
+    # Extend the length of endy_position to make it touch the plane
+    # tangent at center_position.
+    endy_position /= (center_position * endy_position).sum(axis=1)[:, None]
+
+    diff1 = endy_position - center_position
+    diff2 = local_north_position - center_position
+
+    cross_prod = numpy.cross(diff2, diff1)
+
+    length_cross_sq = (cross_prod * cross_prod).sum(axis=1)
+
+    normalization = (diff1 * diff1).sum(axis=1) * (diff2 * diff2).sum(axis=1)
+
+    # The length of the cross product equals the product of the lengths of
+    # the vectors times the sine of their angle, but that would only give
+    # 0<=yoffset_angle<=90. We'll use the dotproduct instead, to get the
+    # angle between the y-axis and local north, measured eastwards.
+    yoffs_rad = numpy.arccos((diff1 * diff2).sum(axis=1) /
+                             numpy.sqrt(normalization))
+
+    # The multiplication with -sign_cor makes sure that the angle
+    # is measured eastwards (increasing RA), not westwards.
+    sign_cor = ((cross_prod * center_position).sum(axis=1) /
+                numpy.sqrt(length_cross_sq))
+    yoffs_rad *= -sign_cor
+    yoffset_angle = numpy.degrees(yoffs_rad)
+
+    # Now that we have the BPA, we can also compute the position errors
+    # properly, by projecting the errors in pixel coordinates (x and y)
+    # on local north and local east.
+    errorx_proj = numpy.sqrt((x_err * numpy.cos(yoffs_rad))**2 +
+                             (y_err * numpy.sin(yoffs_rad))**2)
+    errory_proj = numpy.sqrt((x_err * numpy.sin(yoffs_rad))**2 +
+                             (y_err * numpy.cos(yoffs_rad))**2)
+
+    # The ends of the axes.
+    # Note that the signs of numpy.sin and numpy.cos in the
+    # four expressions below are arbitrary.
+    theta = numpy.array([det.theta.value for det in detections],
+                        dtype=numpy.float64)
+    smaj = numpy.array([det.smaj.value for det in detections],
+                       dtype=numpy.float64)
+    smin = numpy.array([det.smin.value for det in detections],
+                       dtype=numpy.float64)
+    end_smaj_x = x - numpy.sin(theta) * smaj
+    start_smaj_x = x + numpy.sin(theta) * smaj
+    end_smaj_y = y + numpy.cos(theta) * smaj
+    start_smaj_y = y - numpy.cos(theta) * smaj
+    end_smin_x = x + numpy.cos(theta) * smin
+    start_smin_x = x - numpy.cos(theta) * smin
+    end_smin_y = y + numpy.sin(theta) * smin
+    start_smin_y = y - numpy.sin(theta) * smin
+
+    # All the other positions we need in celestial coordinates, in one go:
+    # the ends of the projected position errors, the corners of the error
+    # box for the error radius (all combinations, in case we have a
+    # nonlinear WCS) and the ends of the axes.
+    others = wcs.all_p2s(numpy.column_stack((
+        numpy.concatenate((x + errorx_proj, x,
+                           x + x_err, x - x_err, x + x_err, x - x_err,
+                           end_smaj_x, end_smin_x)),
+        numpy.concatenate((y, y + errory_proj,
+                           y + y_err, y + y_err, y - y_err, y - y_err,
+                           end_smaj_y, end_smin_y))
+    )))
+    others_ra = others[:, 0].reshape(8, n)
+    others_dec = others[:, 1].reshape(8, n)
+    others_failed = numpy.isnan(others).any(axis=1).reshape(8, n)
+
+    # Sort out which combination of errorx_proj and errory_proj gives the
+    # largest errors in RA and Dec. If the errors place the limits outside
+    # of the image, we set the RA / Dec uncertainties to infinity.
+    eps_ra = numpy.array([det.eps_ra for det in detections])
+    eps_dec = numpy.array([det.eps_dec for det in detections])
+    errors_failed = others_failed[0:2].any(axis=0)
+    with numpy.errstate(invalid='ignore'):
+        ra_error = numpy.where(
+            errors_failed, numpy.inf,
+            eps_ra + numpy.fabs(ra - others_ra[0:2]).max(axis=0))
+        dec_error = numpy.where(
+            errors_failed, numpy.inf,
+            eps_dec + numpy.fabs(dec - others_dec[0:2]).max(axis=0))
+
+    # Estimate an absolute angular error on our central position; see
+    # utils.get_error_radius(). This is pessimistic, taking the largest
+    # separation from the corners of the error box.
+    with numpy.errstate(invalid='ignore'):
+        error_radius = numpy.where(
+            others_failed[2:6].any(axis=0), numpy.inf,
+            _angsep(ra, dec, others_ra[2:6], others_dec[2:6]).max(axis=0))
+
+    smaj_asec = _angsep(ra, dec, others_ra[6], others_dec[6])
+    smin_asec = _angsep(ra, dec, others_ra[7], others_dec[7])
+
+    for i, det in enumerate(detections):
+        det.ra, det.dec = Uncertain(ra[i]), Uncertain(dec[i])
+        det.ra.error = ra_error[i]
+        det.dec.error = dec_error[i]
+        det.error_radius = error_radius[i]
+
+        # Now we can compute the BPA, east from local north.
+        # That these angles can simply be added is not completely trivial.
+        # First, the Gaussian in gaussian.py must be such that theta is
+        # measured from the positive y-axis in the direction of negative x.
+        # Secondly, x and y are defined such that the direction
+        # positive y-->negative x-->negative y-->positive x is the same
+        # direction (counterclockwise) as (local) north-->east-->south-->west.
+        # If these two conditions are matched, the formula below is valid.
+        # Of course, the formula is also valid if theta is measured
+        # from the positive y-axis towards positive x
+        # and both of these directions are equal (clockwise).
+        det.theta_celes = Uncertain(
+            (numpy.degrees(det.theta.value) + yoffset_angle[i]) % 180,
+            numpy.degrees(det.theta.error))
+        det.theta_dc_celes = Uncertain(
+            (det.theta_dc.value + yoffset_angle[i]) % 180,
+            numpy.degrees(det.theta_dc.error))
+
+        det.end_smaj_x, det.start_smaj_x = end_smaj_x[i], start_smaj_x[i]
+        det.end_smaj_y, det.start_smaj_y = end_smaj_y[i], start_smaj_y[i]
+        det.end_smin_x, det.start_smin_x = end_smin_x[i], start_smin_x[i]
+        det.end_smin_y, det.start_smin_y = end_smin_y[i], start_smin_y[i]
+
+        # Next, the axes.
+        det.smaj_asec = Uncertain(
+            smaj_asec[i], smaj_asec[i] / det.smaj.value * det.smaj.error)
+        det.smin_asec = Uncertain(
+            smin_asec[i], smin_asec[i] / det.smin.value * det.smin.error)
@@ -10,6 +10,16 @@ import utils
 
 FIT_PARAMS = ('peak', 'xbar', 'ybar', 'semimajor', 'semiminor', 'theta')
 
+# The first and second moments of an island, from which its shape is
+# estimated; see raw_moments() and labelled_moments().
+MOMENTS_DTYPE = numpy.dtype([
+    ('peak', numpy.float64), ('flux', numpy.float64),
+    ('xbar', numpy.float64), ('ybar', numpy.float64),
+    ('xxbar', numpy.float64), ('yybar', numpy.float64),
+    ('xybar', numpy.float64), ('nonzero', numpy.int64)
+])
+
+
 def moments(data, beam, threshold=0):
     """Calculate source positional values using moments
 
@@ -33,21 +43,146 @@ def moments(data, beam, threshold=0):
     ellipse. The second moments are used to estimate the rotation angle
     and the length of the axes.
     """
+    return moments_to_shape(raw_moments(data, beam), beam, threshold)
+
+
+def raw_moments(data, beam):
+    """The peak, total, barycenter and second moments of an island
+
+    Args:
+
+        data (numpy.ndarray): Actual 2D image data
 
+        beam (3-tuple): beam (psf) information
+
+    Returns:
+
+        (dict): the fields of MOMENTS_DTYPE; see moments_to_shape().
+    """
     # Are we fitting a -ve or +ve Gaussian?
     if data.mean() >= 0:
         # The peak is always underestimated when you take the highest pixel.
         peak = data.max() * utils.fudge_max_pix(beam[0], beam[1], beam[2])
     else:
         peak = data.min()
-    ratio = threshold / peak
     total = data.sum()
     x, y = numpy.indices(data.shape)
     xbar = float((x * data).sum()/total)
     ybar = float((y * data).sum()/total)
-    xxbar = (x * x * data).sum()/total - xbar**2
-    yybar = (y * y * data).sum()/total - ybar**2
-    xybar = (x * y * data).sum()/total - xbar * ybar
+    return {
+        "peak": peak,
+        "flux": total,
+        "xbar": xbar,
+        "ybar": ybar,
+        "xxbar": (x * x * data).sum()/total - xbar**2,
+        "yybar": (y * y * data).sum()/total - ybar**2,
+        "xybar": (x * y * data).sum()/total - xbar * ybar,
+        "nonzero": len(data.nonzero()[0])
+    }
+
+
+def labelled_moments(data, labelled_data, labels, origins, beam):
+    """The raw moments of many islands at once
+
+    This gives the same results as raw_moments() applied to each island in
+    turn, but measures all of them in a single pass over the labelled
+    image, rather than building arrays for each island.
+
+    Args:
+
+        data (numpy.ndarray): Actual 2D image data
+
+        labelled_data (numpy.ndarray): map of the islands, as returned by
+            ndimage.label()
+
+        labels (sequence): labels of the islands to measure
+
+        origins (numpy.ndarray): for each island, the corner of the chunk
+            it is measured in; its positions are measured from there
+
+        beam (3-tuple): beam (psf) information
+
+    Returns:
+
+        (tuple): a record array of MOMENTS_DTYPE, and an array of the
+            position of the highest pixel of each island, relative to its
+            origin
+    """
+    labels = numpy.asarray(labels, dtype=numpy.intp)
+    origins = numpy.asarray(origins, dtype=numpy.intp).reshape(-1, 2)
+    result = numpy.zeros(len(labels), dtype=MOMENTS_DTYPE)
+    if not len(labels):
+        return result, numpy.zeros((0, 2), dtype=numpy.intp)
+
+    # Number the islands in the order of labels; pixels with other labels
+    # are left out.
+    index = numpy.zeros(labelled_data.max() + 1, dtype=numpy.intp)
+    index.fill(-1)
+    index[labels] = numpy.arange(len(labels))
+    x, y = numpy.nonzero(labelled_data)
+    island = index[labelled_data[x, y]]
+    selected = island >= 0
+    x, y, island = x[selected], y[selected], island[selected]
+    values = numpy.asarray(data[x, y], dtype=numpy.float64)
+    x = x - origins[island, 0]
+    y = y - origins[island, 1]
+
+    def total(weights):
+        return numpy.bincount(island, weights=weights, minlength=len(labels))
+
+    # Sort the pixels by island, and from brightest to faintest within each
+    # island, keeping the first of equally bright pixels first as
+    # ndimage.maximum_position() does.
+    counts = numpy.bincount(island, minlength=len(labels))
+    order = numpy.lexsort((-values, island))
+    first = numpy.cumsum(counts) - counts
+    brightest = order[first]
+    faintest = order[first + counts - 1]
+
+    flux = total(values)
+    result['peak'] = numpy.where(
+        flux / counts >= 0,
+        values[brightest] * utils.fudge_max_pix(beam[0], beam[1], beam[2]),
+        values[faintest])
+    result['flux'] = flux
+    result['xbar'] = xbar = total(x * values) / flux
+    result['ybar'] = ybar = total(y * values) / flux
+    result['xxbar'] = total(x * x * values) / flux - xbar**2
+    result['yybar'] = total(y * y * values) / flux - ybar**2
+    result['xybar'] = total(x * y * values) / flux - xbar * ybar
+    result['nonzero'] = total(values != 0)
+    return result, numpy.column_stack((x[brightest], y[brightest]))
+
+
+def moments_to_shape(raw, beam, threshold=0):
+    """The shape of an island, estimated from its raw moments
+
+    Args:
+
+        raw (dict or numpy.void): as returned by raw_moments(), or a record
+            of labelled_moments()
+
+        beam (3-tuple): beam (psf) information
+
+        threshold (float): threshold used to select the pixels of the
+            island
+
+    Returns:
+
+        (dict): see moments()
+
+    Raises:
+
+        ValueError (in case of NaN in input)
+    """
+    peak = raw["peak"]
+    total = raw["flux"]
+    xbar = float(raw["xbar"])
+    ybar = float(raw["ybar"])
+    xxbar = raw["xxbar"]
+    yybar = raw["yybar"]
+    xybar = raw["xybar"]
+    ratio = threshold / peak
 
     working1 = (xxbar + yybar) / 2.0
     working2 = math.sqrt(((xxbar - yybar)/2)**2 + xybar**2)
@@ -57,7 +192,7 @@ def moments(data, beam, threshold=0):
     # equal, this happens with islands that have a thickness of only one pixel
     # in at least one dimension.  Due to rounding errors this difference
     # becomes negative--->math domain error in sqrt.
-    if len(data.nonzero()[0]) == 1:
+    if raw["nonzero"] == 1:
         # This is the case when the island (or more likely subisland) has
         # a size of only one pixel.
         semiminor = numpy.sqrt(beamsize/numpy.pi)
@@ -155,44 +290,86 @@ def fitgaussian(pixels, params, fixed=None, maxfev=0):
             else:
                 initial.append(params[param])
 
+    # Only the unmasked pixels take part in the fit; the masked values
+    # (=below threshold) at the edges and corners of the (rectangular)
+    # pixels array must not be taken into account. We work out their
+    # coordinates once, rather than on every evaluation of the model.
+    x, y = numpy.nonzero(~numpy.ma.getmaskarray(pixels))
+    x, y = x.astype(numpy.float64), y.astype(numpy.float64)
+    pixel_values = numpy.ma.getdata(pixels)[~numpy.ma.getmaskarray(pixels)]
+
+    def gaussian_args(paramlist):
+        """Merge the fitted parameters with the fixed ones"""
+        paramlist = list(numpy.atleast_1d(paramlist))
+        args = []
+        for param in FIT_PARAMS:
+            if param in fixed:
+                args.append(fixed[param])
+            else:
+                args.append(paramlist.pop(0))
+        return args
+
     def residuals(paramlist):
         """Error function to be used in chi-squared fitting
 
         :argument paramlist: fitting parameters
         :type paramlist: numpy.ndarray
-        :argument fixed: parameters to be held frozen
-        :type fixed: dict
 
-        :returns: 2d-array of difference between estimated Gaussian function
-            and the actual pixels
+        :returns: 1d-array of difference between estimated Gaussian function
+            and the actual unmasked pixels
         """
-        paramlist = list(paramlist)
-        gaussian_args = []
-        for param in FIT_PARAMS:
-            if param in fixed:
-                gaussian_args.append(fixed[param])
-            else:
-                gaussian_args.append(paramlist.pop(0))
-
         # gaussian() returns a function which takes arguments x, y and returns
         # a Gaussian with parameters gaussian_args evaluated at that point.
-        g = gaussian(*gaussian_args)
-
-        # The .compressed() below is essential so the Gaussian fit will not
-        # take account of the masked values (=below threshold) at the edges
-        # and corners of pixels (=(masked) array, so rectangular in shape).
-        pixel_resids = numpy.ma.MaskedArray(
-            data = numpy.fromfunction(g, pixels.shape) - pixels,
-            mask = pixels.mask)
-        return pixel_resids.compressed()
-
-    # maxfev=0, the default, corresponds to 200*(N+1) (NB, not 100*(N+1) as
-    # the scipy docs state!) function evaluations, where N is the number of
-    # parameters in the solution.
+        g = gaussian(*gaussian_args(paramlist))
+        return g(x, y) - pixel_values
+
+    def jacobian(paramlist):
+        """Analytic derivatives of residuals() w.r.t. the fitted parameters
+
+        :argument paramlist: fitting parameters
+        :type paramlist: numpy.ndarray
+
+        :returns: 2d-array with one row of derivatives at the unmasked
+            pixels for each parameter which isn't fixed
+        """
+        height, center_x, center_y, semimajor, semiminor, theta = (
+            gaussian_args(paramlist))
+        cos_theta, sin_theta = math.cos(theta), math.sin(theta)
+        dx, dy = x - center_x, y - center_y
+        # u runs along the minor axis, v along the major axis.
+        u = cos_theta * dx + sin_theta * dy
+        v = cos_theta * dy - sin_theta * dx
+        u_scaled, v_scaled = u / semiminor, v / semimajor
+        exponential = numpy.exp(
+            -math.log(2.0) * (u_scaled**2.0 + v_scaled**2.0))
+        g = height * exponential
+        # The Gaussian is height * exp(-log(2) * q); twice_log2_g * (dq/2)
+        # gives minus the derivative with respect to a parameter.
+        twice_log2_g = 2.0 * math.log(2.0) * g
+        u_semiminor = u_scaled / semiminor
+        v_semimajor = v_scaled / semimajor
+        derivatives = {
+            'peak': exponential,
+            'xbar': twice_log2_g * (cos_theta * u_semiminor -
+                                    sin_theta * v_semimajor),
+            'ybar': twice_log2_g * (sin_theta * u_semiminor +
+                                    cos_theta * v_semimajor),
+            'semimajor': twice_log2_g * v_scaled**2.0 / semimajor,
+            'semiminor': twice_log2_g * u_scaled**2.0 / semiminor,
+            'theta': twice_log2_g * u * v * (1.0 / semimajor**2.0 -
+                                             1.0 / semiminor**2.0)
+        }
+        return numpy.array([derivatives[param] for param in FIT_PARAMS
+                            if param not in fixed])
+
+    # Since we supply the Jacobian, maxfev=0, the default, corresponds to
+    # 100*(N+1) function evaluations, where N is the number of parameters in
+    # the solution. Evaluations of the Jacobian don't count towards that.
     # Convergence tolerances xtol and ftol established by experiment on images
     # from Paul Hancock's simulations.
     soln, success = scipy.optimize.leastsq(
-        residuals, initial, maxfev=maxfev, xtol=1e-4, ftol=1e-4
+        residuals, initial, Dfun=jacobian, col_deriv=True, maxfev=maxfev,
+        xtol=1e-4, ftol=1e-4
     )
 
     if success > 4:
@@ -5,12 +5,18 @@ calculating (specific) variances
 
 import logging
 import itertools
+import functools
+import collections
+import multiprocessing
 import numpy
 from tkp.utility import containers
 from tkp.utility.memoize import Memoize
+from tkp.utility import profiling
 from tkp.sourcefinder import utils
 from tkp.sourcefinder import stats
 from tkp.sourcefinder import extract
+from tkp.sourcefinder import fitting
+from tkp.sourcefinder.gaussian import gaussian
 try:
     import ndimage
 except ImportError:
@@ -29,8 +35,11 @@ MEDIAN_FILTER = 0       # If non-zero, apply a median filter of size
 MF_THRESHOLD = 0        # If MEDIAN_FILTER is non-zero, only use the filtered
                         # grid when the (absolute) difference between the raw
                         # and filtered grids is larger than MF_THRESHOLD.
+MASK_CACHE_SIZE = 4     # Number of margin/radius masks to keep for reuse.
 DEBLEND_MINCONT = 0.005 # Min. fraction of island flux in deblended subisland
 STRUCTURING_ELEMENT = [[0,1,0], [1,1,1], [0,1,0]] # Island connectiivty
+FORCED_FIT_BATCH = 2**20 # Number of pixels of the boxes fitted together by
+                         # fit_fixed_positions()
 
 class ImageData(object):
     """Encapsulates an image in terms of a numpy array + meta/headerdata.
@@ -40,7 +49,8 @@ class ImageData(object):
     """
 
     def __init__(self, data, beam, wcs, margin=0, radius=0, back_size_x=32,
-                 back_size_y=32, residuals=True
+                 back_size_y=32, residuals=True, float32=False, map_cache=None,
+                 profile=None
     ):
         """Sets up an ImageData object.
 
@@ -51,6 +61,17 @@ class ImageData(object):
           - beam (3-tuple): beam shape specification as
             (semimajor, semiminor, theta)
 
+        *Kwargs:*
+          - float32 (bool): hold the data, and the maps derived from it, in
+            single precision. This halves their memory use; islands are
+            still measured in double precision.
+          - map_cache (mapcache.MapCacheEntry): cache entry for this image.
+            If given, the background and RMS grids and maps are loaded from
+            the cache when available, and stored there when calculated.
+          - profile (utility.profiling.Profile): if given, the time and
+            memory taken by each stage of source extraction are recorded
+            in it.
+
         """
 
         # Do data, wcs and beam need deepcopy?
@@ -70,6 +91,9 @@ class ImageData(object):
         self.margin = margin
         self.radius = radius
         self.residuals = residuals
+        self.dtype = numpy.float32 if float32 else numpy.float64
+        self.map_cache = map_cache
+        self.profile = profile
 
 
     ###########################################################################
@@ -89,14 +113,15 @@ class ImageData(object):
     @Memoize
     def _grids(self):
         """Gridded RMS and background data for interpolating"""
-        return self.__grids()
+        return self._cached('grids', self.__grids)
     grids = property(fget=_grids, fdel=_grids.delete)
 
     @Memoize
     def _backmap(self):
         """Background map"""
         if not hasattr(self, "_user_backmap"):
-            return self._interpolate(self.grids['bg'])
+            return self._cached('backmap', lambda: {
+                'bg': self._interpolate(self.grids['bg'])})['bg']
         else:
             return self._user_backmap
 
@@ -111,39 +136,56 @@ class ImageData(object):
     def _get_rm(self):
         """RMS map"""
         if not hasattr(self, "_user_noisemap"):
-            return self._interpolate(self.grids['rms'], roundup=True)
+            return self._cached('rmsmap', lambda: {
+                'rms': self._interpolate(self.grids['rms'], roundup=True)
+            })['rms']
         else:
             return self._user_noisemap
 
     def _set_rm(self, noisemap):
         self._user_noisemap = noisemap
         del(self.rmsmap)
+        del(self.rms_median)
 
     rmsmap = property(fget=_get_rm, fdel=_get_rm.delete, fset=_set_rm)
 
+    @Memoize
+    def _rms_median(self):
+        """Median of the RMS map"""
+        return numpy.ma.median(self.rmsmap)
+    rms_median = property(fget=_rms_median, fdel=_rms_median.delete)
+
     @Memoize
     def _get_data(self):
         """Masked image data"""
         # We will ignore all the data which is masked for the rest of the
-        # sourcefinding process. We build up the mask by stacking ("or-ing
-        # together") a number of different effects:
+        # sourcefinding process. We build up a boolean mask in place by
+        # stacking ("or-ing together") a number of different effects:
         #
+        # * Data which is "obviously" bad (equal to 0 or NaN);
         # * A margin from the edge of the image;
-        # * Any data outside a given radius from the centre of the image;
-        # * Data which is "obviously" bad (equal to 0 or NaN).
-        mask = numpy.zeros((self.xdim, self.ydim))
-        if self.margin:
-            margin_mask = numpy.ones((self.xdim, self.ydim))
-            margin_mask[self.margin:-self.margin, self.margin:-self.margin] = 0
-            mask = numpy.logical_or(mask, margin_mask)
-        if self.radius:
-            radius_mask = utils.circular_mask(self.xdim, self.ydim, self.radius)
-            mask = numpy.logical_or(mask, radius_mask)
-        mask = numpy.logical_or(mask, numpy.where(self.rawdata == 0, 1, 0))
-        mask = numpy.logical_or(mask, numpy.isnan(self.rawdata))
+        # * Any data outside a given radius from the centre of the image.
+        mask = self.rawdata == 0
+        mask |= numpy.isnan(self.rawdata)
+        geometry = geometric_mask(self.rawdata.shape, self.margin, self.radius)
+        if geometry is not None:
+            mask |= geometry
+        if self.dtype == numpy.float32:
+            return numpy.ma.array(self.rawdata, mask=mask, dtype=self.dtype)
         return numpy.ma.array(self.rawdata, mask=mask)
     data = property(fget=_get_data, fdel=_get_data.delete)
 
+    @Memoize
+    def _useful_chunk(self):
+        """Bounding box of the unmasked data, or None if it's all masked"""
+        mask = numpy.ma.getmaskarray(self.data)
+        x = numpy.flatnonzero(~mask.all(axis=1))
+        y = numpy.flatnonzero(~mask.all(axis=0))
+        if not len(x):
+            return None
+        return (slice(x[0], x[-1] + 1), slice(y[0], y[-1] + 1))
+    useful_chunk = property(fget=_useful_chunk, fdel=_useful_chunk.delete)
+
     @Memoize
     def _get_data_bgsubbed(self):
         """Background subtracted masked image data"""
@@ -183,7 +225,9 @@ class ImageData(object):
         self.clip.clear()
         del(self.backmap)
         del(self.rmsmap)
+        del(self.rms_median)
         del(self.data)
+        del(self.useful_chunk)
         del(self.data_bgsubbed)
         del(self.grids)
         if hasattr(self, 'residuals_from_gauss_fitting'):
@@ -202,6 +246,36 @@ class ImageData(object):
     ###########################################################################
 
     # Private "support" methods
+    def _cached(self, name, calculate):
+        """
+        Load a set of maps from the map cache, or calculate them.
+
+        Args:
+
+            name (str): name of the maps in the cache.
+
+            calculate (function): returns the maps, as a dict of masked
+                arrays, for storing in the cache.
+
+        Returns:
+
+            (dict)
+        """
+        if self.map_cache is None:
+            return calculate()
+        # Everything the maps depend on, besides the image itself.
+        parameters = (
+            self.margin, self.radius, self.back_size_x, self.back_size_y,
+            tuple(self.beam), numpy.dtype(self.dtype).name, INTERPOLATE_ORDER, MEDIAN_FILTER,
+            MF_THRESHOLD
+        )
+        maps = self.map_cache.load(name, parameters)
+        if maps is None:
+            maps = calculate()
+            self.map_cache.save(name, parameters, maps)
+        return maps
+
+    @profiling.profiled('grids')
     def __grids(self):
         """Calculate background and RMS grids of this image.
 
@@ -214,57 +288,21 @@ class ImageData(object):
 
         # there's no point in working with the whole of the data array
         # if it's masked.
-        useful_chunk = ndimage.find_objects(numpy.where(self.data.mask, 0, 1))
-        assert(len(useful_chunk) == 1)
-        useful_data = self.data[useful_chunk[0]]
-        my_xdim, my_ydim = useful_data.shape
-
-        rmsgrid, bggrid = [], []
-        for startx in xrange(0, my_xdim, self.back_size_x):
-            rmsrow, bgrow = [], []
-            for starty in xrange(0, my_ydim, self.back_size_y):
-                chunk = useful_data[
-                    startx:startx + self.back_size_x,
-                    starty:starty + self.back_size_y
-                ].ravel()
-                if not chunk.any():
-                    rmsrow.append(False)
-                    bgrow.append(False)
-                    continue
-                chunk, sigma, median, num_clip_its = stats.sigma_clip(
-                    chunk, self.beam)
-                if len(chunk) == 0 or not chunk.any():
-                    rmsrow.append(False)
-                    bgrow.append(False)
-                else:
-                    mean = numpy.mean(chunk)
-                    rmsrow.append(sigma)
-                    # In the case of a crowded field, the distribution will be
-                    # skewed and we take the median as the background level.
-                    # Otherwise, we take 2.5 * median - 1.5 * mean. This is the
-                    # same as SExtractor: see discussion at
-                    # <http://terapix.iap.fr/forum/showthread.php?tid=267>.
-                    # (mean - median) / sigma is a quick n' dirty skewness
-                    # estimator devised by Karl Pearson.
-                    if numpy.fabs(mean - median) / sigma >= 0.3:
-                        logger.debug(
-                            'bg skewed, %f clipping iterations', num_clip_its)
-                        bgrow.append(median)
-                    else:
-                        logger.debug(
-                            'bg not skewed, %f clipping iterations', num_clip_its)
-                        bgrow.append(2.5 * median - 1.5 * mean)
-
-            rmsgrid.append(rmsrow)
-            bggrid.append(bgrow)
-
-        rmsgrid = numpy.ma.array(
-            rmsgrid, mask=numpy.where(numpy.array(rmsgrid) == False, 1, 0))
-        bggrid = numpy.ma.array(
-            bggrid, mask=numpy.where(numpy.array(bggrid) == False, 1, 0))
+        assert(self.useful_chunk is not None)
+        useful_data = self.data[self.useful_chunk]
+
+        rmsgrid, bggrid = background_grids(
+            useful_data, self.beam, self.back_size_x, self.back_size_y,
+            dtype=self.dtype)
+
+        # Grid points with a value of exactly zero carry no information, and
+        # are masked along with the unusable boxes.
+        rmsgrid = numpy.ma.array(rmsgrid, mask=(rmsgrid == 0))
+        bggrid = numpy.ma.array(bggrid, mask=(bggrid == 0))
 
         return {'rms': rmsgrid, 'bg': bggrid}
 
+    @profiling.profiled('interpolate')
     def _interpolate(self, grid, roundup=False):
         """
         Interpolate a grid to produce a map of the dimensions of the image.
@@ -289,50 +327,19 @@ class ImageData(object):
         """
         # there's no point in working with the whole of the data array if it's
         # masked.
-        useful_chunk = ndimage.find_objects(numpy.where(self.data.mask, 0, 1))
-        assert(len(useful_chunk) == 1)
-        my_xdim, my_ydim = self.data[useful_chunk[0]].shape
-
-        if MEDIAN_FILTER:
-            f_grid = ndimage.median_filter(grid, MEDIAN_FILTER)
-            if MF_THRESHOLD:
-                grid = numpy.where(
-                    numpy.fabs(f_grid - grid) > MF_THRESHOLD, f_grid, grid
-                )
-            else:
-                grid = f_grid
-
-        # Bicubic spline interpolation
-        xratio = float(my_xdim)/self.back_size_x
-        yratio = float(my_ydim)/self.back_size_y
-        # First arg: starting point. Second arg: ending point. Third arg:
-        # 1j * number of points. (Why is this complex? Sometimes, NumPy has an
-        # utterly baffling API...)
-        slicex = slice(-0.5, -0.5+xratio, 1j*my_xdim)
-        slicey = slice(-0.5, -0.5+yratio, 1j*my_ydim)
-        my_map = numpy.ma.MaskedArray(numpy.zeros(self.data.shape),
-                                      mask = self.data.mask)
-        my_map[useful_chunk[0]] = ndimage.map_coordinates(
-            grid, numpy.mgrid[slicex, slicey],
-            mode='nearest', order=INTERPOLATE_ORDER)
-
-        # If the input grid was entirely masked, then the output map must
-        # also be masked: there's no useful data here. We don't search for
-        # sources on a masked background/RMS, so this data will be cleanly
-        # skipped by the rest of the sourcefinder
-        if numpy.ma.getmask(grid).all():
-            my_map.mask = True
-        elif roundup:
-            # In some cases, the spline interpolation may produce values
-            # lower than the minimum value in the map. If required, these
-            # can be trimmed off. No point doing this if the map is already
-            # fully masked, though.
-            my_map = numpy.ma.MaskedArray(
-                    data = numpy.where(
-                        my_map >= numpy.min(grid), my_map, numpy.min(grid)),
-                    mask = my_map.mask
-            )
-        return my_map
+        useful_chunk = self.useful_chunk
+        assert(useful_chunk is not None)
+        my_xdim, my_ydim = [s.stop - s.start for s in useful_chunk]
+
+        # The map gets a copy of the mask: filling it in below unmasks it,
+        # and that mustn't unmask the data.
+        my_map = numpy.ma.MaskedArray(
+            numpy.zeros(self.data.shape, dtype=self.dtype),
+            mask = self.data.mask.copy())
+        my_map[useful_chunk] = interpolate_grid(
+            grid, (my_xdim, my_ydim), self.back_size_x, self.back_size_y,
+            dtype=self.dtype)
+        return finalise_map(my_map, grid, roundup)
 
     ###########################################################################
     #                                                                         #
@@ -344,7 +351,8 @@ class ImageData(object):
     ###########################################################################
 
     def extract(self, det, anl, noisemap=None, bgmap=None, labelled_data=None,
-                labels=None, deblend_nthresh=0, force_beam=False):
+                labels=None, deblend_nthresh=0, force_beam=False,
+                nr_processes=1):
 
         """
         Kick off conventional (ie, RMS island finding) source extraction.
@@ -369,6 +377,9 @@ class ImageData(object):
             force_beam (bool): force all extractions to have major/minor axes
                 equal to the restoring beam
 
+            nr_processes (int): number of processes to use for fitting the
+                islands in parallel. The default, 1, fits them serially.
+
         Returns:
 
              (..utility.containers.ExtractionResults):
@@ -399,7 +410,8 @@ class ImageData(object):
 
         return self._pyse(
             det * self.rmsmap, anl * self.rmsmap, deblend_nthresh, force_beam,
-            labelled_data=labelled_data, labels=labels
+            labelled_data=labelled_data, labels=labels,
+            nr_processes=nr_processes
         )
 
     def reverse_se(self, det):
@@ -423,7 +435,8 @@ class ImageData(object):
         return results
 
     def fd_extract(self, alpha, anl=None, noisemap=None,
-                   bgmap=None, deblend_nthresh=0, force_beam=False
+                   bgmap=None, deblend_nthresh=0, force_beam=False,
+                   nr_processes=1
     ):
         """False Detection Rate based source extraction.
         The FDR procedure guarantees that <FDR> < alpha.
@@ -464,19 +477,15 @@ class ImageData(object):
         normalized_data = self.data_bgsubbed/self.rmsmap
 
         n1 = numpy.sqrt(2 * numpy.pi)
-        prob = numpy.sort(numpy.ravel(numpy.exp(-0.5 * normalized_data**2)/n1))
-        lengthprob = float(len(prob))
-        compare = (alpha / C_n) * numpy.arange(lengthprob+1)[1:] / lengthprob
+        prob = numpy.exp(-0.5 * numpy.ma.compressed(normalized_data)**2)/n1
         # Find the last undercrossing, see, e.g., fig. 9 in Miller et al., AJ
-        # 122, 3492 (2001).  Searchsorted is not used because the array is not
-        # sorted.
-        try:
-            index = (numpy.where(prob-compare < 0.)[0]).max()
-        except ValueError:
+        # 122, 3492 (2001).
+        cutoff = stats.fdr_cutoff(prob, normalized_data.size, alpha / C_n)
+        if cutoff is None:
             # Everything below threshold
             return containers.ExtractionResults()
 
-        fdr_threshold = numpy.sqrt(-2.0 * numpy.log(n1 * prob[index]))
+        fdr_threshold = numpy.sqrt(-2.0 * numpy.log(n1 * cutoff))
         # Default we require that all source pixels are above the threshold,
         # not only the peak pixel.  This gives a better guarantee that indeed
         # the fraction of false positives is less than fdr_alpha in config.py.
@@ -484,7 +493,8 @@ class ImageData(object):
         if not anl:
             anl = fdr_threshold
         return self._pyse(fdr_threshold * self.rmsmap, anl * self.rmsmap,
-                          deblend_nthresh, force_beam)
+                          deblend_nthresh, force_beam,
+                          nr_processes=nr_processes)
 
     def flux_at_pixel(self, x, y, numpix=1):
         """Return the background-subtracted flux at a certain position
@@ -501,6 +511,7 @@ class ImageData(object):
         Returns a slice centred about (x,y), of width = 2*int(box_radius) + 1
         """
         ibr = int(box_radius)
+        x, y = int(x), int(y)
         return (slice(x - ibr, x + ibr + 1),
                 slice(y - ibr, y + ibr + 1))
 
@@ -515,13 +526,15 @@ class ImageData(object):
 
         Returns an instance of :class:`tkp.sourcefinder.extract.Detection`.
         """
+        # The fit is made around the pixel which contains (x, y).
+        pixel = int(x), int(y)
         if ((
                 # Recent NumPy
                 hasattr(numpy.ma.core, "MaskedConstant") and
                 isinstance(self.rmsmap, numpy.ma.core.MaskedConstant)
             ) or (
                 # Old NumPy
-                numpy.ma.is_masked(self.rmsmap[x, y])
+                numpy.ma.is_masked(self.rmsmap[pixel])
         )):
             logger.error("Background is masked: cannot fit")
             return None
@@ -529,20 +542,9 @@ class ImageData(object):
         chunk = ImageData.box_slice_about_pixel(x, y, boxsize/2.0)
         if threshold is not None:
             # We'll mask out anything below threshold*self.rmsmap from the fit.
-            labels, num = self.labels.setdefault( #Dictionary mapping threshold -> islands map
-                threshold,
-                ndimage.label(
-                    self.clip.setdefault( #Dictionary mapping threshold -> mask
-                        threshold,
-                        numpy.where(
-                            self.data_bgsubbed > threshold * self.rmsmap, 1, 0
-                            )
-                        )
-                    )
-                )
+            labels, num = self._threshold_labels(threshold)
 
-
-            mylabel = labels[x, y]
+            mylabel = labels[pixel]
             if mylabel == 0:  # 'Background'
                 raise ValueError("Fit region is below specified threshold, fit aborted.")
             mask = numpy.where(labels[chunk] == mylabel, 0, 1)
@@ -572,7 +574,7 @@ class ImageData(object):
             raise TypeError("Unkown fixed parameter")
 
         if threshold is not None:
-            threshold_at_pixel = threshold * self.rmsmap[x, y]
+            threshold_at_pixel = threshold * self.rmsmap[pixel]
         else:
             threshold_at_pixel = None
 
@@ -580,7 +582,7 @@ class ImageData(object):
             measurement, residuals = extract.source_profile_and_errors(
                 fitme,
                 threshold_at_pixel,
-                self.rmsmap[x, y],
+                self.rmsmap[pixel],
                 self.beam,
                 fixed=fixed
             )
@@ -636,44 +638,248 @@ class ImageData(object):
         if ids is not None:
             assert len(ids)==len(positions)
 
+        if fixed == 'position+shape':
+            # Only the peaks are fitted, which can be done for all the
+            # positions at once.
+            all_fit_results = self._fit_fixed_shapes(positions, boxsize,
+                                                     threshold)
+        else:
+            all_fit_results = (
+                self._fit_fixed_position(posn, boxsize, threshold, fixed)
+                for posn in positions)
+
         successful_fits = []
         successful_ids = []
-        for idx, posn in enumerate(positions):
-            try:
-                x, y, = self.wcs.s2p((posn[0], posn[1]))
-            except RuntimeError, e:
-                if (str(e).startswith("wcsp2s error: 8:") or
-                    str(e).startswith("wcsp2s error: 9:")):
-                    logger.warning("Input coordinates (%.2f, %.2f) invalid: ",
-                                    posn[0], posn[1])
-                else:
-                    raise
+        for idx, fit_results in enumerate(all_fit_results):
+            if not fit_results:
+                # We were unable to get a good fit
+                continue
+            if ( fit_results.ra.error == float('inf') or
+                  fit_results.dec.error == float('inf')):
+                logging.warning("position errors extend outside image")
             else:
-                try:
-                    fit_results = self.fit_to_point(x, y,
-                                                boxsize=boxsize,
-                                                threshold=threshold,
-                                                fixed=fixed)
-                    if not fit_results:
-                        # We were unable to get a good fit
-                        continue
-                    if ( fit_results.ra.error == float('inf') or
-                          fit_results.dec.error == float('inf')):
-                        logging.warning("position errors extend outside image")
-                    else:
-                        successful_fits.append(fit_results)
-                        if ids:
-                            successful_ids.append(ids[idx])
-
-                except IndexError as e:
-                    logger.warning("Input pixel coordinates (%.2f, %.2f) "
-                                    "could not be fit because: " + e.message,
-                                    posn[0], posn[1])
+                successful_fits.append(fit_results)
+                if ids:
+                    successful_ids.append(ids[idx])
         if ids:
             return successful_fits, successful_ids
         return successful_fits
 
-    def label_islands(self, detectionthresholdmap, analysisthresholdmap):
+    def _fit_fixed_position(self, posn, boxsize, threshold, fixed):
+        """
+        Fit a source at the given position with fit_to_point().
+
+        Returns the Detection, or None if the position can't be fitted.
+        """
+        try:
+            x, y, = self.wcs.s2p((posn[0], posn[1]))
+        except RuntimeError, e:
+            if (str(e).startswith("wcsp2s error: 8:") or
+                str(e).startswith("wcsp2s error: 9:")):
+                logger.warning("Input coordinates (%.2f, %.2f) invalid: ",
+                                posn[0], posn[1])
+                return None
+            else:
+                raise
+        try:
+            return self.fit_to_point(x, y, boxsize=boxsize,
+                                     threshold=threshold, fixed=fixed)
+        except IndexError as e:
+            logger.warning("Input pixel coordinates (%.2f, %.2f) "
+                            "could not be fit because: " + e.message,
+                            posn[0], posn[1])
+            return None
+
+    def _fit_fixed_shapes(self, positions, boxsize, threshold):
+        """
+        Fit sources of the shape of the beam at the given positions.
+
+        With both the position and the shape fixed, the model is linear in
+        its only free parameter, the peak, so the least-squares fit has a
+        closed form: the sum of the data weighted by the beam, divided by
+        the sum of the squared beam, over the pixels used in the fit. This
+        is worked out for many positions at once, in place of a call of
+        fit_to_point(x, y, boxsize, threshold, 'position+shape') for each
+        of them, which gives the same results.
+
+        Returns:
+
+            (list): for each position, the Detection, or None if it
+            can't be fitted.
+        """
+        results = [None] * len(positions)
+        if not len(positions):
+            return results
+        if isinstance(self.rmsmap, numpy.ma.core.MaskedConstant):
+            logger.error("Background is masked: cannot fit")
+            return results
+
+        # The beam, centred in the box, as in fit_to_point().
+        ibr = int(boxsize/2.0)
+        size = 2 * ibr + 1
+        semimajor, semiminor, theta = self.beam
+        stamp = gaussian(1.0, boxsize/2.0, boxsize/2.0, semimajor, semiminor,
+                         theta)(*numpy.indices((size, size)))
+        if semiminor > semimajor:
+            semimajor, semiminor, theta = semiminor, semimajor, theta + numpy.pi/2
+        semimajor, semiminor = abs(semimajor), abs(semiminor)
+        beamsize = utils.calculate_beamsize(self.beam[0], self.beam[1])
+
+        positions = numpy.asarray(positions, dtype=numpy.float64)
+        pixels = self.wcs.all_s2p(positions[:, :2])
+        usable = []
+        for index in xrange(len(positions)):
+            if numpy.isnan(pixels[index]).any():
+                logger.warning("Input coordinates (%.2f, %.2f) invalid: ",
+                               positions[index, 0], positions[index, 1])
+            else:
+                usable.append(index)
+
+        detections = []
+        batch = max(1, FORCED_FIT_BATCH // size**2)
+        for start in xrange(0, len(usable), batch):
+            indices = usable[start:start + batch]
+            detections.extend(self._fit_fixed_shape_batch(
+                indices, positions[indices], pixels[indices], boxsize, size,
+                threshold, stamp, (semimajor, semiminor, theta), beamsize,
+                results))
+        extract.physical_coordinates(detections)
+        return results
+
+    def _fit_fixed_shape_batch(self, indices, positions, pixels, boxsize,
+                               size, threshold, stamp, shape, beamsize,
+                               results):
+        """
+        Fit the peaks of a batch of positions for _fit_fixed_shapes().
+
+        The Detections are stored in results, by index, and returned.
+        """
+        xdim, ydim = self.data.shape
+        ibr = size // 2
+        x, y = pixels[:, 0], pixels[:, 1]
+        pixel_x = x.astype(numpy.intp)
+        pixel_y = y.astype(numpy.intp)
+
+        # Positions outside the image can't be fitted, nor can those whose
+        # boxes start beyond the edge of the image; boxes which end beyond
+        # the edge are cut short.
+        in_image = ((pixel_x >= 0) & (pixel_x < xdim) &
+                    (pixel_y >= 0) & (pixel_y < ydim))
+        pixel_x, pixel_y = pixel_x.clip(0, xdim - 1), pixel_y.clip(0, ydim - 1)
+        rms_masked = numpy.ma.getmaskarray(self.rmsmap)[pixel_x, pixel_y]
+        for index in numpy.flatnonzero(in_image & rms_masked):
+            logger.error("Background is masked at %f, %f: cannot fit",
+                         x[index], y[index])
+        candidates = in_image & ~rms_masked
+
+        offsets = numpy.arange(size)
+        rows = (pixel_x - ibr)[:, None] + offsets
+        cols = (pixel_y - ibr)[:, None] + offsets
+        outside = (rows >= xdim)[:, :, None] | (cols >= ydim)[:, None, :]
+        rows, cols = rows.clip(0, xdim - 1), cols.clip(0, ydim - 1)
+        rows, cols = rows[:, :, None], cols[:, None, :]
+        data = numpy.ma.getdata(self.data_bgsubbed)[rows, cols]
+        masked = outside | numpy.ma.getmaskarray(self.data_bgsubbed)[rows, cols]
+
+        if threshold is not None:
+            # We'll mask out anything below threshold*self.rmsmap from the fit.
+            labels, num = self._threshold_labels(threshold)
+            mylabel = labels[pixel_x, pixel_y]
+            if (candidates & (mylabel == 0)).any():
+                raise ValueError(
+                    "Fit region is below specified threshold, fit aborted.")
+            masked |= labels[rows, cols] != mylabel[:, None, None]
+
+        in_box = in_image & (pixel_x - ibr >= 0) & (pixel_y - ibr >= 0)
+        used = ~masked
+        npix = used.sum(axis=(1, 2))
+        for index in numpy.flatnonzero(
+                ~in_image | (candidates & ~(in_box & (npix > 0)))):
+            if threshold is None and in_box[index]:
+                logger.error("All data is masked: cannot fit")
+            else:
+                logger.warning("Input pixel coordinates (%.2f, %.2f) "
+                               "could not be fit because: Fit region too "
+                               "close to edge or too small",
+                               positions[index, 0], positions[index, 1])
+        candidates &= in_box & (npix > 0)
+
+        # Gaussian fitting needs the (nonzero) pixels to span more than two
+        # pixels in both directions.
+        nonzero = used & (data != 0)
+        extent = []
+        for axis in (2, 1):
+            spanned = nonzero.any(axis=axis)
+            extent.append(size - 1 - spanned[:, ::-1].argmax(axis=1) -
+                          spanned.argmax(axis=1))
+        fitted = (candidates & nonzero.any(axis=(1, 2)) &
+                  (extent[0] > 2) & (extent[1] > 2))
+        for index in numpy.flatnonzero(candidates & ~fitted):
+            logger.error("Gaussian fit failed at %f, %f", x[index], y[index])
+
+        data = numpy.where(used, data, 0).reshape(len(indices), -1)
+        used = used.reshape(len(indices), -1)
+        peaks = numpy.dot(data, stamp.ravel()) / numpy.maximum(
+            numpy.dot(used, (stamp**2).ravel()), numpy.finfo(float).tiny)
+        rms = numpy.ma.MaskedArray(
+            numpy.ma.getdata(self.rmsmap)[rows, cols],
+            mask=numpy.ma.getmaskarray(self.rmsmap)[rows, cols])
+        sigs = (numpy.ma.MaskedArray(data.reshape(rms.shape), mask=masked) /
+                rms).reshape(len(indices), -1).max(axis=1)
+
+        semimajor, semiminor, theta = shape
+        fitted = numpy.flatnonzero(fitted)
+        noise = numpy.ma.getdata(self.rmsmap)[pixel_x[fitted], pixel_y[fitted]]
+        measurements = []
+        for index in fitted:
+            measurement = extract.ParamSet()
+            measurement.update({
+                'peak': peaks[index],
+                'xbar': boxsize/2.0,
+                'ybar': boxsize/2.0,
+                'semimajor': semimajor,
+                'semiminor': semiminor,
+                'theta': theta
+            })
+            measurement.gaussian = True
+            measurement['flux'] = (numpy.pi * peaks[index] * semimajor *
+                                   semiminor / beamsize)
+            measurements.append(measurement)
+        if threshold is not None:
+            threshold = threshold * noise
+        extract.calculate_all_errors(measurements, noise, self.beam,
+                                     threshold)
+        extract.deconvolve_all(measurements, self.beam)
+
+        detections = []
+        for index, measurement in itertools.izip(fitted, measurements):
+            measurement['xbar'] += x[index] - boxsize/2.0
+            measurement['ybar'] += y[index] - boxsize/2.0
+            measurement.sig = sigs[index]
+            detection = extract.Detection(measurement, self,
+                                          convert_coordinates=False)
+            results[indices[index]] = detection
+            detections.append(detection)
+        return detections
+
+    def _threshold_labels(self, threshold):
+        """
+        The islands above threshold * rmsmap, as from ndimage.label().
+
+        These are calculated once for each threshold, and kept in
+        self.labels (and the mask they are made from in self.clip) until
+        clearcache() is called.
+        """
+        if threshold not in self.labels:
+            if threshold not in self.clip:
+                self.clip[threshold] = numpy.where(
+                    self.data_bgsubbed > threshold * self.rmsmap, 1, 0)
+            self.labels[threshold] = ndimage.label(self.clip[threshold])
+        return self.labels[threshold]
+
+    @profiling.profiled('label_islands')
+    def label_islands(self, detectionthresholdmap, analysisthresholdmap,
+                      rms_median=None):
         """
         Return a lablled array of pixels for fitting.
 
@@ -683,6 +889,13 @@ class ImageData(object):
 
             analysisthresholdmap (numpy.ndarray):
 
+        Kwargs:
+
+            rms_median (float): median of the RMS map, used to reject
+                regions without usable data (see below). Taken from this
+                image if not given; set it when this image is part of a
+                larger one.
+
         Returns:
 
             list of valid islands (list of int)
@@ -690,7 +903,7 @@ class ImageData(object):
             labelled islands (numpy.ndarray)
         """
         # If there is no usable data, we return an empty set of islands.
-        if not len(self.rmsmap.compressed()):
+        if not self.rmsmap.count():
             logging.warning("RMS map masked; sourcefinding skipped")
             return [], numpy.zeros(self.data_bgsubbed.shape, dtype=numpy.int)
 
@@ -709,55 +922,46 @@ class ImageData(object):
         # which contain no usable data; for example, the parts of the image
         # falling outside the circular region produced by awimager.
         RMS_FILTER = 0.001
+        if rms_median is None:
+            rms_median = self.rms_median
         clipped_data = numpy.ma.where(
             (self.data_bgsubbed > analysisthresholdmap) &
-            (self.rmsmap >= (RMS_FILTER * numpy.ma.median(self.rmsmap))),
+            (self.rmsmap >= (RMS_FILTER * rms_median)),
             1, 0
         ).filled(fill_value=0)
         labelled_data, num_labels = ndimage.label(clipped_data, STRUCTURING_ELEMENT)
 
-        labels_below_det_thr, labels_above_det_thr = [], []
+        labels_above_det_thr = []
         if num_labels > 0:
             # Select the labels of the islands above the analysis threshold
-            # that have maximum values values above the detection threshold.
+            # that have any pixel above the detection threshold.
             # Like above we make sure not to select anything where either
             # the data or the noise map are masked.
-            # We fill these pixels in above_det_thr with -1 to make sure
-            # its labels will not be in labels_above_det_thr.
             # NB data_bgsubbed, and hence above_det_thr, is a masked array;
-            # filled() sets all mased values equal to -1.
+            # filled() sets all masked values to -1, which is below the
+            # detection threshold.
             above_det_thr = (
                 self.data_bgsubbed - detectionthresholdmap
-            ).filled(fill_value=-1)
-            # Note that we avoid label 0 (the background).
-            maximum_values = ndimage.maximum(
-                above_det_thr, labelled_data, numpy.arange(1, num_labels + 1)
-            )
-
-            # If there's only one island, ndimage.maximum will return a float,
-            # rather than a list. The rest of this function assumes that it's
-            # always a list, so we need to convert it.
-            if isinstance(maximum_values, float):
-                maximum_values = [maximum_values]
-
-            # We'll filter out the insignificant islands
-            for i, x in enumerate(maximum_values, 1):
-                if x < 0:
-                    labels_below_det_thr.append(i)
-                else:
-                    labels_above_det_thr.append(i)
+            ).filled(fill_value=-1) >= 0
+
+            # A lookup table from the label of each island to the label it
+            # keeps: its own if it is significant, zero (the background)
+            # otherwise.
+            relabel = numpy.zeros(num_labels + 1, dtype=labelled_data.dtype)
+            significant = labelled_data[above_det_thr]
+            relabel[significant] = significant
+            relabel[0] = 0
+            labels_above_det_thr = numpy.flatnonzero(relabel).tolist()
             # Set to zero all labelled islands that are below det_thr:
-            labelled_data = numpy.where(
-                numpy.in1d(labelled_data.ravel(), labels_above_det_thr).reshape(labelled_data.shape),
-                labelled_data, 0
-            )
+            labelled_data = relabel[labelled_data]
 
         return labels_above_det_thr, labelled_data
 
 
     def _pyse(
         self, detectionthresholdmap, analysisthresholdmap,
-        deblend_nthresh, force_beam, labelled_data=None, labels=[]
+        deblend_nthresh, force_beam, labelled_data=None, labels=[],
+        nr_processes=1
     ):
         """
         Run Python-based source extraction on this image.
@@ -781,6 +985,9 @@ class ImageData(object):
             labels (list): list of labels in the island map to use for
             fitting.
 
+            nr_processes (int): number of processes used to fit the islands.
+            1 fits them all in this process.
+
         Returns:
 
             (..utility.containers.ExtractionResults):
@@ -788,6 +995,9 @@ class ImageData(object):
         This is described in detail in the "Source Extraction System" document
         by John Swinbank, available from TKP svn.
         """
+        # The time taken by each stage is recorded if profiling.
+        stage = functools.partial(profiling.stage, self.profile)
+
         # Map our chunks onto a list of islands.
         island_list = []
         if labelled_data is None:
@@ -795,88 +1005,161 @@ class ImageData(object):
                 detectionthresholdmap, analysisthresholdmap
             )
 
-        # Get a bounding box for each island:
-        # NB Slices ordered by label value (1...N,)
-        # 'None' returned for missing label indices.
-        slices = ndimage.find_objects(labelled_data)
-
-        for label in labels:
-            chunk = slices[label-1]
-            analysis_threshold = (analysisthresholdmap[chunk] /
-                                  self.rmsmap[chunk]).max()
-            # In selected_data only the pixels with the "correct"
-            # (see above) labels are retained. Other pixel values are
-            # set to -(bignum).
-            # In this way, disconnected pixels within (rectangular)
-            # slices around islands (particularly the large ones) do
-            # not affect the source measurements.
-            selected_data = numpy.ma.where(
-                labelled_data[chunk] == label,
-                self.data_bgsubbed[chunk].data, -extract.BIGNUM
-            ).filled(fill_value=-extract.BIGNUM)
-
-            island_list.append(
-                extract.Island(
-                    selected_data,
-                    self.rmsmap[chunk],
-                    chunk,
-                    analysis_threshold,
-                    detectionthresholdmap[chunk],
-                    self.beam,
-                    deblend_nthresh,
-                    DEBLEND_MINCONT,
-                    STRUCTURING_ELEMENT
-                )
+        with stage('measure', islands=len(labels)):
+            # Get a bounding box for each island:
+            # NB Slices ordered by label value (1...N,)
+            # 'None' returned for missing label indices.
+            slices = ndimage.find_objects(labelled_data)
+            chunks = [slices[label-1] for label in labels]
+
+            # Measure all the islands in a single pass over the image. Their
+            # moments are the initial estimates for fitting them, unless they
+            # are deblended.
+            all_moments, max_positions = fitting.labelled_moments(
+                self.data_bgsubbed.data, labelled_data, labels,
+                [(chunk[0].start, chunk[1].start) for chunk in chunks],
+                self.beam
             )
 
+            for label, chunk, moments, max_pos in itertools.izip(
+                    labels, chunks, all_moments, max_positions):
+                analysis_threshold = (analysisthresholdmap[chunk] /
+                                      self.rmsmap[chunk]).max()
+                # In selected_data only the pixels with the "correct"
+                # (see above) labels are retained. Other pixel values are
+                # set to -(bignum).
+                # In this way, disconnected pixels within (rectangular)
+                # slices around islands (particularly the large ones) do
+                # not affect the source measurements.
+                selected_data = numpy.ma.where(
+                    labelled_data[chunk] == label,
+                    self.data_bgsubbed[chunk].data, -extract.BIGNUM
+                ).filled(fill_value=-extract.BIGNUM)
+
+                island_list.append(
+                    extract.Island(
+                        selected_data,
+                        self.rmsmap[chunk],
+                        chunk,
+                        analysis_threshold,
+                        detectionthresholdmap[chunk],
+                        self.beam,
+                        deblend_nthresh,
+                        DEBLEND_MINCONT,
+                        STRUCTURING_ELEMENT,
+                        flux_orig=moments['flux'],
+                        max_pos=max_pos,
+                        moments=moments
+                    )
+                )
+
         # If required, we can save the 'left overs' from the deblending and
         # fitting processes for later analysis. This needs setting up here:
         if self.residuals:
-            self.residuals_from_gauss_fitting = numpy.zeros(self.data.shape)
-            self.residuals_from_deblending = numpy.zeros(self.data.shape)
+            self.residuals_from_gauss_fitting = numpy.zeros(
+                self.data.shape, dtype=self.dtype)
+            self.residuals_from_deblending = numpy.zeros(
+                self.data.shape, dtype=self.dtype)
             for island in island_list:
                 self.residuals_from_deblending[island.chunk] += (
                     island.data.filled(fill_value=0.))
 
-        # Deblend each of the islands to its consituent parts, if necessary
-        if deblend_nthresh:
-            deblended_list = map(lambda x: x.deblend(), island_list)
-            #deblended_list = [x.deblend() for x in island_list]
-            island_list = list(utils.flatten(deblended_list))
-
-        # Iterate over the list of islands and measure the source in each,
-        # appending it to the results list.
-        results = containers.ExtractionResults()
-        for island in island_list:
-            if force_beam:
-                fixed = {'semimajor': self.beam[0],
-                         'semiminor': self.beam[1],
-                         'theta': self.beam[2]}
-            else:
-                fixed = None
-            fit_results = island.fit(fixed=fixed)
-            if fit_results:
-                measurement, residual = fit_results
-            else:
-                # Failed to fit; drop this island and go to the next.
-                continue
-            try:
-                det = extract.Detection(measurement, self, chunk=island.chunk)
-                if (det.ra.error == float('inf') or
-                        det.dec.error == float('inf')):
-                    logger.warn('Bad fit from blind extraction at pixel coords:'
-                                  '%f %f - measurement discarded'
-                                  '(increase fitting margin?)', det.x, det.y )
-                else:
-                    results.append(det)
+        with stage('deblend', islands=len(island_list)):
+            # Deblend each of the islands to its consituent parts, if necessary
+            if deblend_nthresh:
+                deblended_list = map(lambda x: x.deblend(), island_list)
+                #deblended_list = [x.deblend() for x in island_list]
+                island_list = list(utils.flatten(deblended_list))
 
+        if force_beam:
+            fixed = {'semimajor': self.beam[0],
+                     'semiminor': self.beam[1],
+                     'theta': self.beam[2]}
+        else:
+            fixed = None
+
+        with stage('fit', islands=len(island_list)):
+            # Measure the source in each of the islands. This may be spread
+            # over several processes; the results come back in the order of
+            # the islands either way.
+            if (nr_processes > 1 and len(island_list) > 1 and
+                    multiprocessing.current_process().daemon):
+                # Daemonic processes, such as the workers used by
+                # tkp.distribute.multiproc, are not allowed to have children.
+                logger.warn("Can't fit islands in parallel from within a "
+                            "daemon process; fitting serially")
+                nr_processes = 1
+            # The errors are calculated for all the islands at once afterwards.
+            if nr_processes > 1 and len(island_list) > 1:
+                pool = multiprocessing.Pool(processes=nr_processes)
+                try:
+                    all_fit_results = pool.map(
+                        functools.partial(extract.fit_island, errors=False),
+                        [island.compact(fixed=fixed)
+                         for island in island_list],
+                        chunksize=int(numpy.ceil(
+                            len(island_list) / (4. * nr_processes)))
+                    )
+                finally:
+                    pool.terminate()
+            else:
+                all_fit_results = (island.fit(fixed=fixed, errors=False)
+                                   for island in island_list)
+
+            # Drop the islands which failed to fit, including those which
+            # can't be deconvolved (see extract.deconvolve_all()).
+            fitted = [(island, fit_results) for island, fit_results
+                      in itertools.izip(island_list, all_fit_results)
+                      if fit_results]
+
+        with stage('errors', islands=len(island_list)):
+            extract.calculate_all_errors(
+                [measurement for island, (measurement, residual) in fitted],
+                [island.noise() for island, fit_results in fitted],
+                self.beam,
+                [island.threshold() for island, fit_results in fitted])
+            for island, (measurement, residual) in fitted:
+                if numpy.isinf(measurement['theta'].error):
+                    logger.error("Moments & Gaussian fitting failed at %s" %
+                                 (str(island.position)))
+            fitted = [(island, (measurement, residual))
+                      for island, (measurement, residual) in fitted
+                      if not numpy.isinf(measurement['theta'].error)]
+            extract.deconvolve_all(
+                [measurement for island, (measurement, residual) in fitted],
+                self.beam)
+
+        with stage('detections', islands=len(island_list)):
+            # Make a detection of the source measured in each island.
+            detections = []
+            for island, (measurement, residual) in fitted:
+                detections.append(extract.Detection(
+                    measurement, self, chunk=island.chunk,
+                    convert_coordinates=False
+                ))
                 if self.residuals:
                     self.residuals_from_deblending[island.chunk] -= (
                         island.data.filled(fill_value=0.))
-                    self.residuals_from_gauss_fitting[island.chunk] += residual
+                    self.residuals_from_gauss_fitting[island.chunk] += (
+                        residual)
+
+            # Work out the celestial coordinates of all the detections at
+            # once, then append those with usable position errors to the
+            # results list.
+            try:
+                extract.physical_coordinates(detections)
             except RuntimeError:
                 logger.warn("Island not processed; unphysical?")
                 raise
+            results = containers.ExtractionResults()
+            for det in detections:
+                if (det.ra.error == float('inf') or
+                        det.dec.error == float('inf')):
+                    logger.warn('Bad fit from blind extraction at pixel '
+                                'coords: %f %f - measurement discarded'
+                                '(increase fitting margin?)', det.x, det.y )
+                else:
+                    results.append(det)
 
         def is_usable(det):
             # Check that both ends of each axis are usable; that is, that they
@@ -888,7 +1171,7 @@ class ImageData(object):
                 y = (numpy.floor(y), numpy.ceil(y))
                 for position in itertools.product(x, y):
                     try:
-                        if self.data.mask[position[0], position[1]]:
+                        if self.data.mask[int(position[0]), int(position[1])]:
                             # Point falls in mask
                             return False
                     except IndexError:
@@ -908,3 +1191,275 @@ class ImageData(object):
             return True
         # Filter will return a list; ensure we return an ExtractionResults.
         return containers.ExtractionResults(filter(is_usable, results))
+
+
+# Masks returned by geometric_mask(), most recently used last.
+_geometric_masks = collections.OrderedDict()
+
+def geometric_mask(shape, margin=0, radius=0):
+    """Mask the margin of an image, and everything outside a radius.
+
+    Args:
+
+        shape (2-tuple): shape of the image.
+
+    Kwargs:
+
+        margin (int): width of the margin along each edge, in pixels.
+
+        radius (float): radius from the centre of the image, in pixels.
+
+    Returns:
+
+        (numpy.ndarray): boolean mask, True where the data is to be ignored,
+        or None if there is nothing to mask.
+
+    The images processed together generally share their shapes, so the
+    masks are cached (read-only) for reuse.
+    """
+    if not margin and not radius:
+        return None
+    key = (tuple(shape), margin, radius)
+    try:
+        mask = _geometric_masks.pop(key)
+    except KeyError:
+        if margin:
+            mask = numpy.ones(shape, dtype=numpy.bool)
+            mask[margin:-margin, margin:-margin] = False
+        else:
+            mask = numpy.zeros(shape, dtype=numpy.bool)
+        if radius:
+            mask |= utils.circular_mask(shape[0], shape[1], radius)
+        mask.flags.writeable = False
+        while len(_geometric_masks) >= MASK_CACHE_SIZE:
+            _geometric_masks.popitem(last=False)
+    _geometric_masks[key] = mask
+    return mask
+
+
+def _neighbour_seeds(num_pix, sigma, median):
+    """Initial estimates for clipping the odd columns of a grid of boxes.
+
+    Args:
+
+        num_pix, sigma, median (numpy.ndarray): results of clipping the
+            boxes in the even columns of the grid, as returned by
+            stats.sigma_clip_tiles(), in the shape of the whole grid.
+
+    Returns:
+
+        (dict): initial_centre and initial_std arguments for
+        stats.sigma_clip_tiles(), one for each box in the odd columns. The
+        centre is the mean of the medians of the usable boxes to either side,
+        and the standard deviation the larger of theirs, so that the first
+        clip errs on the side of keeping pixels. Boxes without a usable
+        neighbour get NaNs, and start cold.
+    """
+    nx, ny = num_pix.shape
+    usable = (num_pix > 0) & numpy.logical_or(median, sigma)
+    # The grids are padded with a column of NaNs on the right, so that every
+    # odd column has a neighbour on either side.
+    centre = numpy.empty((nx, ny + 1))
+    centre.fill(numpy.nan)
+    centre[:, :ny] = numpy.where(usable, median, numpy.nan)
+    std = numpy.empty((nx, ny + 1))
+    std.fill(numpy.nan)
+    std[:, :ny] = numpy.where(usable, sigma, numpy.nan)
+    left, right = slice(0, ny - 1, 2), slice(2, ny + 1, 2)
+
+    seed_centre = numpy.where(
+        numpy.isnan(centre[:, left]), centre[:, right],
+        numpy.where(numpy.isnan(centre[:, right]), centre[:, left],
+                    0.5 * (centre[:, left] + centre[:, right])))
+    seed_std = numpy.fmax(std[:, left], std[:, right])
+    return {'initial_centre': seed_centre.ravel(),
+            'initial_std': seed_std.ravel()}
+
+
+def background_grids(useful_data, beam, back_size_x, back_size_y,
+                     dtype=numpy.float64, warm_start=True):
+    """Calculate the RMS and background in each box of an image.
+
+    Args:
+
+        useful_data (numpy.ma.MaskedArray): the image data, trimmed to the
+            bounding box of the unmasked pixels.
+
+        beam (3-tuple): beam shape specification as
+            (semimajor, semiminor, theta)
+
+        back_size_x, back_size_y (int): box size.
+
+    Kwargs:
+
+        dtype (numpy.dtype): type in which to hold a copy of the data while
+            clipping it.
+
+        warm_start (bool): clip the boxes in the even columns of the grid
+            first, and use their results as a warm start for clipping the
+            boxes in between (see stats.sigma_clip()). This takes fewer
+            clipping iterations, and gives the same grids as clipping every
+            box from a cold start to within the noise of the estimates.
+
+    Returns:
+
+        (2-tuple of numpy.ndarray): RMS and background grids, with one value
+        per box. Boxes which can't be used are set to zero.
+
+    Each box only depends on those beside it in the same row of the grid:
+    calculating the grids for a strip of whole rows of boxes gives the same
+    values as calculating them for the whole image.
+    """
+    my_xdim, my_ydim = useful_data.shape
+
+    # Rather than looping over the grid, we reshape the useful data into
+    # a (boxes, pixels) block, with each row holding the pixels of one
+    # back_size_x * back_size_y box, and process all the boxes at once.
+    # Boxes along the upper edges may be smaller than the others: we pad
+    # them with NaNs, which (like masked pixels) are ignored.
+    nx = -(-my_xdim // back_size_x)
+    ny = -(-my_ydim // back_size_y)
+    boxes = numpy.empty((nx * back_size_x, ny * back_size_y), dtype=dtype)
+    boxes.fill(numpy.nan)
+    boxes[:my_xdim, :my_ydim] = useful_data.filled(fill_value=numpy.nan)
+    boxes = boxes.reshape(
+        nx, back_size_x, ny, back_size_y).swapaxes(1, 2)
+
+    # With a warm start, the even columns of boxes are clipped first, and
+    # the odd columns start from the results of their neighbours.
+    if warm_start and ny > 1:
+        steps = (slice(0, None, 2), slice(1, None, 2))
+    else:
+        steps = (slice(None),)
+    grids = None
+    for columns in steps:
+        seeds = {} if grids is None else _neighbour_seeds(*grids[:3])
+        results = stats.sigma_clip_tiles(
+            boxes[:, columns].reshape(-1, back_size_x * back_size_y), beam,
+            **seeds)
+        if grids is None:
+            grids = [numpy.zeros((nx, ny), dtype=result.dtype)
+                     for result in results]
+        for grid, result in zip(grids, results):
+            grid[:, columns] = result.reshape(nx, -1)
+    del boxes
+    num_pix, sigma, median, mean, num_clip_its = [
+        grid.ravel() for grid in grids]
+
+    # A box without any (non-zero) data left after clipping is
+    # unusable. If sigma and the median are both zero, all the
+    # remaining data must be zero.
+    usable = (num_pix > 0) & numpy.logical_or(median, sigma)
+
+    # In the case of a crowded field, the distribution will be skewed and
+    # we take the median as the background level. Otherwise, we take
+    # 2.5 * median - 1.5 * mean. This is the same as SExtractor: see
+    # discussion at <http://terapix.iap.fr/forum/showthread.php?tid=267>.
+    # (mean - median) / sigma is a quick n' dirty skewness estimator
+    # devised by Karl Pearson.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        skewed = numpy.fabs(mean - median) / sigma >= 0.3
+    logger.debug('bg skewed in %d of %d boxes, max %d clipping iterations',
+                 (skewed & usable).sum(), usable.sum(),
+                 num_clip_its.max() if len(num_clip_its) else 0)
+
+    rmsgrid = numpy.where(usable, sigma, 0).reshape(nx, ny)
+    bggrid = numpy.where(
+        usable, numpy.where(skewed, median, 2.5 * median - 1.5 * mean), 0
+    ).reshape(nx, ny)
+    return rmsgrid, bggrid
+
+
+def interpolate_grid(grid, useful_shape, back_size_x, back_size_y,
+                     window=None, dtype=numpy.float64):
+    """Interpolate a background or RMS grid up to the size of the image.
+
+    Args:
+
+        grid (numpy.ma.MaskedArray): grid, as calculated by
+            background_grids().
+
+        useful_shape (2-tuple): shape of the bounding box of the unmasked
+            pixels of the image, which the grid covers.
+
+        back_size_x, back_size_y (int): box size.
+
+    Kwargs:
+
+        window (2-tuple of slices): if given, only calculate this part of
+            the map (relative to the bounding box). The values are the same
+            as those in the corresponding part of the whole map.
+
+        dtype (numpy.dtype): type of the map.
+
+    Returns:
+
+        (numpy.ndarray): the interpolated map.
+    """
+    my_xdim, my_ydim = useful_shape
+
+    if MEDIAN_FILTER:
+        f_grid = ndimage.median_filter(grid, MEDIAN_FILTER)
+        if MF_THRESHOLD:
+            grid = numpy.where(
+                numpy.fabs(f_grid - grid) > MF_THRESHOLD, f_grid, grid
+            )
+        else:
+            grid = f_grid
+
+    # Bicubic spline interpolation
+    xratio = float(my_xdim)/back_size_x
+    yratio = float(my_ydim)/back_size_y
+    # First arg: starting point. Second arg: ending point. Third arg:
+    # 1j * number of points. (Why is this complex? Sometimes, NumPy has an
+    # utterly baffling API...)
+    slicex = slice(-0.5, -0.5+xratio, 1j*my_xdim)
+    slicey = slice(-0.5, -0.5+yratio, 1j*my_ydim)
+    if window is None:
+        window = (slice(0, my_xdim), slice(0, my_ydim))
+    # These are the coordinates numpy.mgrid[slicex, slicey] would give us,
+    # but only for the window.
+    x, y = numpy.mgrid[slicex][window[0]], numpy.mgrid[slicey][window[1]]
+    coordinates = numpy.empty((2, len(x), len(y)), dtype=dtype)
+    coordinates[0] = x[:, numpy.newaxis]
+    coordinates[1] = y[numpy.newaxis, :]
+    return ndimage.map_coordinates(
+        grid, coordinates, output=dtype, mode='nearest',
+        order=INTERPOLATE_ORDER)
+
+
+def finalise_map(my_map, grid, roundup=False):
+    """Apply the finishing touches to a map interpolated from a grid.
+
+    Args:
+
+        my_map (numpy.ma.MaskedArray): interpolated map, masked like the
+            image.
+
+        grid (numpy.ma.MaskedArray): the grid it was interpolated from.
+
+    Kwargs:
+
+        roundup (bool): trim values lower than the grid.
+
+    Returns:
+
+        (numpy.ma.MaskedArray)
+    """
+    # If the input grid was entirely masked, then the output map must
+    # also be masked: there's no useful data here. We don't search for
+    # sources on a masked background/RMS, so this data will be cleanly
+    # skipped by the rest of the sourcefinder
+    if numpy.ma.getmask(grid).all():
+        my_map.mask = True
+    elif roundup:
+        # In some cases, the spline interpolation may produce values
+        # lower than the minimum value in the map. If required, these
+        # can be trimmed off. No point doing this if the map is already
+        # fully masked, though.
+        my_map = numpy.ma.MaskedArray(
+                data = numpy.where(
+                    my_map >= numpy.min(grid), my_map, numpy.min(grid)),
+                mask = my_map.mask
+        )
+    return my_map
@@ -0,0 +1,130 @@
+"""
+On-disk cache of the background and RMS grids and maps of images.
+
+Calculating the background and RMS of an image is expensive, and the same
+image is processed more than once: blind extraction and forced fitting each
+build their own ImageData, usually in different processes. An ImageData
+given an entry in a MapCache will load its grids and maps from there if
+they are available, and store them there when it calculates them.
+
+Entries are keyed by the path, modification time and size of the image
+file, so that a changed image is never matched with stale maps. A CASA
+image is a directory, the modification time of which doesn't change when
+the tables inside it are rewritten, so it is keyed by the modification times
+and sizes of the files it contains instead. The ImageData adds its mesh
+parameters and beam to the key of each set of maps. The cache is limited in
+size: the least recently used maps are discarded to make room for new ones.
+"""
+
+import os
+import logging
+import numpy
+
+from tkp.utility.filecache import FileCache, file_status, digest
+
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".npz"
+
+
+class MapCache(FileCache):
+    """A directory holding cached maps.
+
+    Args:
+
+        directory (str): where to store the maps. Created if necessary.
+
+    Kwargs:
+
+        max_size (int): maximum total size of the cached maps, in bytes.
+    """
+    suffixes = (SUFFIX,)
+
+    def __init__(self, directory, max_size=2**32):
+        super(MapCache, self).__init__(directory, max_size)
+
+    def entry(self, url):
+        """The cache entry for the image in the file at url.
+
+        Returns:
+
+            (MapCacheEntry)
+        """
+        url = os.path.abspath(url)
+        return MapCacheEntry(self, digest(url, *file_status(url)))
+
+    def load(self, key):
+        """Load the arrays stored under key.
+
+        Returns:
+
+            (dict): masked arrays, by name; None if there aren't any.
+        """
+        path = self.path(key, SUFFIX)
+        try:
+            arrays = {}
+            with open(path, 'rb') as f:
+                stored = numpy.load(f)
+                for name in stored.files:
+                    if name.endswith("_data"):
+                        name = name[:-len("_data")]
+                        arrays[name] = numpy.ma.MaskedArray(
+                            stored[name + "_data"],
+                            mask=stored[name + "_mask"])
+            # Mark the entry as recently used.
+            self.touch(key)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            # A corrupt entry is no worse than a missing one.
+            logger.warn("Ignoring unreadable cached maps %s: %s", path, e)
+            return None
+        logger.debug("Loaded cached maps %s", path)
+        return arrays
+
+    def save(self, key, arrays):
+        """Store masked arrays (a dict, by name) under key."""
+        stored = {}
+        for name, array in arrays.iteritems():
+            stored[name + "_data"] = numpy.ma.getdata(array)
+            stored[name + "_mask"] = numpy.ma.getmaskarray(array)
+        try:
+            self.write(key, SUFFIX, lambda f: numpy.savez(f, **stored))
+        except (IOError, OSError) as e:
+            logger.warn("Failed to cache maps: %s", e)
+            return
+        self.evict()
+
+
+class MapCacheEntry(object):
+    """The cached maps of a single image.
+
+    Each set of maps is stored under a name, together with the parameters
+    used to calculate them.
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def load(self, name, parameters):
+        """Load a set of maps.
+
+        Args:
+
+            name (str): name of the maps.
+
+            parameters (tuple): parameters used to calculate them.
+
+        Returns:
+
+            (dict): masked arrays, by name; None if they aren't cached.
+        """
+        return self.cache.load(self._key(name, parameters))
+
+    def save(self, name, parameters, arrays):
+        """Store a set of maps (a dict of masked arrays); see load()."""
+        self.cache.save(self._key(name, parameters), arrays)
+
+    def _key(self, name, parameters):
+        return "%s-%s" % (self.key, digest(name, *parameters)[:16])
@@ -55,9 +55,19 @@ def unbiased_sigma(N_indep):
     return 1.4142135623730951 * erfcinv(0.5 / N_indep)
 
 
+def _median_inplace(data):
+    """Median of a 1D array, equivalent to numpy.median.
+
+    The array is partitioned in place rather than copied.
+    """
+    n = len(data)
+    data.partition(((n - 1) // 2, n // 2))
+    return 0.5 * (data[(n - 1) // 2] + data[n // 2])
+
+
 def sigma_clip(data, beam, sigma=unbiased_sigma, max_iter=100,
                centref=numpy.median, distf=numpy.var, my_iterations=0,
-               corr_clip=1.):
+               corr_clip=1., initial_centre=None, initial_std=None):
     """Iterative clipping
 
     By default, this performs clipping of the standard deviation about the
@@ -66,62 +76,349 @@ def sigma_clip(data, beam, sigma=unbiased_sigma, max_iter=100,
 
     max_iter sets the maximum number of iterations used.
 
-    my_iterations is a counter for recursive operation of the code; leave it
-    alone unless you really want to pretend to jump into the middle of a loop.
+    my_iterations and corr_clip allow you to pretend to jump into the middle
+    of the clipping loop; leave them alone unless you really want to do that.
 
     sigma is subtle: if a callable is given, it is passed a copy of the data
     array and can calculate a clipping limit. See, for e.g., unbiased_sigma()
     defined above. However, if it isn't callable, sigma is assumed to just set
     a hard limit.
 
-    To do: Improve documentation
-            -Returns???
-            -How does it make use of the beam? (It estimates the noise correlation)
-    """
-    if my_iterations >= max_iter:
-        # Exceeded maximum number of iterations; return
-        return data, my_iterations
+    The beam is used to estimate the number of independent pixels, since the
+    noise in the data is correlated over a beam.
+
+    If initial_centre and initial_std are given (for example, the results of
+    clipping similar data), the data is first clipped about those values
+    before iterating as usual. That typically removes most of the outliers
+    at once, so clipping converges in fewer iterations than it would from a
+    cold start. The results agree with those of a cold start to within the
+    noise of the estimates, but are not identical: the iterations may settle
+    on a window of the data a few values wider or narrower, and the clipping
+    correction applied to the standard deviation depends on the number of
+    pixels at the last clip. If nothing, or everything, is clipped about the
+    initial values, clipping carries on from a cold start.
+
+    The data is copied once into a work array; all further clipping happens
+    in place, so the input is not modified.
 
+    Returns a tuple of the clipped data (a 1D array), the unbiased standard
+    deviation and the centre of the clipped data and the number of iterations
+    performed.
+    """
     # Numpy 1.1 breaks std() for MaskedArray: see
     # <http://www.scipy.org/scipy/numpy/wiki/MaskedArray>.
     # MaskedArray.compressed() returns a 1-D array of non-masked data.
     if isinstance(data, MaskedArray):
-        data = data.compressed()
-    centre = centref(data)
-    N = numpy.size(data)
-    N_indep = indep_pixels(N, beam)
-    if N_indep < 1:
-        # This chunk is too small for processing; return an empty array.
-        return numpy.array([]), 0, 0, 0
-
-    # If sigma is callable, use it to dynamically calculate the clipping
-    # limits.
-    if callable(sigma):
-        my_sigma = sigma(N_indep)
+        work = data.compressed()
     else:
-        my_sigma = sigma
+        work = numpy.array(data, dtype=numpy.float64).ravel()
+    scratch = numpy.empty(len(work))
+    keep = numpy.empty(len(work), dtype=numpy.bool)
+    lower = numpy.empty(len(work), dtype=numpy.bool)
+
+    warm_start = initial_centre is not None and initial_std is not None
+    unbiased_std, centre = initial_std, initial_centre
+    while True:
+        N = numpy.size(work)
+        N_indep = indep_pixels(N, beam)
+        if N_indep < 1:
+            # This chunk is too small for processing; return an empty array.
+            return numpy.array([]), 0, 0, 0
+
+        # If sigma is callable, use it to dynamically calculate the clipping
+        # limits.
+        if callable(sigma):
+            my_sigma = sigma(N_indep)
+        else:
+            my_sigma = sigma
 
-    # distf=numpy.var is a sample variance with the factor N/(N-1)
-    # already built in, N being the number of pixels. So, we are
-    # going to remove that and replace it by N_indep/(N_indep-1)
-    clipped_var = distf(data) * (N - 1.) * N_indep / (N * (N_indep - 1.))
-    unbiased_var = corr_clip * clipped_var
+        if not warm_start:
+            if centref is numpy.median:
+                centre = _median_inplace(work)
+            else:
+                centre = centref(work)
 
-    # There is an extra factor c4 needed to get a unbiased standard
-    # deviation, unbiased if we disregard clipping bias, see
-    # http://en.wikipedia.org/wiki/Unbiased_estimation_of_standard_deviation\
-    #         #Results_for_the_normal_distribution
-    c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
-    unbiased_std = numpy.sqrt(unbiased_var) / c4
+            # distf=numpy.var is a sample variance with the factor N/(N-1)
+            # already built in, N being the number of pixels. So, we are
+            # going to remove that and replace it by N_indep/(N_indep-1)
+            if distf is numpy.var:
+                deviation = numpy.subtract(
+                    work, work.sum() / N, out=scratch[:N])
+                deviation *= deviation
+                variance = deviation.sum() / N
+            else:
+                variance = distf(work)
+            clipped_var = variance * (N - 1.) * N_indep / (N * (N_indep - 1.))
+            unbiased_var = corr_clip * clipped_var
 
-    limit = my_sigma * unbiased_std
+            # There is an extra factor c4 needed to get a unbiased standard
+            # deviation, unbiased if we disregard clipping bias, see
+            # http://en.wikipedia.org/wiki/Unbiased_estimation_of_standard_deviation\
+            #         #Results_for_the_normal_distribution
+            c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+            unbiased_std = numpy.sqrt(unbiased_var) / c4
 
-    newdata = data.compress(abs(data - centre) <= limit)
+        limit = my_sigma * unbiased_std
 
-    if len(newdata) != len(data) and len(newdata) > 0:
+        # Values more than limit from the centre are clipped. These are the
+        # smallest n_low and the largest n_high values of the data, so we
+        # can partition them to either end of the work array and continue
+        # with a view on the values in between.
+        numpy.subtract(work, centre, out=scratch[:N])
+        numpy.abs(scratch[:N], out=scratch[:N])
+        numpy.less_equal(scratch[:N], limit, out=keep[:N])
+        n_keep = numpy.count_nonzero(keep[:N])
+        if n_keep == N or n_keep == 0:
+            if warm_start:
+                # Nothing, or everything, to clip about the initial values;
+                # carry on as usual to calculate the statistics.
+                warm_start = False
+                continue
+            if n_keep == 0:
+                work = work[:0]
+            return work, unbiased_std, centre, my_iterations
+
+        numpy.less(work, centre, out=lower[:N])
+        numpy.logical_and(lower[:N], ~keep[:N], out=lower[:N])
+        n_low = numpy.count_nonzero(lower[:N])
+        work.partition((n_low, n_low + n_keep - 1))
+        work = work[n_low:n_low + n_keep]
+
+        warm_start = False
         corr_clip = var_helper(my_sigma)
         my_iterations += 1
-        return sigma_clip(newdata, beam, sigma, max_iter, centref, distf,
-                          my_iterations, corr_clip)
+        if my_iterations >= max_iter:
+            # Exceeded maximum number of iterations; return
+            return work, unbiased_std, centre, my_iterations
+
+
+def sigma_clip_tiles(tiles, beam, sigma=unbiased_sigma, max_iter=100,
+                     initial_centre=None, initial_std=None):
+    """Iterative clipping of many chunks of data at once
+
+    This performs the same clipping as sigma_clip() (with its default centref
+    & distf), but operates on every row of a 2D array in parallel, rather than
+    on a single 1D array. It is intended for calculating the background & RMS
+    grids of an image, where every row holds the pixels of one grid box.
+
+    Unusable pixels (those which would be masked) should be set to NaN.
+
+    Since the data is clipped symmetrically about the median, the values
+    retained after every iteration always form a contiguous range of the
+    sorted data. Each row is therefore sorted only once, and we track a
+    window [lo, lo + n) of surviving values rather than repeatedly copying
+    the data. Sums over the window are taken from cumulative sums of the
+    sorted data, which are offset by the initial median of each row to avoid
+    losing precision when the variance is small compared to the mean. The
+    sums are accumulated in double precision, even if the tiles are single
+    precision.
+
+    initial_centre and initial_std may give a warm start for each row, as
+    for sigma_clip(). Rows whose initial values are NaN, or whose initial
+    standard deviation is not positive, start cold. Unlike a cold start, a
+    warm start may clip too much at first: if the final clipping limits of
+    a row would take in values which were clipped, they are put back and
+    clipping carries on.
+
+    Returns a tuple of 1D arrays, each with one entry per row:
+
+        - the number of surviving pixels (0 if the row should be discarded);
+        - the unbiased standard deviation (cf. sigma_clip());
+        - the median (cf. sigma_clip());
+        - the mean of the surviving pixels;
+        - the number of clipping iterations performed.
+    """
+    data = numpy.sort(tiles, axis=1) # NaNs are sorted to the end
+    ntiles, npix = data.shape
+    everything = numpy.arange(ntiles)
+
+    lo = numpy.zeros(ntiles, dtype=numpy.intp)
+    n = npix - numpy.isnan(data[:, ::-1]).argmin(axis=1)
+    n[numpy.isnan(data[:, 0])] = 0
+    valid = n.copy()
+    corr_clip = numpy.ones(ntiles)
+    iterations = numpy.zeros(ntiles, dtype=numpy.int)
+    std = numpy.zeros(ntiles)
+    centre = numpy.zeros(ntiles)
+
+    warm = numpy.zeros(ntiles, dtype=numpy.bool)
+    seeded = numpy.zeros(ntiles, dtype=numpy.bool)
+    if initial_centre is not None and initial_std is not None:
+        seed_centre = numpy.empty(ntiles)
+        seed_centre[:] = initial_centre
+        seed_std = numpy.empty(ntiles)
+        seed_std[:] = initial_std
+        with numpy.errstate(invalid='ignore'):
+            warm = numpy.isfinite(seed_centre) & (seed_std > 0)
+
+    def median(rows, lo, n):
+        # Equivalent to numpy.median applied to each window.
+        return 0.5 * (data[rows, lo + (n - 1) // 2] + data[rows, lo + n // 2])
+
+    offset = numpy.where(n > 0, median(everything, lo, numpy.maximum(n, 1)), 0)
+    shifted = numpy.nan_to_num(data - offset[:, numpy.newaxis])
+    cumsum = numpy.zeros((ntiles, npix + 1))
+    numpy.cumsum(shifted, axis=1, dtype=numpy.float64, out=cumsum[:, 1:])
+    shifted *= shifted
+    cumsum_sq = numpy.zeros((ntiles, npix + 1))
+    numpy.cumsum(shifted, axis=1, dtype=numpy.float64, out=cumsum_sq[:, 1:])
+    del shifted
+
+    def window_sums(rows, lo, n):
+        return (cumsum[rows, lo + n] - cumsum[rows, lo],
+                cumsum_sq[rows, lo + n] - cumsum_sq[rows, lo])
+
+    # Rows which are all NaN are discarded up front; we only carry on
+    # working with those rows which are still being clipped.
+    active = numpy.flatnonzero(n > 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        while len(active):
+            N = n[active].astype(numpy.float64)
+            N_indep = indep_pixels(N, beam)
+
+            # Chunks too small for processing are discarded.
+            too_small = N_indep < 1
+            n[active[too_small]] = 0
+            active, N, N_indep = (
+                active[~too_small], N[~too_small], N_indep[~too_small])
+            if not len(active):
+                break
+
+            row_lo, row_n, row_warm = lo[active], n[active], warm[active]
+            row_centre = median(active, row_lo, row_n)
+
+            if callable(sigma):
+                my_sigma = sigma(N_indep)
+            else:
+                my_sigma = sigma * numpy.ones(len(active))
+
+            # Population variance of each window, equivalent to numpy.var.
+            total, total_sq = window_sums(active, row_lo, row_n)
+            variance = numpy.maximum(total_sq / N - (total / N)**2, 0)
+
+            # See sigma_clip() for a discussion of these corrections.
+            clipped_var = variance * (N - 1.) * N_indep / (N * (N_indep - 1.))
+            unbiased_var = corr_clip[active] * clipped_var
+            c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+            unbiased_std = numpy.sqrt(unbiased_var) / c4
+            if row_warm.any():
+                row_centre[row_warm] = seed_centre[active[row_warm]]
+                unbiased_std[row_warm] = seed_std[active[row_warm]]
+            limit = my_sigma * unbiased_std
+
+            # The surviving values form a contiguous range both of the full
+            # row and of the current window: we take the intersection.
+            survivors = (numpy.abs(data[active] - row_centre[:, numpy.newaxis])
+                         <= limit[:, numpy.newaxis])
+            first = survivors.argmax(axis=1)
+            last = first + survivors.sum(axis=1)
+            new_lo = numpy.maximum(first, row_lo)
+            new_n = numpy.maximum(
+                numpy.minimum(last, row_lo + row_n) - new_lo, 0)
+
+            std[active] = unbiased_std
+            centre[active] = row_centre
+            lo[active] = numpy.where(new_n > 0, new_lo, row_lo)
+            n[active] = new_n
+
+            clipped = (new_n != row_n) & (new_n > 0)
+
+            # A warm start which clips nothing, or everything, carries on as
+            # a cold start from the same window.
+            restart = row_warm & ~clipped
+            lo[active[restart]] = row_lo[restart]
+            n[active[restart]] = row_n[restart]
+            seeded[active[row_warm & clipped]] = True
+            warm[active] = False
+
+            # A window only ever shrinks, so a warm start which was too
+            # tight may settle on a window which its final limits would
+            # widen. Such a window is widened and clipped again. A warm
+            # start which loses every value starts again from cold.
+            row_seeded = seeded[active] & ~clipped
+            grow = row_seeded & (new_n > 0) & (
+                (first < row_lo) | (last > row_lo + row_n))
+            lo[active[grow]] = first[grow]
+            n[active[grow]] = last[grow] - first[grow]
+            lost = row_seeded & (new_n == 0)
+            lo[active[lost]] = 0
+            n[active[lost]] = valid[active[lost]]
+            seeded[active[lost]] = False
+
+            corr_clip[active[clipped]] = var_helper(my_sigma[clipped])
+            corr_clip[active[lost]] = 1.
+            iterations[active[clipped | grow]] += 1
+            active = active[
+                ((clipped | grow) & (iterations[active] < max_iter)) |
+                restart | lost]
+
+        # Finally, the mean of whatever survived the clipping.
+        mean = offset + window_sums(everything, lo, n)[0] / n
+    return n, std, centre, mean, iterations
+
+
+def fdr_cutoff(prob, size, scale, nbins=1024, max_passes=4):
+    """The largest probability below the Benjamini-Hochberg line.
+
+    The probabilities are ranked in ascending order, and the k-th of them
+    is compared to scale * k / size; this returns the last one which lies
+    below that line (cf. fig. 9 in Miller et al., AJ 122, 3492 (2001)), or
+    None if there is none. It is the same value as found by sorting all the
+    probabilities, but only those below the line at the highest rank can
+    ever cross it, and of those we only sort the ones in the histogram bins where the last
+    crossing may lie. If more than max_passes bins have to be sorted, or
+    the bins are too coarse to narrow down the candidates, we fall back to
+    sorting all the candidates.
+
+    Args:
+        prob (numpy.ndarray): probabilities of the unmasked pixels
+        size (int): the number of pixels, including any masked ones, which
+            are never taken to cross the line
+        scale (float): the false detection rate divided by the correction
+            for correlated pixels
+
+    Kwargs:
+        nbins (int): number of histogram bins between 0 and scale
+        max_passes (int): number of bins to sort before falling back
+
+    Returns:
+        (float): the probability at the cutoff, or None
+    """
+    size = float(size)
+
+    def compare(ranks):
+        # As computed for the ranks of all pixels, in the same order.
+        return scale * ranks.astype(numpy.float64) / size
+
+    def last_crossing(sorted_prob, first_rank):
+        ranks = numpy.arange(first_rank, first_rank + len(sorted_prob))
+        below = numpy.flatnonzero(sorted_prob - compare(ranks) < 0.)
+        if len(below):
+            return sorted_prob[below[-1]]
+
+    # No probability at or above the line at the highest rank can cross it.
+    limit = compare(numpy.array([len(prob)]))[0]
+    candidates = prob[prob < limit]
+    if not len(candidates):
+        return None
+    counts, edges = numpy.histogram(candidates, bins=nbins, range=(0, limit))
+    below_edge = numpy.concatenate(([0], numpy.cumsum(counts)))
+    # A bin may hold a crossing only if its lower edge lies below the line
+    # at the rank of its last element.
+    possible = numpy.flatnonzero(
+        (counts > 0) & (edges[:-1] < compare(below_edge[1:])))
+    for passes, index in enumerate(possible[::-1]):
+        if (passes == max_passes or
+                counts[index] > max(len(candidates) // max_passes, nbins)):
+            break
+        in_bin = candidates >= edges[index]
+        if index < nbins - 1:
+            # numpy.histogram() closes only the last bin.
+            in_bin &= candidates < edges[index + 1]
+        cutoff = last_crossing(numpy.sort(candidates[in_bin]),
+                               below_edge[index] + 1)
+        if cutoff is not None:
+            return cutoff
     else:
-        return newdata, unbiased_std, centre, my_iterations
+        return None
+    return last_crossing(numpy.sort(candidates), 1)
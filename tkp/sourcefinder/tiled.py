@@ -0,0 +1,458 @@
+"""
+Source extraction on images which are too large to fit in memory.
+
+The image is read piecemeal from an array (typically memory mapped from
+disk), so that only a limited number of pixels are in memory at once.
+Sources are found and measured in overlapping tiles, each of which is
+extracted by an ordinary ImageData.
+
+The background and RMS grids, and the median of the RMS map, are calculated
+for the image as a whole. The interpolated maps in each tile are therefore
+the same as the corresponding parts of those for the whole image. Each
+island is measured in the tile whose core contains the corner of its
+bounding box. An island which extends beyond the overlap of that tile is
+labelled again, and measured, in a window around it which is grown until it
+contains the whole island: so we find the same sources as ImageData would
+for the whole image, unless an island is too large to fit within the memory
+budget, in which case it is skipped.
+"""
+
+import copy
+import logging
+import numpy
+from tkp.utility import containers
+from tkp.utility.memoize import Memoize
+from tkp.sourcefinder import extract
+from tkp.sourcefinder.image import ImageData
+from tkp.sourcefinder.image import background_grids
+from tkp.sourcefinder.image import interpolate_grid
+from tkp.sourcefinder.image import finalise_map
+try:
+    import ndimage
+except ImportError:
+    from scipy import ndimage
+
+
+logger = logging.getLogger(__name__)
+
+#
+# Hard-coded configuration parameters; not user settable.
+#
+BYTES_PER_PIXEL = 128   # Rough upper limit to the memory used by ImageData
+                        # per pixel during source extraction.
+MEDIAN_BINS = 65536     # Histogram bins used for finding the median RMS.
+
+
+class TiledImage(object):
+    """An image which is processed in tiles to limit memory usage.
+
+    This provides (a subset of) the ImageData interface for source
+    extraction.
+    """
+
+    def __init__(self, data, beam, wcs, margin=0, radius=0, back_size_x=32,
+                 back_size_y=32, memory_budget=2**30, overlap=64,
+                 float32=False):
+        """Sets up a TiledImage object.
+
+        *Args:*
+          - data (2D array): image data, indexed like the data of an
+            ImageData. This is only ever read a slice at a time, so it may
+            be a numpy.memmap.
+          - beam (3-tuple): beam shape specification as
+            (semimajor, semiminor, theta)
+          - wcs (utility.coordinates.wcs): world coordinate system
+            specification
+
+        *Kwargs:*
+          - margin, radius, back_size_x, back_size_y, float32: as for
+            ImageData.
+          - memory_budget (int): approximate maximum number of bytes to use
+            while processing a tile.
+          - overlap (int): number of pixels by which the tiles overlap.
+            Islands larger than this are measured separately, at some
+            extra cost.
+        """
+        self.rawdata = data
+        self.beam = beam
+        self.wcs = wcs
+        self.margin = margin
+        self.radius = radius
+        self.back_size_x = back_size_x
+        self.back_size_y = back_size_y
+        self.memory_budget = memory_budget
+        self.overlap = overlap
+        self.dtype = numpy.float32 if float32 else numpy.float64
+
+        self.xdim, self.ydim = data.shape
+        self.max_pixels = memory_budget // BYTES_PER_PIXEL
+
+        # Work out the size of the tiles, including the overlap. Where the
+        # budget allows, a tile covers the whole of a dimension of the image.
+        ext_x = min(self.xdim, int(numpy.sqrt(self.max_pixels)))
+        ext_y = min(self.ydim, self.max_pixels // max(ext_x, 1))
+        if ext_y == self.ydim:
+            ext_x = min(self.xdim, self.max_pixels // ext_y)
+        self.core_x = ext_x if ext_x == self.xdim else ext_x - 2 * overlap
+        self.core_y = ext_y if ext_y == self.ydim else ext_y - 2 * overlap
+        if self.core_x < 1 or self.core_y < 1:
+            raise ValueError(
+                "Memory budget of %d bytes too small for tiles with an "
+                "overlap of %d pixels" % (memory_budget, overlap))
+
+    @property
+    def tiles(self):
+        """List of (core, extended) regions of the tiles.
+
+        Each region is a tuple of slices. The cores cover the image without
+        overlapping; the extended regions include the overlap.
+        """
+        tiles = []
+        for x0 in xrange(0, self.xdim, self.core_x):
+            for y0 in xrange(0, self.ydim, self.core_y):
+                core = (slice(x0, min(x0 + self.core_x, self.xdim)),
+                        slice(y0, min(y0 + self.core_y, self.ydim)))
+                extended = (
+                    slice(max(0, core[0].start - self.overlap),
+                          min(self.xdim, core[0].stop + self.overlap)),
+                    slice(max(0, core[1].start - self.overlap),
+                          min(self.ydim, core[1].stop + self.overlap))
+                )
+                tiles.append((core, extended))
+        return tiles
+
+    def _strips(self, rows=1):
+        """Regions covering the image in strips, a multiple of rows high"""
+        rows *= max(1, self.max_pixels // (rows * self.ydim))
+        return [(slice(x0, min(x0 + rows, self.xdim)), slice(0, self.ydim))
+                for x0 in xrange(0, self.xdim, rows)]
+
+    def _read(self, region):
+        """
+        Read part of the image.
+
+        Returns the data as a masked array. Like the data of an ImageData,
+        the margin, anything outside the radius and data which is equal to
+        0 or NaN are masked. For convenience, the masked values are NaN.
+        """
+        data = numpy.array(self.rawdata[region], dtype=self.dtype)
+        mask = numpy.isnan(data)
+        if self.margin:
+            x = numpy.arange(region[0].start, region[0].stop)[:, numpy.newaxis]
+            y = numpy.arange(region[1].start, region[1].stop)[numpy.newaxis, :]
+            mask |= (x < self.margin) | (x >= self.xdim - self.margin)
+            mask |= (y < self.margin) | (y >= self.ydim - self.margin)
+        if self.radius:
+            # As utils.circular_mask(), for this region.
+            centre_x, centre_y = (self.xdim-1)/2.0, (self.ydim-1)/2.0
+            x = numpy.arange(region[0].start, region[0].stop) - centre_x
+            y = numpy.arange(region[1].start, region[1].stop) - centre_y
+            mask |= (x[:, numpy.newaxis]**2 + y[numpy.newaxis, :]**2 >=
+                     self.radius * self.radius)
+        mask |= (data == 0)
+        data[mask] = numpy.nan
+        return numpy.ma.array(data, mask=mask)
+
+    @Memoize
+    def _useful_chunk(self):
+        """Bounding box of the unmasked data, or None if it's all masked"""
+        useful_x = numpy.zeros(self.xdim, dtype=numpy.bool)
+        useful_y = numpy.zeros(self.ydim, dtype=numpy.bool)
+        for region in self._strips():
+            unmasked = ~numpy.ma.getmaskarray(self._read(region))
+            useful_x[region[0]] = unmasked.any(axis=1)
+            useful_y |= unmasked.any(axis=0)
+        if not useful_x.any():
+            return None
+        x, y = numpy.flatnonzero(useful_x), numpy.flatnonzero(useful_y)
+        return (slice(x[0], x[-1] + 1), slice(y[0], y[-1] + 1))
+    useful_chunk = property(fget=_useful_chunk, fdel=_useful_chunk.delete)
+
+    @Memoize
+    def _grids(self):
+        """Gridded RMS and background data for interpolating"""
+        # The boxes are aligned with the corner of the useful chunk; we work
+        # through it a strip of boxes at a time.
+        useful_chunk = self.useful_chunk
+        rmsgrid, bggrid = [], []
+        for region in self._strips(rows=self.back_size_x):
+            region = (
+                slice(useful_chunk[0].start + region[0].start,
+                      min(useful_chunk[0].start + region[0].stop,
+                          useful_chunk[0].stop)),
+                useful_chunk[1]
+            )
+            if region[0].start >= useful_chunk[0].stop:
+                break
+            rms, bg = background_grids(self._read(region), self.beam,
+                                       self.back_size_x, self.back_size_y,
+                                       dtype=self.dtype)
+            rmsgrid.append(rms)
+            bggrid.append(bg)
+        rmsgrid, bggrid = numpy.vstack(rmsgrid), numpy.vstack(bggrid)
+        return {'rms': numpy.ma.array(rmsgrid, mask=(rmsgrid == 0)),
+                'bg': numpy.ma.array(bggrid, mask=(bggrid == 0))}
+    grids = property(fget=_grids, fdel=_grids.delete)
+
+    def _map(self, grid, region, mask, roundup=False):
+        """
+        The part of the map interpolated from grid covering region; the
+        same as the corresponding part of ImageData._interpolate(grid).
+        """
+        my_map = numpy.ma.MaskedArray(
+            numpy.zeros(mask.shape, dtype=self.dtype), mask=mask)
+        useful_chunk = self.useful_chunk
+        if useful_chunk is not None:
+            overlap = [
+                slice(max(r.start, u.start), min(r.stop, u.stop))
+                for r, u in zip(region, useful_chunk)
+            ]
+            if all(o.start < o.stop for o in overlap):
+                useful_shape = [u.stop - u.start for u in useful_chunk]
+                window = tuple(slice(o.start - u.start, o.stop - u.start)
+                               for o, u in zip(overlap, useful_chunk))
+                in_region = tuple(slice(o.start - r.start, o.stop - r.start)
+                                  for o, r in zip(overlap, region))
+                my_map[in_region] = interpolate_grid(
+                    grid, useful_shape, self.back_size_x, self.back_size_y,
+                    window=window, dtype=self.dtype)
+        return finalise_map(my_map, grid, roundup)
+
+    def _rmsmaps(self):
+        """Yield the RMS map, piece by piece"""
+        for region in self._strips():
+            mask = numpy.ma.getmaskarray(self._read(region))
+            yield self._map(self.grids['rms'], region, mask, roundup=True)
+
+    @Memoize
+    def _rms_median(self):
+        """Median of the RMS map, as numpy.ma.median(ImageData.rmsmap)"""
+        if self.useful_chunk is None:
+            return 0.
+        count, low, high = 0, numpy.inf, -numpy.inf
+        for rmsmap in self._rmsmaps():
+            values = rmsmap.compressed()
+            if len(values):
+                count += len(values)
+                low, high = min(low, values.min()), max(high, values.max())
+        if not count:
+            return 0.
+
+        # Count the values in bins spanning their range. The binning is
+        # monotonic, so the values we're after are in the bins where the
+        # cumulative count passes their ranks; we then collect the values in
+        # those bins to find them exactly.
+        scale = (MEDIAN_BINS - 1) / (high - low) if high > low else 0.
+        def bin_index(values):
+            return numpy.floor((values - low) * scale).astype(numpy.int64)
+        histogram = numpy.zeros(MEDIAN_BINS, dtype=numpy.int64)
+        for rmsmap in self._rmsmaps():
+            histogram += numpy.bincount(bin_index(rmsmap.compressed()),
+                                        minlength=MEDIAN_BINS)
+        cumulative = numpy.cumsum(histogram)
+        ranks = ((count - 1) // 2, count // 2)
+        bins = [numpy.searchsorted(cumulative, rank, side='right')
+                for rank in ranks]
+
+        candidates = []
+        for rmsmap in self._rmsmaps():
+            values = rmsmap.compressed()
+            candidates.append(values[numpy.in1d(bin_index(values), bins)])
+        candidates = numpy.sort(numpy.concatenate(candidates))
+        offset = cumulative[bins[0]] - histogram[bins[0]]
+        middle = candidates[[rank - offset for rank in ranks]]
+        return middle.sum() / 2. if count % 2 == 0 else middle[0]
+    rms_median = property(fget=_rms_median, fdel=_rms_median.delete)
+
+    def _tile_wcs(self, region):
+        """WCS for a tile starting at the corner of region"""
+        wcs = copy.deepcopy(self.wcs)
+        wcs.crpix = (self.wcs.crpix[0] - region[0].start,
+                     self.wcs.crpix[1] - region[1].start)
+        return wcs
+
+    def _tile(self, region):
+        """ImageData for the region of the image, with the background and
+        RMS maps set from those of the whole image."""
+        data = self._read(region)
+        # ImageData masks zeros, just as it does NaNs.
+        tile = ImageData(data.filled(0), self.beam, self._tile_wcs(region),
+                         back_size_x=self.back_size_x,
+                         back_size_y=self.back_size_y, residuals=False,
+                         float32=(self.dtype == numpy.float32))
+        mask = numpy.ma.getmaskarray(data)
+        tile.backmap = self._map(self.grids['bg'], region, mask)
+        tile.rmsmap = self._map(self.grids['rms'], region, mask, roundup=True)
+        return tile
+
+    def extract(self, det, anl, deblend_nthresh=0, force_beam=False,
+                nr_processes=1):
+        """
+        Kick off conventional (ie, RMS island finding) source extraction.
+
+        Kwargs:
+
+            det, anl, deblend_nthresh, force_beam, nr_processes: as for
+                ImageData.extract().
+
+        Returns:
+
+             (..utility.containers.ExtractionResults): the detections,
+                which do not refer to an image (see
+                extract.Detection.from_record()).
+        """
+        if anl > det:
+            logger.warn(
+                "Analysis threshold is higher than detection threshold"
+            )
+        results = containers.ExtractionResults()
+        if self.useful_chunk is None:
+            logger.warning("Image masked; sourcefinding skipped")
+            return results
+        tiles = self.tiles
+        logger.info("Extracting sources from %d tiles", len(tiles))
+        for core, extended in tiles:
+            tile = self._tile(extended)
+            labels, labelled_data = tile.label_islands(
+                det * tile.rmsmap, anl * tile.rmsmap,
+                rms_median=self.rms_median)
+            labels, edge_islands = self._select_islands(
+                labels, labelled_data, core, extended)
+            tile_results = tile.extract(
+                det, anl, labelled_data=labelled_data, labels=labels,
+                deblend_nthresh=deblend_nthresh, force_beam=force_beam,
+                nr_processes=nr_processes
+            )
+            for det_record in extract.detections_to_array(tile_results):
+                results.append(extract.Detection.from_record(
+                    _shift_record(det_record, extended[0].start,
+                                  extended[1].start)))
+            del tile, labelled_data, tile_results
+            for chunk, pixel in edge_islands:
+                results.extend(self._extract_island(
+                    chunk, pixel, core, det, anl,
+                    deblend_nthresh=deblend_nthresh, force_beam=force_beam,
+                    nr_processes=nr_processes
+                ))
+        return results
+
+    def _select_islands(self, labels, labelled_data, core, extended):
+        """
+        Select the labelled islands which are to be measured in this tile:
+        those with the corner of their bounding box in the core.
+
+        Returns:
+
+            (tuple): the labels of the islands lying within the extended
+                tile, and the bounding box and a pixel (in the coordinates
+                of the image) of each island which reaches the edge of the
+                extended tile, and so may be truncated.
+        """
+        slices = ndimage.find_objects(labelled_data)
+        selected, edge_islands = [], []
+        for label in labels:
+            chunk = slices[label - 1]
+            if not (core[0].start <= chunk[0].start + extended[0].start <
+                    core[0].stop and
+                    core[1].start <= chunk[1].start + extended[1].start <
+                    core[1].stop):
+                continue
+            if self._at_edge(chunk, extended):
+                pixel = numpy.transpose(
+                    numpy.nonzero(labelled_data[chunk] == label))[0]
+                edge_islands.append((
+                    _shift_region(chunk, extended),
+                    (pixel[0] + chunk[0].start + extended[0].start,
+                     pixel[1] + chunk[1].start + extended[1].start)
+                ))
+            else:
+                selected.append(label)
+        return selected, edge_islands
+
+    def _at_edge(self, chunk, region):
+        """Whether chunk, relative to region, reaches an edge of region
+        which isn't an edge of the image."""
+        return ((chunk[0].start == 0 and region[0].start > 0) or
+                (chunk[1].start == 0 and region[1].start > 0) or
+                (chunk[0].stop == region[0].stop - region[0].start and
+                 region[0].stop < self.xdim) or
+                (chunk[1].stop == region[1].stop - region[1].start and
+                 region[1].stop < self.ydim))
+
+    def _extract_island(self, chunk, pixel, core, det, anl, **kwargs):
+        """
+        Measure a single island, which extends beyond the tile in which it
+        was found.
+
+        The island is labelled again in a window around its bounding box,
+        grown until the window contains the whole island.
+
+        Args:
+
+            chunk (tuple): bounding box of the island, as far as it is known,
+                in the coordinates of the image.
+
+            pixel (tuple): coordinates of a pixel in the island.
+
+            core (tuple): core of the tile in which it was found: the island
+                is only measured if the corner of its bounding box is there.
+
+            det, anl, kwargs: as for extract().
+
+        Returns:
+
+            (list): the detections.
+        """
+        while True:
+            window = (
+                slice(max(0, chunk[0].start - self.overlap),
+                      min(self.xdim, chunk[0].stop + self.overlap)),
+                slice(max(0, chunk[1].start - self.overlap),
+                      min(self.ydim, chunk[1].stop + self.overlap))
+            )
+            size = ((window[0].stop - window[0].start) *
+                    (window[1].stop - window[1].start))
+            if size > self.max_pixels:
+                logger.warn("Island at %d, %d is too large for the memory "
+                            "budget; skipped", chunk[0].start, chunk[1].start)
+                return []
+            tile = self._tile(window)
+            labels, labelled_data = tile.label_islands(
+                det * tile.rmsmap, anl * tile.rmsmap,
+                rms_median=self.rms_median)
+            label = labelled_data[pixel[0] - window[0].start,
+                                  pixel[1] - window[1].start]
+            tile_chunk = ndimage.find_objects(labelled_data)[label - 1]
+            chunk = _shift_region(tile_chunk, window)
+            if not self._at_edge(tile_chunk, window):
+                break
+        if not (core[0].start <= chunk[0].start < core[0].stop and
+                core[1].start <= chunk[1].start < core[1].stop):
+            # It is measured by the tile in whose core its corner lies.
+            return []
+        tile_results = tile.extract(det, anl, labelled_data=labelled_data,
+                                    labels=[label], **kwargs)
+        return [extract.Detection.from_record(
+                    _shift_record(det_record, window[0].start,
+                                  window[1].start))
+                for det_record in extract.detections_to_array(tile_results)]
+
+
+def _shift_region(region, offset):
+    """Shift a region by the start of another region, offset"""
+    return tuple(slice(r.start + o.start, r.stop + o.start)
+                 for r, o in zip(region, offset))
+
+
+def _shift_record(record, x_offset, y_offset):
+    """Shift the pixel coordinates in a detection record by an offset"""
+    record = record.copy()
+    for name in ('x', 'end_smaj_x', 'start_smaj_x', 'end_smin_x',
+                 'start_smin_x'):
+        record[name] += x_offset
+    for name in ('y', 'end_smaj_y', 'start_smaj_y', 'end_smin_y',
+                 'start_smin_y'):
+        record[name] += y_offset
+    if record['chunk'][0] >= 0:
+        record['chunk'] += (x_offset, x_offset, y_offset, y_offset)
+    return record
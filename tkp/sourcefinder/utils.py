@@ -91,7 +91,14 @@ def generate_result_maps(data, sourcelist):
         upper_bound_x = min(residual_map.shape[0], int(src.x.value - 1 + box_size))
         lower_bound_y = max(0, int(src.y.value - 1 - box_size))
         upper_bound_y = min(residual_map.shape[1], int(src.y.value - 1 + box_size))
-
+        if upper_bound_x <= lower_bound_x or upper_bound_y <= lower_bound_y:
+            continue
+
+        # The Gaussian is only evaluated over the box, on a grid which
+        # broadcasts its column of x-coordinates against its row of
+        # y-coordinates.
+        box = (slice(lower_bound_x, upper_bound_x),
+               slice(lower_bound_y, upper_bound_y))
         local_gaussian = gaussian(
             src.peak.value,
             src.x.value,
@@ -99,13 +106,10 @@ def generate_result_maps(data, sourcelist):
             src.smaj.value,
             src.smin.value,
             src.theta.value
-        )(
-            numpy.indices(residual_map.shape)[0,lower_bound_x:upper_bound_x,lower_bound_y:upper_bound_y],
-            numpy.indices(residual_map.shape)[1,lower_bound_x:upper_bound_x,lower_bound_y:upper_bound_y]
-        )
+        )(*numpy.ogrid[box])
 
-        gaussian_map[lower_bound_x:upper_bound_x, lower_bound_y:upper_bound_y] += local_gaussian
-        residual_map[lower_bound_x:upper_bound_x, lower_bound_y:upper_bound_y] -= local_gaussian
+        gaussian_map[box] += local_gaussian
+        residual_map[box] -= local_gaussian
 
     return gaussian_map, residual_map
 
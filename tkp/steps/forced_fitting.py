@@ -1,7 +1,11 @@
 import logging
+import numpy
 import tkp.accessors
 from tkp.accessors import sourcefinder_image_from_accessor
 import tkp.accessors
+from tkp.steps.misc import open_image
+from tkp.steps.source_extraction import (get_map_cache, set_memo_cache_size,
+                                         log_memo_stats)
 from tkp.db import general as dbgen
 from tkp.db import monitoringlist as dbmon
 from tkp.db import nulldetections as dbnd
@@ -66,7 +70,8 @@ def insert_and_associate_forced_fits(image_id,successful_fits,successful_ids):
 
 
 def perform_forced_fits(fit_posns, fit_ids,
-                        image_path, extraction_params):
+                        image_path, extraction_params,
+                        image_cache_config=None):
     """
     Perform forced source measurements on an image based on a list of
     positions.
@@ -76,6 +81,8 @@ def perform_forced_fits(fit_posns, fit_ids,
         fit_ids: List of identifiers for each requested fit position.
         image_path (str): path to image for measurements.
         extraction_params (dict): source extraction parameters, as a dictionary.
+        image_cache_config (dict): the image_cache section of the pipeline
+            config; see tkp.steps.misc.open_image.
 
     Returns:
         A matched pair of lists (serialized_fits, ids), corresponding to
@@ -84,19 +91,28 @@ def perform_forced_fits(fit_posns, fit_ids,
         if some fits are unsuccessful.
     """
     logger.info("Forced fitting in image: %s" % (image_path))
-    fitsimage = tkp.accessors.open(image_path)
+    set_memo_cache_size(extraction_params)
+    float32 = extraction_params.get('float32', False)
+    if float32:
+        fitsimage = open_image(image_path, image_cache_config,
+                               dtype=numpy.float32)
+    else:
+        fitsimage = open_image(image_path, image_cache_config)
 
     data_image = sourcefinder_image_from_accessor(fitsimage,
                     margin=extraction_params['margin'],
                     radius=extraction_params['extraction_radius_pix'],
                     back_size_x=extraction_params['back_size_x'],
-                    back_size_y=extraction_params['back_size_y'])
+                    back_size_y=extraction_params['back_size_y'],
+                    float32=float32,
+                    map_cache=get_map_cache(image_path, extraction_params))
 
 
     boxsize = extraction_params['box_in_beampix'] * max(data_image.beam[0],
                                              data_image.beam[1])
     successful_fits, successful_ids = data_image.fit_fixed_positions(
                                                 fit_posns, boxsize, ids=fit_ids)
+    log_memo_stats(data_image, image_path)
     if successful_fits:
         serialized =[
             f.serialize(
@@ -8,10 +8,13 @@ import datetime
 import ConfigParser
 import logging
 import os
+import tempfile
 from pprint import pprint
 
 from collections import defaultdict
 
+import tkp.accessors
+from tkp.accessors.imagecache import ImageCache
 from tkp.config import parse_to_dict
 from tkp.db.dump import dump_db
 
@@ -29,6 +32,23 @@ def load_job_config(pipe_config):
     return parse_to_dict(job_config)
 
 
+def open_image(path, image_cache_config=None, **kwargs):
+    """
+    Returns an accessor for the image at path, as tkp.accessors.open() does.
+
+    If image_cache_config (the image_cache section of the pipeline config)
+    enables the node-local image cache with local_cache, the image is opened
+    through the cache; local_cache_dir and local_cache_size (in MB)
+    configure it. See tkp.accessors.imagecache.
+    """
+    if not image_cache_config or not image_cache_config.get('local_cache'):
+        return tkp.accessors.open(path, **kwargs)
+    directory = (image_cache_config.get('local_cache_dir') or
+                 os.path.join(tempfile.gettempdir(), 'tkp-image-cache'))
+    max_size = image_cache_config.get('local_cache_size', 8192) * 2**20
+    return ImageCache(directory, max_size).open(path, **kwargs)
+
+
 def dump_configs_to_logdir(log_dir, job_config, pipe_config):
     if not os.path.isdir(log_dir):
         os.makedirs(log_dir)
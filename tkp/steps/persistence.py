@@ -5,17 +5,21 @@ to the database and image cache (mongodb).
 import os
 import logging
 import warnings
+import cPickle as pickle
 from tempfile import NamedTemporaryFile
 
 from pyrap.images import image as pyrap_image
 
-import tkp.accessors
 from tkp.db.database import Database
 from tkp.db.orm import DataSet, Image
+from tkp.steps.misc import open_image
 
 
 logger = logging.getLogger(__name__)
 
+# The manifest of the images of a job, in its job directory.
+MANIFEST_FILENAME = "image_manifest.pkl"
+
 def image_to_mongodb(filename, hostname, port, db):
     """Copy a file into mongodb"""
 
@@ -81,7 +85,7 @@ def create_dataset(dataset_id, description):
     return dataset.id
 
 
-def extract_metadatas(images, sigma, f):
+def extract_metadatas(images, sigma, f, image_cache_config=None):
     """
     returns the metadata extracted from the list of images.
 
@@ -89,6 +93,8 @@ def extract_metadatas(images, sigma, f):
         images: list of image urls
         sigma: used for RMS calculation, see `tkp.quality.statistics`
         f: used for RMS calculation, see `tkp.quality.statistics`
+        image_cache_config: the image_cache section of the pipeline config;
+            see `tkp.steps.misc.open_image`
 
     a list of metadata's. The metadata will be False if extraction failed.
     """
@@ -96,7 +102,10 @@ def extract_metadatas(images, sigma, f):
     for image in images:
         logger.info("Extracting metadata from %s" % image)
         try:
-            accessor = tkp.accessors.open(image)
+            # Only the metadata and the central region of the image used
+            # by rms_qc() are needed, so the pixels are read on demand,
+            # unless they are read to fill the node-local image cache.
+            accessor = open_image(image, image_cache_config, lazy=True)
         except TypeError as e:
             logging.error("Can't open image %s: %s" % (image, e))
             results.append(False)
@@ -107,6 +116,89 @@ def extract_metadatas(images, sigma, f):
     return results
 
 
+def manifest_key(image, sigma, f):
+    """
+    Key of the metadata of an image, as extracted with sigma and f, in the
+    manifest: its real path, modification time and size, or None if it can't
+    be stat()ed.
+    """
+    try:
+        status = os.stat(image)
+    except OSError:
+        return None
+    return (os.path.realpath(image), status.st_mtime, status.st_size,
+            sigma, f)
+
+
+def load_manifest(manifest_path):
+    """
+    returns the manifest stored at manifest_path: a dict of the metadata of
+    images, by manifest_key(). It is empty if there is no readable manifest.
+    """
+    try:
+        with open(manifest_path, 'rb') as f:
+            return pickle.load(f)
+    except IOError:
+        return {}
+    except Exception as e:
+        logger.warn("Ignoring unreadable image manifest %s: %s",
+                    manifest_path, e)
+        return {}
+
+
+def read_manifest(manifest_path, images, sigma, f):
+    """
+    Look up the metadata of images in the manifest at manifest_path, so that
+    only new or changed images need extract_metadatas().
+
+    args:
+        manifest_path: location of the manifest
+        images: list of image urls
+        sigma, f: used for RMS calculation, see extract_metadatas()
+    returns:
+        a list of the metadata of each of the images in the manifest, in the
+        order of images; None for those which aren't in it.
+    """
+    manifest = load_manifest(manifest_path)
+    metadatas = []
+    for image in images:
+        metadata = manifest.get(manifest_key(image, sigma, f))
+        metadatas.append(dict(metadata) if metadata else None)
+    return metadatas
+
+
+def update_manifest(manifest_path, images_metadata, sigma, f):
+    """
+    Add the metadata of images, as returned by extract_metadatas(), to the
+    manifest at manifest_path, replacing that of earlier versions of the
+    same images.
+    """
+    entries = dict((manifest_key(metadata['url'], sigma, f), dict(metadata))
+                   for metadata in images_metadata if metadata)
+    entries.pop(None, None)
+    if not entries:
+        return
+    paths = set(key[0] for key in entries)
+    manifest = dict((key, metadata) for key, metadata
+                    in load_manifest(manifest_path).iteritems()
+                    if key[0] not in paths)
+    manifest.update(entries)
+    # Write to a temporary file and rename it, so that the manifest is never
+    # left partially written.
+    manifest_file = NamedTemporaryFile(
+        dir=os.path.dirname(manifest_path) or '.', suffix=".tmp",
+        delete=False)
+    try:
+        pickle.dump(manifest, manifest_file, -1)
+        manifest_file.close()
+        os.rename(manifest_file.name, manifest_path)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        manifest_file.close()
+        os.unlink(manifest_file.name)
+        logger.warn("Failed to write image manifest %s: %s",
+                    manifest_path, e)
+
+
 def store_images(images_metadata, extraction_radius_pix, dataset_id):
     """ Add images to database.
     Note that all images in one dataset should be inserted in one go, since the
@@ -140,10 +232,15 @@ def store_images(images_metadata, extraction_radius_pix, dataset_id):
     return image_ids
 
 
-def node_steps(images, image_cache_config, sigma, f):
+def node_steps(images, image_cache_config, sigma, f, manifest_path=None):
     """
     this function executes all persistence steps that should be executed on a node.
     Note: Should only be used in a node recipe
+
+    If manifest_path is given, the metadata of images which haven't changed
+    since they were recorded in the manifest there (see update_manifest())
+    is taken from it rather than extracted again. The images are copied to
+    mongodb either way.
     """
     mongohost = image_cache_config['mongo_host']
     mongoport = image_cache_config['mongo_port']
@@ -156,5 +253,15 @@ def node_steps(images, image_cache_config, sigma, f):
     else:
         logger.info("Not copying images to mongodb")
 
-    metadatas = extract_metadatas(images, sigma, f)
-    return metadatas
+    if manifest_path:
+        metadatas = read_manifest(manifest_path, images, sigma, f)
+    else:
+        metadatas = [None] * len(images)
+    unscanned = [image for image, metadata in zip(images, metadatas)
+                 if metadata is None]
+    if len(unscanned) < len(images):
+        logger.info("metadata of %s images found in manifest" %
+                    (len(images) - len(unscanned)))
+    scanned = iter(extract_metadatas(unscanned, sigma, f, image_cache_config))
+    return [next(scanned) if metadata is None else metadata
+            for metadata in metadatas]
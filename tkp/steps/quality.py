@@ -5,8 +5,8 @@ import logging
 
 from tkp.telescope.lofar.quality import reject_check_lofar
 from tkp.accessors.lofaraccessor import LofarAccessor
-import tkp.accessors
 import tkp.db.quality
+from tkp.steps.misc import open_image
 import tkp.quality.brightsource
 import tkp.quality
 
@@ -14,7 +14,7 @@ import tkp.quality
 logger = logging.getLogger(__name__)
 
 
-def reject_check(image_path, job_config):
+def reject_check(image_path, job_config, image_cache_config=None):
     """ checks if an image passes the quality check. If not, a rejection
         tuple is returned.
 
@@ -25,11 +25,13 @@ def reject_check(image_path, job_config):
             distributed computation!
         image_path: path to image
         parset_file: parset file location with quality check parameters
+        image_cache_config: the image_cache section of the pipeline config;
+            see `tkp.steps.misc.open_image`
     Returns:
         (rejection ID, description) if rejected, else None
     """
 
-    accessor = tkp.accessors.open(image_path)
+    accessor = open_image(image_path, image_cache_config)
     # Only run LOFAR-specific QC checks on LOFAR images.
     if isinstance(accessor, LofarAccessor):
         return reject_check_lofar(
@@ -1,7 +1,15 @@
+import os
+import json
 import logging
+import tempfile
+import numpy
 import tkp.accessors
 from tkp.accessors import sourcefinder_image_from_accessor
 import tkp.accessors
+from tkp.sourcefinder.mapcache import MapCache
+from tkp.steps.misc import open_image
+from tkp.utility import memoize
+from tkp.utility.profiling import Profile
 from collections import namedtuple
 
 logger = logging.getLogger(__name__)
@@ -10,10 +18,50 @@ logger = logging.getLogger(__name__)
 ExtractionResults = namedtuple('ExtractionResults',
                                    ['sources',
                                     'rms_min',
-                                    'rms_max'])
+                                    'rms_max',
+                                    'profile'])
 
 
-def extract_sources(image_path, extraction_params):
+def get_map_cache(image_path, extraction_params):
+    """
+    Return the map cache entry for an image, or None if the map cache is
+    disabled.
+
+    args:
+        image_path: path to the image.
+        extraction_params: dictionary of source extraction parameters. The
+            cache is enabled by map_cache, and map_cache_dir and
+            map_cache_size (in MB) configure it.
+    """
+    if not extraction_params.get('map_cache', False):
+        return None
+    directory = (extraction_params.get('map_cache_dir') or
+                 os.path.join(tempfile.gettempdir(), 'tkp-map-cache'))
+    max_size = extraction_params.get('map_cache_size', 4096) * 2**20
+    return MapCache(directory, max_size).entry(image_path)
+
+
+def set_memo_cache_size(extraction_params):
+    """
+    Limit the memory used by the intermediate results memoized while
+    processing an image to memo_cache_size (in MB) from the source
+    extraction parameters; 0 or absent means no limit.
+    """
+    size = extraction_params.get('memo_cache_size', 0)
+    memoize.default_cache.max_bytes = size * 2**20 if size else None
+
+
+def log_memo_stats(data_image, image_path):
+    """Log how often the intermediate results of an image were reused."""
+    for name, stats in sorted(
+            memoize.default_cache.stats(data_image).iteritems()):
+        logger.debug("%s of image %s: %d hits, %d misses, %d recomputes, "
+                     "%d evictions, %d bytes held", name, image_path,
+                     stats['hits'], stats['misses'], stats['recomputes'],
+                     stats['evictions'], stats['bytes'])
+
+
+def extract_sources(image_path, extraction_params, image_cache_config=None):
     """
     Extract sources from an image.
 
@@ -22,19 +70,33 @@ def extract_sources(image_path, extraction_params):
         extraction_params: dictionary containing at least the detection and
             analysis threshold and the association radius, the last one a
             multiplication factor of the de Ruiter radius.
+        image_cache_config: the image_cache section of the pipeline config;
+            see tkp.steps.misc.open_image.
     returns:
         list of ExtractionResults named tuples containing source measurements,
-        min RMS value and max RMS value
+        min RMS value, max RMS value and, if the profile extraction parameter
+        is set, the report of a tkp.utility.profiling.Profile of the
+        extraction (otherwise None).
     """
     logger.info("Extracting image: %s" % image_path)
-    accessor = tkp.accessors.open(image_path)
+    set_memo_cache_size(extraction_params)
+    float32 = extraction_params.get('float32', False)
+    if float32:
+        accessor = open_image(image_path, image_cache_config,
+                              dtype=numpy.float32)
+    else:
+        accessor = open_image(image_path, image_cache_config)
+    profile = Profile() if extraction_params.get('profile', False) else None
     logger.debug("Detecting sources in image %s at detection threshold %s",
                  image_path, extraction_params['detection_threshold'])
     data_image = sourcefinder_image_from_accessor(accessor,
                     margin=extraction_params['margin'],
                     radius=extraction_params['extraction_radius_pix'],
                     back_size_x=extraction_params['back_size_x'],
-                    back_size_y=extraction_params['back_size_y'])
+                    back_size_y=extraction_params['back_size_y'],
+                    float32=float32,
+                    map_cache=get_map_cache(image_path, extraction_params),
+                    profile=profile)
 
     logger.debug("Employing margin: %s extraction radius: %s deblend_nthresh: %s",
                  extraction_params['margin'],
@@ -54,10 +116,41 @@ def extract_sources(image_path, extraction_params):
     ew_sys_err = extraction_params['ew_sys_err']
     ns_sys_err = extraction_params['ns_sys_err']
     serialized = [r.serialize(ew_sys_err, ns_sys_err) for r in results]
+    rms_min = float(data_image.rmsmap.min())
+    rms_max = float(data_image.rmsmap.max())
+    log_memo_stats(data_image, image_path)
     return ExtractionResults(sources=serialized,
-                             rms_min=float(data_image.rmsmap.min()),
-                             rms_max=float(data_image.rmsmap.max())
+                             rms_min=rms_min,
+                             rms_max=rms_max,
+                             profile=profile and profile.report()
                              )
 
 
+def dump_profiles(log_dir, timestep, urls, extraction_results):
+    """
+    Write the profiles of the source extraction of a timestep, if any, to
+    log_dir as JSON.
+
+    args:
+        log_dir: directory to write to.
+        timestep: the timestep (datetime) of the images.
+        urls: the urls of the images.
+        extraction_results: the ExtractionResults of each image.
+    returns:
+        the path of the file written, or None if there were no profiles.
+    """
+    profiles = dict((url, results.profile) for url, results
+                    in zip(urls, extraction_results) if results.profile)
+    if not profiles:
+        return None
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    path = os.path.join(log_dir, 'source_extraction_profile_%s.json' %
+                        timestep.strftime('%Y%m%dT%H%M%S'))
+    with open(path, 'w') as f:
+        json.dump({'timestep': timestep.isoformat(), 'images': profiles}, f,
+                  indent=1, sort_keys=True)
+    return path
+
+
 
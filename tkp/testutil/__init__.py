@@ -4,6 +4,7 @@ core pipeline functionality.
 """
 import contextlib
 import sys
+import time
 
 @contextlib.contextmanager
 def nostderr():
@@ -14,3 +15,19 @@ def nostderr():
     sys.stderr = Devnull()
     yield
     sys.stderr = savestderr
+
+
+class Timer(object):
+    """Context manager which measures the wall-clock time taken by its
+    block, for benchmarks to report.
+
+    Wall-clock times vary too much between machines, and with load, for
+    tests to assert anything about them: benchmarks should log them, and
+    check that the implementations they compare agree.
+    """
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.start
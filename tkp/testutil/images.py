@@ -0,0 +1,69 @@
+"""
+Synthetic images for use in testing.
+"""
+import numpy
+import pyfits
+
+from tkp.sourcefinder.gaussian import gaussian
+from tkp.utility.coordinates import WCS
+
+
+# Restoring beam of the synthetic images, in pixels.
+beam = (2.5, 2., 0.5)
+
+
+def equatorial_wcs():
+    wcs = WCS()
+    wcs.cdelt = (-0.009722222222222, 0.009722222222222)
+    wcs.crota = (0.0, 0.0)
+    wcs.crpix = (257, 257)
+    wcs.crval = (15.0, 0.0)
+    wcs.ctype = ('RA---SIN', 'DEC--SIN')
+    wcs.cunit = ('deg', 'deg')
+    return wcs
+
+
+def noise_with_sources(shape, nsources, seed=0, background=0.0, border=10):
+    """A map of Gaussian noise with some bright point sources.
+
+    Args:
+
+        shape (tuple): shape of the map.
+
+        nsources (int): number of sources.
+
+    Kwargs:
+
+        seed (int): seed for the random numbers.
+
+        background (float): mean of the noise.
+
+        border (int): width of the border, along the edges of the map,
+            which is kept clear of the centres of sources.
+    """
+    random = numpy.random.RandomState(seed)
+    data = random.normal(background, 0.5, shape)
+    x, y = numpy.indices(shape)
+    for i in range(nsources):
+        x0 = random.uniform(border, shape[0] - border)
+        y0 = random.uniform(border, shape[1] - border)
+        peak = random.uniform(10, 500)
+        box = (slice(max(0, int(x0) - 10), int(x0) + 10),
+               slice(max(0, int(y0) - 10), int(y0) + 10))
+        data[box] += gaussian(peak, x0, y0, beam[0], beam[1], beam[2])(
+            x[box], y[box])
+    return data
+
+
+def write_cube(filename, shape):
+    """Write a FITS image of random data with the given shape."""
+    hdu = pyfits.PrimaryHDU(
+        numpy.random.RandomState(0).normal(size=shape).astype(numpy.float32))
+    for key, value in (('CRVAL1', 350.), ('CRVAL2', 58.), ('CRPIX1', 64.),
+                       ('CRPIX2', 64.), ('CDELT1', -0.01), ('CDELT2', 0.01),
+                       ('CTYPE1', 'RA---SIN'), ('CTYPE2', 'DEC--SIN'),
+                       ('CTYPE3', 'FREQ'), ('CRVAL3', 1.5e8),
+                       ('CDELT3', 2e5), ('BMAJ', 0.05), ('BMIN', 0.04),
+                       ('BPA', 10.), ('DATE-OBS', '2013-01-02T03:04:05')):
+        hdu.header.update(key, value)
+    hdu.writeto(filename)
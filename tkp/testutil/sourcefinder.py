@@ -0,0 +1,40 @@
+"""
+Helpers for testing the sourcefinder.
+"""
+import numpy
+try:
+    import ndimage
+except ImportError:
+    from scipy import ndimage
+
+from tkp.sourcefinder import extract
+from tkp.sourcefinder.image import ImageData, STRUCTURING_ELEMENT
+from tkp.testutil.images import beam, equatorial_wcs
+
+
+def catalogue(results):
+    """Detections as a sorted array of (x, y, peak, flux, ra, dec)"""
+    return numpy.array(sorted(
+        (det.x.value, det.y.value, det.peak.value, det.flux.value,
+         det.ra.value, det.dec.value) for det in results
+    ))
+
+
+def islands(data, nthresh, mincont=0.005):
+    """All the islands of an image, as made by ImageData._pyse()"""
+    imagedata = ImageData(data, beam, equatorial_wcs())
+    detection = 10 * imagedata.rmsmap
+    analysis = 3 * imagedata.rmsmap
+    labels, labelled_data = imagedata.label_islands(detection, analysis)
+    slices = ndimage.find_objects(labelled_data)
+    result = []
+    for label in labels:
+        chunk = slices[label - 1]
+        selected = numpy.where(labelled_data[chunk] == label,
+                               imagedata.data_bgsubbed[chunk].data,
+                               -extract.BIGNUM)
+        result.append(extract.Island(
+            selected, imagedata.rmsmap[chunk], chunk,
+            (analysis[chunk] / imagedata.rmsmap[chunk]).max(),
+            detection[chunk], beam, nthresh, mincont, STRUCTURING_ELEMENT))
+    return result
@@ -6,6 +6,7 @@ General purpose astronomical coordinate handling routines.
 
 import sys
 import math
+import numpy
 import pywcs
 import logging
 import datetime
@@ -683,3 +684,51 @@ class WCS(object):
         if math.isnan(x) or math.isnan(y):
             raise RuntimeError("Pixel position is not a number")
         return x, y
+
+    def all_p2s(self, pixpos):
+        """
+        Pixel to Spatial coordinate conversion for many positions at once.
+
+        Args:
+            pixpos (numpy.ndarray): N x 2 array of [x, y] pixel positions
+
+        Returns:
+            (numpy.ndarray): N x 2 array of [ra, dec] positions. Unlike
+            p2s(), no exception is raised for invalid positions; they are
+            returned as NaN instead.
+        """
+        return self._all_transform(self.wcs.wcs_pix2sky, pixpos)
+
+    def all_s2p(self, spatialpos):
+        """
+        Spatial to Pixel coordinate conversion for many positions at once.
+
+        Args:
+            spatialpos (numpy.ndarray): N x 2 array of [ra, dec] spatial
+                positions
+
+        Returns:
+            (numpy.ndarray): N x 2 array of [x, y] pixel positions. Unlike
+            s2p(), no exception is raised for invalid positions; they are
+            returned as NaN instead.
+        """
+        return self._all_transform(self.wcs.wcs_sky2pix, spatialpos)
+
+    def _all_transform(self, transform, positions):
+        positions = numpy.asarray(positions, dtype=numpy.float64)
+        result = numpy.empty((len(positions), 2))
+        if not len(positions):
+            return result
+        try:
+            result[:, 0], result[:, 1] = transform(
+                positions[:, 0], positions[:, 1], self.ORIGIN)
+        except RuntimeError:
+            # wcslib gave up on the whole lot because of some invalid
+            # positions; convert them one at a time to find out which.
+            for i, (first, second) in enumerate(positions):
+                try:
+                    [result[i, 0]], [result[i, 1]] = transform(
+                        [first], [second], self.ORIGIN)
+                except RuntimeError:
+                    result[i] = numpy.nan
+        return result
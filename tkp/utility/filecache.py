@@ -0,0 +1,144 @@
+"""
+A directory of cached files, limited in size.
+
+This is the on-disk store shared by the caches of decoded images
+(:mod:`tkp.accessors.imagecache`) and of background and RMS maps
+(:mod:`tkp.sourcefinder.mapcache`). It may be shared by several processes:
+files are written to a temporary name and renamed into place, so that
+other processes never see a partially written file, and files which
+disappear while they are being used are simply treated as missing.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache(object):
+    """A directory of cached entries, each stored in one or more files.
+
+    The files of an entry are named by its key and one of the suffixes of
+    the cache. The modification time of an entry marks when it was last
+    used: the least recently used entries are discarded to keep the cache
+    within its maximum size.
+
+    Args:
+
+        directory (str): where to store the files. Created if necessary.
+
+        max_size (int): maximum total size of the cached files, in bytes.
+    """
+    # The suffixes of the files of an entry; every entry has a file with the
+    # first of them.
+    suffixes = ()
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def write(self, key, suffix, write):
+        """Write a file of the entry under key.
+
+        Args:
+
+            write (function): writes the contents of the file to the file
+                object it is passed.
+        """
+        f = tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False)
+        try:
+            write(f)
+            f.close()
+            os.rename(f.name, self.path(key, suffix))
+        except:
+            f.close()
+            os.unlink(f.name)
+            raise
+
+    def touch(self, key):
+        """Mark the entry under key as recently used.
+
+        Raises OSError if it isn't cached.
+        """
+        os.utime(self.path(key, self.suffixes[0]), None)
+
+    def size(self):
+        """Total size of the cached files, in bytes"""
+        return sum(size for key, size, mtime in self._entries())
+
+    def evict(self):
+        """Discard the least recently used entries, until the cache is
+        within its maximum size."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for key, size, mtime in entries)
+        for key, size, mtime in entries:
+            if total <= self.max_size:
+                break
+            logger.debug("Evicting %s from %s", key, self.directory)
+            for suffix in reversed(self.suffixes):
+                try:
+                    os.unlink(self.path(key, suffix))
+                except OSError:
+                    # Already removed by another process.
+                    pass
+            total -= size
+
+    def _entries(self):
+        """(key, size, modification time) of every cached entry"""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(self.suffixes[0]):
+                continue
+            key = filename[:-len(self.suffixes[0])]
+            try:
+                status = os.stat(self.path(key, self.suffixes[0]))
+            except OSError:
+                continue
+            size = status.st_size
+            for suffix in self.suffixes[1:]:
+                try:
+                    size += os.stat(self.path(key, suffix)).st_size
+                except OSError:
+                    # Not yet written, or its writer failed.
+                    pass
+            entries.append((key, size, status.st_mtime))
+        return entries
+
+
+def file_status(path):
+    """The modification time and size of the file at path, for keying cache
+    entries.
+
+    A CASA image is a directory, the modification time of which doesn't
+    change when the tables inside it are rewritten: for a directory, this is
+    the modification time and size of every file in it.
+    """
+    if not os.path.isdir(path):
+        status = os.stat(path)
+        return [(status.st_mtime, status.st_size)]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            status = os.stat(filepath)
+            files.append((os.path.relpath(filepath, path), status.st_mtime,
+                          status.st_size))
+    return files
+
+
+def digest(*values):
+    """A key for the cache, made from values"""
+    return hashlib.sha1(repr(values)).hexdigest()
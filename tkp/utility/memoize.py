@@ -3,9 +3,126 @@
 #
 # Memoization.
 #
-from weakref import WeakKeyDictionary
+import collections
+from weakref import WeakKeyDictionary, ref
 from functools import update_wrapper
 
+import numpy
+
+
+def nbytes(value):
+    """Memory held by a memoized value, counting the arrays it contains."""
+    if isinstance(value, numpy.ma.MaskedArray):
+        mask = numpy.ma.getmask(value)
+        return value.data.nbytes + (
+            mask.nbytes if mask is not numpy.ma.nomask else 0)
+    elif isinstance(value, numpy.ndarray):
+        return value.nbytes
+    elif isinstance(value, dict):
+        return sum(nbytes(item) for item in value.itervalues())
+    elif isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    return 0
+
+
+class MemoCache(object):
+    """Book-keeping for the values held by all Memoize decorators.
+
+    This tracks the memory held by each memoized value, and if max_bytes is
+    set, forgets the least recently used values to keep the total within
+    it; they are recalculated when they are next needed. The value being
+    stored is never forgotten straight away, even if it alone is larger
+    than max_bytes.
+
+    It also counts, for each instance and memoized method:
+
+        - hits: values returned from the cache;
+        - misses: values calculated for the first time;
+        - recomputes: values calculated again, having been forgotten;
+        - evictions: values forgotten to stay within max_bytes.
+
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # (Memoize, weak reference to instance, bytes), keyed by
+        # (id(Memoize), id(instance)), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._counters = WeakKeyDictionary()
+
+    def _counter(self, memoize, instance):
+        counters = self._counters.setdefault(instance, {})
+        if memoize.__name__ not in counters:
+            counters[memoize.__name__] = collections.Counter(
+                hits=0, misses=0, recomputes=0, evictions=0)
+        return counters[memoize.__name__]
+
+    def hit(self, memoize, instance):
+        """Count a value returned from the cache, and mark it as used."""
+        key = (id(memoize), id(instance))
+        if key in self._entries:
+            self._entries[key] = self._entries.pop(key)
+        self._counter(memoize, instance)['hits'] += 1
+
+    def add(self, memoize, instance, value):
+        """Account for a newly calculated value."""
+        counter = self._counter(memoize, instance)
+        if counter['misses']:
+            counter['recomputes'] += 1
+        else:
+            counter['misses'] += 1
+        key = (id(memoize), id(instance))
+        self.remove(memoize, instance)
+
+        def forget(reference, key=key):
+            # The instance, and with it the value, has gone.
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[2]
+        size = nbytes(value)
+        self._entries[key] = (memoize, ref(instance, forget), size)
+        self.nbytes += size
+        self.evict(keep=key)
+
+    def remove(self, memoize, instance):
+        """Account for a value which has been forgotten."""
+        entry = self._entries.pop((id(memoize), id(instance)), None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def evict(self, keep=None):
+        """Forget the least recently used values until within max_bytes."""
+        if self.max_bytes is None:
+            return
+        for key in list(self._entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            memoize, reference, size = self._entries[key]
+            instance = reference()
+            if instance is None:
+                continue
+            memoize.delete(instance)
+            self._counter(memoize, instance)['evictions'] += 1
+
+    def stats(self, instance):
+        """
+        The counters of each method memoized for an instance, and the bytes
+        held by its value, by name.
+        """
+        result = {}
+        for name, counter in self._counters.get(instance, {}).iteritems():
+            result[name] = dict(counter, bytes=0)
+        for memoize, reference, size in self._entries.itervalues():
+            if reference() is instance:
+                result[memoize.__name__]['bytes'] = size
+        return result
+
+
+default_cache = MemoCache()
+
 
 class Memoize(object):
     """Decorator to cache the results of methods.
@@ -17,17 +134,23 @@ class Memoize(object):
             return self.__grids()
         grids = property(fget=_grids, fdel=_grids.delete)
 
+    The results are accounted for in a MemoCache, by default
+    default_cache, which may forget them to limit the memory they use.
     """
 
-    def __init__(self, funct):
+    def __init__(self, funct, cache=default_cache):
         self.funct = funct
         self.memo = WeakKeyDictionary()
+        self.cache = cache
         update_wrapper(self, self.funct)
 
     def __call__(self, instance):
-        if instance not in self.memo:
-            self.memo[instance] = self.funct(instance)
-        return self.memo[instance]
+        if instance in self.memo:
+            self.cache.hit(self, instance)
+            return self.memo[instance]
+        value = self.memo[instance] = self.funct(instance)
+        self.cache.add(self, instance, value)
+        return value
 
     def delete(self, instance):
         """Forget a memoized value"""
@@ -35,3 +158,5 @@ class Memoize(object):
             del(self.memo[instance])
         except KeyError:
             pass
+        else:
+            self.cache.remove(self, instance)
@@ -0,0 +1,212 @@
+#
+# LOFAR Transients Key Project
+#
+# Profiling the stages of processing an image.
+#
+import os
+import time
+import resource
+import functools
+import contextlib
+
+
+def island_bucket(islands):
+    """
+    Label for a range of island counts: '0', '1-9', '10-99', '100-999', ...
+    """
+    if islands < 1:
+        return '0'
+    lower = 10 ** (len(str(int(islands))) - 1)
+    return '%d-%d' % (lower, 10 * lower - 1)
+
+
+# The largest peak resident memory of this process before it was last reset.
+_peak_before_reset = [0]
+
+
+def _proc_status(field):
+    """
+    A memory field of /proc/self/status, in bytes, or None if it can't be
+    read (other than on Linux).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    # The fields are in kilobytes.
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def current_rss():
+    """Resident memory of this process, in bytes, or None if unknown."""
+    return _proc_status('VmRSS')
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process, in bytes, since reset_peak_rss()
+    last succeeded, or since the process started.
+    """
+    peak = _proc_status('VmHWM')
+    if peak is None:
+        # ru_maxrss is in kilobytes on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+def lifetime_peak_rss():
+    """
+    Peak resident memory of this process since it started, in bytes, even
+    if reset_peak_rss() has been called since.
+    """
+    return max(_peak_before_reset[0], peak_rss(),
+               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of this process (see peak_rss()) to its
+    current resident memory. This is only possible on Linux, by writing 5
+    to /proc/self/clear_refs.
+
+    Returns:
+
+        (bool): whether the peak was reset.
+    """
+    peak = lifetime_peak_rss()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return False
+    _peak_before_reset[0] = peak
+    return True
+
+
+def cpu_time():
+    """User and system CPU time used by this process, in seconds."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Profile(object):
+    """Wall time, CPU time and peak memory of each stage of processing.
+
+    Each stage is timed with::
+
+        with profile.stage('fit', islands=len(island_list)):
+            ...
+
+    Stages may be nested, and the time of a stage excludes that of those
+    nested within it. Stages given an island count are also totalled by
+    island_bucket().
+
+    The memory of a stage is measured, where possible, as:
+
+        - peak_rss: the peak resident memory of the process during the
+          stage, including any nested stages. The peak is reset at the
+          start of each stage, which needs Linux.
+        - rss_increase: the resident memory of the process at the end of
+          the stage, less that at the start; negative if the stage freed
+          memory. This needs /proc/self/status.
+        - max_rss_growth: how much the stage raised the peak resident
+          memory the process has had since it started, if that can't be
+          reset. This is zero for any stage which uses less memory than an
+          earlier one, so is only a guide in a fresh process.
+
+    The totals of each are the largest of any call of the stage.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.islands = {}
+        self._nested = []
+
+    @staticmethod
+    def _add(totals, wall, cpu, memory):
+        totals['calls'] = totals.get('calls', 0) + 1
+        totals['wall'] = totals.get('wall', 0.) + wall
+        totals['cpu'] = totals.get('cpu', 0.) + cpu
+        for key, value in memory.iteritems():
+            totals[key] = max(totals.get(key, value), value)
+
+    @contextlib.contextmanager
+    def stage(self, name, islands=None):
+        """Time a stage called name, optionally processing some islands."""
+        # Resetting the peak memory loses that of the enclosing stage so
+        # far, which is kept with the time spent in stages nested in it.
+        if self._nested:
+            self._nested[-1][2] = max(self._nested[-1][2], peak_rss())
+        self._nested.append([0., 0., 0])
+        start_rss = current_rss()
+        start_peak = lifetime_peak_rss()
+        resettable = reset_peak_rss()
+        start_wall, start_cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.time() - start_wall
+            cpu = cpu_time() - start_cpu
+            end_rss = current_rss()
+            nested_wall, nested_cpu, nested_peak = self._nested.pop()
+            memory = {}
+            if resettable:
+                memory['peak_rss'] = max(peak_rss(), nested_peak)
+            else:
+                memory['max_rss_growth'] = lifetime_peak_rss() - start_peak
+            if start_rss is not None and end_rss is not None:
+                memory['rss_increase'] = end_rss - start_rss
+            if self._nested:
+                self._nested[-1][0] += wall
+                self._nested[-1][1] += cpu
+                self._nested[-1][2] = max(self._nested[-1][2],
+                                          memory.get('peak_rss', 0))
+            wall, cpu = wall - nested_wall, cpu - nested_cpu
+            self._add(self.stages.setdefault(name, {}), wall, cpu, memory)
+            if islands is not None:
+                self._add(self.islands.setdefault(name, {}).setdefault(
+                    island_bucket(islands), {}), wall, cpu, memory)
+
+    def report(self):
+        """
+        The totals of each stage, as a dict suitable for JSON:
+
+            - stages: {stage name: totals};
+            - islands: {stage name: {island_bucket(): totals}};
+            - peak_rss: peak resident memory of the process since it
+              started, in bytes.
+
+        where totals are a dict of the number of calls, the wall and cpu
+        times (s) and the memory measurements (bytes) described above.
+        """
+        return {'stages': self.stages, 'islands': self.islands,
+                'peak_rss': lifetime_peak_rss()}
+
+
+@contextlib.contextmanager
+def _no_stage():
+    yield
+
+
+def stage(profile, name, islands=None):
+    """Profile.stage() of profile, or a no-op if profile is None."""
+    if profile is None:
+        return _no_stage()
+    return profile.stage(name, islands)
+
+
+def profiled(name):
+    """
+    Decorator profiling a method as stage name of the profile attribute of
+    its instance, if that is not None.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with stage(self.profile, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator